@@ -0,0 +1,119 @@
+# bench/bench_asset_log.py
+"""
+Upload latency of the dropbox_upload handler with the file_assets insert on
+the request path (old `_sb_insert`) vs written behind by lib.asset_log, then
+an outage: Supabase refuses connections for `--outage` uploads, comes back,
+and every row must land exactly once.
+
+The fake PostgREST charges `--latency-ms` per call, plus a `--spike-ms` stall
+on `--spike-pct` percent of writes (lock waits, trigger work on a busy
+table) - what drives the old p99. The dedup lookup (a read) stays on the
+request path in both runs.
+
+    python -m bench.bench_asset_log [--uploads 300] [--outage 100]
+"""
+import argparse, json, logging, os, random, statistics, tempfile, time
+
+os.environ.update(DROPBOX_APP_KEY="k", DROPBOX_APP_SECRET="s", DROPBOX_REFRESH_TOKEN="r",
+                  SUPABASE_URL="http://fake-supabase", SUPABASE_SERVICE_ROLE_KEY="x",
+                  ASSET_LOG_JOURNAL_DIR=tempfile.mkdtemp(prefix="asset_log_bench_"))
+
+import azure.functions as func
+import httpx
+
+import lib.dropbox_client as dc
+from bench.fake_dropbox import FakeDropbox
+from bench.fake_postgrest import FILE_ASSETS_COLUMNS, FILE_ASSETS_REQUIRED, FakePostgrest
+from lib import asset_log, rate_limit, supabase
+
+META = {"owner_name": "Sunset Capital", "owner_id": 101, "property_name": "Sunset Villas",
+        "property_id": 201, "unit_name": "Unit 4B", "unit_id": 301}
+
+
+class _Link:
+    """Latency, write spikes and an on/off switch in front of the fake."""
+
+    def __init__(self, pg: FakePostgrest, latency_ms: float, spike_ms: float, spike_pct: float):
+        self.pg, self.down = pg, False
+        self.latency, self.spike, self.spike_pct = latency_ms / 1000, spike_ms / 1000, spike_pct / 100
+
+    def transport(self) -> httpx.MockTransport:
+        def handler(request):
+            if self.down:
+                raise httpx.ConnectError("connection refused", request=request)
+            spike = request.method != "GET" and random.random() < self.spike_pct
+            time.sleep(self.latency + (self.spike if spike else 0))
+            return self.pg.handle(request)
+        return httpx.MockTransport(handler)
+
+
+def _request(i: int):
+    body = os.urandom(1024) + i.to_bytes(4, "big")
+    return func.HttpRequest("POST", "/api/dropbox_upload", body=body, headers={
+        "content-type": "application/octet-stream", "x-upload-entity-type": "UnitPhoto",
+        "x-upload-original-filename": f"photo-{i}.jpg", "x-upload-meta": json.dumps(META)})
+
+
+def _run(handler, start: int, n: int):
+    lat = []
+    for i in range(start, start + n):
+        t0 = time.perf_counter()
+        res = handler.main(_request(i))
+        lat.append((time.perf_counter() - t0) * 1000)
+        assert res.status_code == 200, res.get_body()
+    return sorted(lat)
+
+
+def _report(name, lat):
+    print(f"{name:<28} mean={statistics.mean(lat):6.1f}ms p50={lat[len(lat)//2]:6.1f}ms "
+          f"p99={lat[int(len(lat)*0.99)-1]:6.1f}ms")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--uploads", type=int, default=300)
+    ap.add_argument("--outage", type=int, default=100)
+    ap.add_argument("--latency-ms", type=float, default=15)
+    ap.add_argument("--spike-ms", type=float, default=250)
+    ap.add_argument("--spike-pct", type=float, default=3)
+    a = ap.parse_args()
+    rate_limit.configure(supabase.NAMESPACE, retries=3, base_delay=0.01, max_delay=0.05, concurrency=16)
+    logging.disable(logging.ERROR)  # the outage phase logs every failed lookup/flush
+
+    fake = FakeDropbox(rtt_ms=5, connect_ms=0, token_ms=0)
+    dc.create_session = lambda *args, **kw: fake.session()
+    pg = FakePostgrest()
+    link = _Link(pg, a.latency_ms, a.spike_ms, a.spike_pct)
+    supabase.reset_client(link.transport())
+
+    import dropbox_upload as handler
+    log = asset_log._log
+    rows = pg.table("file_assets", columns=FILE_ASSETS_COLUMNS, required=FILE_ASSETS_REQUIRED)
+
+    # before: the insert sits on the request path
+    handler.asset_log = type("Sync", (), {"record": staticmethod(lambda row: supabase.insert("file_assets", row)),
+                                         "upload_row": staticmethod(asset_log.upload_row)})
+    _report("before: insert per upload", _run(handler, 0, a.uploads))
+    handler.asset_log = asset_log
+    rows.clear()
+
+    # after: written behind
+    _report("after: write-behind", _run(handler, a.uploads, a.uploads))
+
+    # outage: uploads keep answering, rows go to the journal
+    link.down = True
+    _report("after: Supabase down", _run(handler, 2 * a.uploads, a.outage))
+    log.flush()
+    journaled = sum(1 for f in os.listdir(log.journal_dir) for _ in open(os.path.join(log.journal_dir, f)))
+    link.down = False
+
+    t0 = time.perf_counter()
+    log.close()
+    ids = [r["log_id"] for r in rows]
+    print(f"rows in journal after outage: {journaled}; replay + shutdown flush {time.perf_counter() - t0:.2f}s")
+    print(f"file_assets rows: {len(rows)} (expected {a.uploads + a.outage}), duplicates: {len(ids) - len(set(ids))}, "
+          f"bulk writes: {pg.calls['POST file_assets']}")
+
+
+if __name__ == "__main__":
+    main()
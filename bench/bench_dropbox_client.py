@@ -0,0 +1,70 @@
+# bench/bench_dropbox_client.py
+"""
+Per-request latency of a handler's Dropbox call: a fresh SDK client per
+invocation (old behaviour) vs the pooled DropboxClient.
+
+    python -m bench.bench_dropbox_client [--requests 200] [--threads 8]
+"""
+import argparse, os, statistics, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+import dropbox
+import dropbox.dropbox_client as sdk
+
+import lib.dropbox_client as dc
+from bench.fake_dropbox import FakeDropbox
+
+PATH = "/Altus_Empire_Command_Center"
+
+
+def _fresh_per_request(fake: FakeDropbox):
+    # what get_dbx() used to do on every invocation
+    dbx = dropbox.Dropbox(app_key="k", app_secret="s", oauth2_refresh_token="r", timeout=30)
+    dbx.files_get_metadata(PATH)
+
+
+def _pooled(fake: FakeDropbox):
+    dc.DropboxClient.from_env().dbx.files_get_metadata(PATH)
+
+
+def _run(name, fn, fake, n, threads):
+    lat = []
+    lock = threading.Lock()
+
+    def one(_):
+        t0 = time.perf_counter()
+        fn(fake)
+        with lock:
+            lat.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(threads) as ex:
+        list(ex.map(one, range(n)))
+    wall = time.perf_counter() - t0
+    lat.sort()
+    print(f"{name:<22} mean={statistics.mean(lat):7.1f}ms p50={lat[len(lat)//2]:7.1f}ms "
+          f"p95={lat[int(len(lat)*0.95)-1]:7.1f}ms  wall={wall:5.2f}s  token_calls={fake.calls['oauth2/token']}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--rtt-ms", type=float, default=20)
+    ap.add_argument("--connect-ms", type=float, default=60)
+    ap.add_argument("--token-ms", type=float, default=80)
+    a = ap.parse_args()
+
+    os.environ.update(DROPBOX_APP_KEY="k", DROPBOX_APP_SECRET="s", DROPBOX_REFRESH_TOKEN="r")
+
+    for name, fn in (("before: per-request", _fresh_per_request), ("after: pooled client", _pooled)):
+        fake = FakeDropbox(rtt_ms=a.rtt_ms, connect_ms=a.connect_ms, token_ms=a.token_ms)
+        fake.folders.add(PATH.lower())
+        sdk.create_session = lambda *args, **kw: fake.session()
+        dc.create_session = lambda *args, **kw: fake.session()
+        dc.DropboxClient.reset_shared()
+        _run(name, fn, fake, a.requests, a.threads)
+
+
+if __name__ == "__main__":
+    main()
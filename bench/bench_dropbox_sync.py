@@ -0,0 +1,255 @@
+# bench/bench_dropbox_sync.py
+"""
+Dropbox -> file_assets sync against the fakes. A portfolio of `--files`
+uploaded files (rows without Dropbox ids, as the upload endpoints write
+them) is changed directly in Dropbox: `--added` new files, a unit folder
+moved to another property, `--renamed` files renamed and `--deleted`
+deleted. Then `--notifications` signed webhook POSTs arrive at once from
+16 threads.
+
+Reported: the notifications vs the pulls they caused, the Dropbox and
+PostgREST calls one pull costs next to a full rescan of ROOT, and checks
+that the live file_assets rows match the Dropbox tree, that moved and
+renamed files keep their asset ids, and that replaying the pull from its
+starting cursor changes nothing. The fake PostgREST implements the V17
+RPCs in Python, with V19's id checks and the file_assets foreign keys.
+
+    python -m bench.bench_dropbox_sync [--files 3000] [--notifications 300]
+"""
+import argparse, hashlib, hmac, json, logging, os, random, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+os.environ.update(DROPBOX_APP_KEY="k", DROPBOX_APP_SECRET="webhook-secret", DROPBOX_REFRESH_TOKEN="r",
+                  SUPABASE_URL="http://fake-supabase", SUPABASE_SERVICE_ROLE_KEY="x")
+
+import azure.functions as func
+import httpx
+
+import lib.dropbox_client as dc
+from bench.fake_dropbox import FakeDropbox
+from bench.fake_postgrest import FakePostgrest
+from lib import dropbox_sync, supabase
+from lib.pathmap import ROOT, ids_from_path, unit_root
+
+import functions.dropbox_sync_tick as tick
+import functions.dropbox_webhook as webhook
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _rpcs(pg: FakePostgrest, ids: dict):
+    """`ids`: the owner and property ids that exist, and {unit id: property id}."""
+    state, assets = pg.tables[dropbox_sync.STATE], pg.tables["file_assets"]
+
+    @pg.rpc("dropbox_sync_request")
+    def request(args):
+        row = next((r for r in state if r["root"] == args["p_root"]), None)
+        if row is None:
+            row = {"root": args["p_root"], "notifications": 0, "deferred": [], "changes": 0}
+            state.append(row)
+        row["requested_at"] = _now().isoformat()
+        row["notifications"] += 1
+        return row["notifications"]
+
+    @pg.rpc("dropbox_sync_claim")
+    def claim(args):
+        now = _now()
+        row = next((r for r in state if r["root"] == args["p_root"]), None)
+        if row is None:
+            row = {"root": args["p_root"], "notifications": 0, "deferred": [], "changes": 0}
+            state.append(row)
+        at = lambda k: datetime.fromisoformat(row[k]) if row.get(k) else datetime.min.replace(tzinfo=timezone.utc)
+        ago = lambda k: now - timedelta(seconds=args[k])
+        if row.get("lease_expires_at") and at("lease_expires_at") >= now:
+            return []
+        notified = at("requested_at") > at("pulled_at") and (
+            at("requested_at") <= ago("p_debounce_seconds") or at("pulled_at") <= ago("p_max_wait_seconds"))
+        if not (notified or at("pulled_at") <= ago("p_poll_seconds")):
+            return []
+        row.update(lease_owner=args["p_owner"], claimed_at=now.isoformat(),
+                   lease_expires_at=(now + timedelta(seconds=args["p_lease_seconds"])).isoformat())
+        return [dict(row)]
+
+    @pg.rpc("file_assets_apply_changes")
+    def apply(args):
+        files = []
+        for f in args["p_files"]:
+            f = dict(f)
+            if f["property_id"] not in ids["property_id"]:
+                f["property_id"] = None
+            if ids["unit_id"].get(f["unit_id"], "none") != f["property_id"]:
+                f["unit_id"] = None
+            if f["owner_id"] not in ids["owner_id"]:
+                f["owner_id"] = None
+            if f["entity_type"] in ("unit", "property", "owner"):
+                kind = next((k for k in ("unit_id", "property_id", "owner_id") if f[k] is not None), None)
+                f.update(entity_type=kind[:-3] if kind else "dropbox", entity_id=f[kind] if kind else 0)
+            files.append(f)
+        if any(f[k] is not None and f[k] not in ids[k] for f in files for k in ("property_id", "unit_id")):
+            return httpx.Response(409, json={"code": "23503", "message": "violates foreign key constraint"})
+        n = {"deleted": 0, "updated": 0, "created": 0}
+        for d in args["p_deleted"]:
+            for r in assets:
+                p = r["dropbox_path_lower"]
+                if r.get("deleted_at") is None and (p == d or p.startswith(d + "/")):
+                    r["deleted_at"] = _now().isoformat()
+                    n["deleted"] += 1
+        by_id = {}
+        for r in assets:
+            by_id.setdefault(r.get("dropbox_id"), []).append(r)
+        by_path = {}
+        for r in assets:
+            if r.get("dropbox_id") is None:
+                by_path.setdefault(r["dropbox_path_lower"], []).append(r)
+        for f in files:
+            patch = {"dropbox_rev": f["rev"], "size_bytes": f["size"], "deleted_at": None}
+            hits = by_id.get(f["dropbox_id"], [])
+            for r in hits:
+                r.update(patch, dropbox_path=f["path"], dropbox_path_lower=f["path"].lower())
+            paired = by_path.pop(f["path_lower"], [])
+            for r in paired:
+                r.update(patch, dropbox_id=f["dropbox_id"])
+            n["updated"] += len(hits) + len(paired)
+            if not hits and not paired:
+                row = {"id": len(assets) + 1, "entity_type": f["entity_type"], "entity_id": f["entity_id"],
+                       "property_id": f["property_id"], "unit_id": f["unit_id"], "original_filename": f["name"],
+                       "stored_filename": f["name"], "dropbox_path": f["path"], "dropbox_path_lower": f["path_lower"],
+                       "dropbox_id": f["dropbox_id"], "dropbox_rev": f["rev"], "size_bytes": f["size"],
+                       "uploaded_by": "dropbox_sync", "deleted_at": None}
+                assets.append(row)
+                by_id[f["dropbox_id"]] = [row]
+                n["created"] += 1
+        return n
+
+
+def _portfolio(fake, files: int) -> list:
+    rows, units = [], []
+    for o in range(5):
+        for p in range(10):
+            for u in range(12):
+                units.append(unit_root(f"Owner {o}", 100 + o, f"Property {p}", 1000 * o + p, f"Unit {u}",
+                                       100000 * o + 100 * p + u))
+    for i in range(files):
+        path = f"{units[i % len(units)]}/01_Photos/photo-{i}.jpg"
+        fake.put(path, b"x")
+        ids = ids_from_path(path)
+        rows.append({"id": i + 1, "entity_type": "unit", "entity_id": ids["unit_id"], "unit_id": ids["unit_id"],
+                     "property_id": ids["property_id"], "original_filename": path.rsplit("/", 1)[-1],
+                     "stored_filename": path.rsplit("/", 1)[-1], "dropbox_path": path,
+                     "dropbox_path_lower": path.lower(), "uploaded_by": "upload", "deleted_at": None})
+    return rows, units
+
+
+def _post(body: bytes, signature: str):
+    return webhook.main(func.HttpRequest("POST", "/api/dropbox_webhook", body=body,
+                                         headers={"x-dropbox-signature": signature}))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=3000)
+    ap.add_argument("--added", type=int, default=200)
+    ap.add_argument("--renamed", type=int, default=50)
+    ap.add_argument("--deleted", type=int, default=100)
+    ap.add_argument("--notifications", type=int, default=300)
+    ap.add_argument("--rtt-ms", type=float, default=20)
+    a = ap.parse_args()
+    logging.disable(logging.WARNING)
+    rnd = random.Random(5)
+    dropbox_sync.DEBOUNCE = dropbox_sync.MAX_WAIT = 0
+
+    fake = FakeDropbox(rtt_ms=a.rtt_ms, connect_ms=0, token_ms=0)
+    fake.page_size = 500
+    dc.create_session = lambda *args, **kw: fake.session()
+    dc.DropboxClient.reset_shared()
+    pg = FakePostgrest(latency_ms=2)
+    rows, units = _portfolio(fake, a.files)
+    assets = pg.table("file_assets", rows)
+    pg.table(dropbox_sync.STATE, key="root")
+    _rpcs(pg, {"owner_id": {100 + o for o in range(5)},
+               "property_id": {r["property_id"] for r in rows},
+               "unit_id": {r["unit_id"]: r["property_id"] for r in rows}})
+    supabase.reset_client(pg.transport())
+
+    body = json.dumps({"list_folder": {"accounts": ["dbid:fake"]}, "delta": {"users": [1]}}).encode()
+    sig = hmac.new(b"webhook-secret", body, hashlib.sha256).hexdigest()
+    challenge = webhook.main(func.HttpRequest("GET", "/api/dropbox_webhook", params={"challenge": "abc123"}, body=b""))
+    print(f"handshake: {challenge.status_code} {challenge.get_body().decode()!r}; "
+          f"bad signature: {_post(body, '0' * 64).status_code}")
+
+    # first pull: no cursor yet, so it lists ROOT and attaches Dropbox ids to the upload rows
+    _post(body, sig)
+    tick.main(None)
+    print(f"first pull: {sum(1 for r in assets if r.get('dropbox_id'))}/{len(assets)} rows got their Dropbox id")
+
+    # ---------- out-of-band changes ----------
+    by_path = {r["dropbox_path_lower"]: r["id"] for r in assets}
+    moved_unit = units[7]
+    dest = unit_root("Owner 4", 104, "Property 9", 4009, "Unit 77", 400977)
+    moved = {p: p.replace(moved_unit.lower(), dest.lower()) for p in by_path if p.startswith(moved_unit.lower() + "/")}
+    fake.move(moved_unit, dest)
+    live = [p for p in by_path if p not in moved]
+    rnd.shuffle(live)
+    renamed = {}
+    for p in live[:a.renamed]:
+        renamed[p] = p.replace(".jpg", "-renamed.jpg")
+        fake.move(p, renamed[p])
+    for p in live[a.renamed:a.renamed + a.deleted]:
+        fake.delete(p)
+    for i in range(a.added):
+        fake.put(f"{rnd.choice(units)}/06_Media/direct-{i}.pdf", b"y")
+    # made by hand: "-2024" and "-3" look like ids but name no rows
+    handmade = units[0].rsplit("/", 3)[0] + "/building-2024/01_Units/apt-3/lease.pdf"
+    fake.put(handmade, b"z")
+
+    # ---------- burst of notifications, then one tick ----------
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        codes = set(pool.map(lambda _: _post(body, sig).status_code, range(a.notifications)))
+    state = pg.tables[dropbox_sync.STATE][0]
+    start_cursor = state["cursor"]
+    fake.calls.clear()
+    pg.calls.clear()
+    t0 = time.perf_counter()
+    report = dropbox_sync.pull(dc.DropboxClient.from_env(), 60)
+    secs = time.perf_counter() - t0
+    again = dropbox_sync.pull(dc.DropboxClient.from_env(), 60)
+    print(f"{a.notifications} notifications (status {sorted(codes)}) -> 1 pull; a second pull due: {again['pulled']}")
+    print(f"pull: {secs * 1000:7.1f} ms  {report['entries']} change entries in {report['pages']} pages  "
+          f"list_folder/continue={fake.calls['files/list_folder/continue']}  "
+          f"apply RPCs={pg.calls['POST rpc/file_assets_apply_changes']}  PostgREST calls={sum(pg.calls.values())}")
+    print(f"  deleted={report['deleted']} updated={report['updated']} created={report['created']} "
+          f"skipped={report['skipped']}")
+
+    fake.calls.clear()
+    t0 = time.perf_counter()
+    listed = sum(len(e) for e, _ in dc.DropboxClient.from_env().list_folder_pages(ROOT))
+    print(f"full rescan instead: {(time.perf_counter() - t0) * 1000:7.1f} ms  "
+          f"list_folder calls={fake.calls['files/list_folder'] + fake.calls['files/list_folder/continue']}  "
+          f"{listed} entries to diff against file_assets")
+
+    # ---------- checks ----------
+    alive = {r["dropbox_path_lower"] for r in assets if r.get("deleted_at") is None}
+    print(f"live rows match Dropbox files: {alive == set(fake.files)} ({len(alive)} rows, {len(fake.files)} files)")
+    final = {r["dropbox_path_lower"]: r["id"] for r in assets if r.get("deleted_at") is None}
+    kept = all(final.get(new) == by_path[old] for old, new in {**moved, **renamed}.items())
+    print(f"moved ({len(moved)}) and renamed ({len(renamed)}) files keep their asset ids: {kept}")
+    new = [r for r in assets if r.get("uploaded_by") == "dropbox_sync" and r["dropbox_path_lower"] != handmade.lower()]
+    print(f"new rows: {len(new)}, tagged with unit ids: {all(r['entity_type'] == 'unit' for r in new)}")
+    hm = next(r for r in assets if r["dropbox_path_lower"] == handmade.lower())
+    print(f"hand-made folder file: {hm['entity_type']} {hm['entity_id']}, "
+          f"property_id={hm['property_id']} unit_id={hm['unit_id']}")
+
+    # deletion timestamps move on a replay; whether a row is deleted must not
+    view = lambda: [dict(r, deleted_at=r.get("deleted_at") is not None) for r in sorted(assets, key=lambda r: r["id"])]
+    before = view()
+    state.update(cursor=start_cursor, requested_at=_now().isoformat())
+    dropbox_sync.pull(dc.DropboxClient.from_env(), 60)
+    after = view()
+    print(f"replay from the starting cursor: {len(after)} rows, unchanged: {before == after}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# bench/bench_namespace_mirror.py
+"""
+Namespace mirror (lib/namespace_mirror.py) against the fake Dropbox. A
+portfolio tree of 600 units with their subfolders and `--files` files is
+mirrored once; then
+
+- `--checks` ensure_folder calls on existing folders, with a cold
+  known_folders cache, go to the API and then to the mirror;
+- exists / children / subtree / find_by_hash are timed on the mirror;
+- out-of-band changes (puts, a unit moved, deletes) are caught up with
+  one sync, and the mirror is compared with the fake's tree;
+- a second worker starts cold, once by relisting and once from the
+  snapshot the first wrote, and both are compared again.
+
+    python -m bench.bench_namespace_mirror [--files 20000] [--rtt-ms 20]
+"""
+import argparse, logging, os, random, tempfile, time
+
+os.environ.update(DROPBOX_APP_KEY="k", DROPBOX_APP_SECRET="s", DROPBOX_REFRESH_TOKEN="r")
+
+import lib.dropbox_client as dc
+from bench.fake_dropbox import FakeDropbox
+from lib import namespace_mirror
+from lib.namespace_mirror import NamespaceMirror
+from lib.pathmap import ROOT, UNIT_SUBS, unit_root, with_subs
+
+
+def _tree(fake, files: int, rnd) -> list:
+    units = [unit_root(f"Owner {o}", 100 + o, f"Property {p}", 1000 * o + p, f"Unit {u}", 100000 * o + 100 * p + u)
+             for o in range(5) for p in range(10) for u in range(12)]
+    for u in units:
+        for f in with_subs(u, UNIT_SUBS):
+            fake._mkdirs(f)
+    for i in range(files):
+        fake.put(f"{rnd.choice(units)}/01_Photos/photo-{i}.jpg", str(i % 5000).encode())
+    return units
+
+
+def _same(mirror: NamespaceMirror, fake) -> bool:
+    folders = {f for f in fake.folders if f.startswith(ROOT.lower())}
+    files = {r[0] for r in mirror._conn().execute("select path_lower from entries where tag = 'file'")}
+    return mirror.folders() == folders and files == set(fake.files)
+
+
+def _timed(fn, n: int) -> float:
+    t0 = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=20000)
+    ap.add_argument("--checks", type=int, default=500)
+    ap.add_argument("--rtt-ms", type=float, default=20)
+    a = ap.parse_args()
+    logging.disable(logging.WARNING)
+    rnd = random.Random(3)
+    tmp = tempfile.mkdtemp(prefix="bench_mirror_")
+    snapshot = os.path.join(tmp, "snapshot.sqlite")
+
+    fake = FakeDropbox(rtt_ms=a.rtt_ms, connect_ms=0, token_ms=0)
+    dc.create_session = lambda *args, **kw: fake.session()
+    dc.DropboxClient.reset_shared()
+    units = _tree(fake, a.files, rnd)
+    client = dc.DropboxClient.from_env()
+
+    # ---------- first worker: full listing ----------
+    mirror = NamespaceMirror(os.path.join(tmp, "worker1.sqlite"), snapshot_path=snapshot)
+    fake.calls.clear()
+    t0 = time.perf_counter()
+    r = mirror.sync(client)
+    print(f"initial listing: {(time.perf_counter() - t0) * 1000:8.1f} ms  {r['entries']} entries in {r['pages']} pages  "
+          f"list_folder calls={sum(v for k, v in fake.calls.items() if 'list_folder' in k)}  "
+          f"snapshot written: {os.path.exists(snapshot)} ({os.path.getsize(snapshot) // 1024} KiB)")
+    print(f"mirror matches the fake's tree: {_same(mirror, fake)}")
+
+    # ---------- ensure_folder: API vs mirror ----------
+    targets = [rnd.choice(with_subs(rnd.choice(units), UNIT_SUBS)) for _ in range(a.checks)]
+    for label, enabled in (("API", False), ("mirror", True)):
+        client.known_folders.clear()
+        namespace_mirror.ENABLED, namespace_mirror._shared = enabled, mirror if enabled else None
+        fake.calls.clear()
+        t0 = time.perf_counter()
+        for t in targets:
+            client.ensure_folder(t)
+        ms = (time.perf_counter() - t0) * 1000
+        print(f"ensure_folder x{a.checks} via {label:<6}: {ms:8.1f} ms  Dropbox calls={sum(fake.calls.values())}")
+    namespace_mirror.ENABLED, namespace_mirror._shared = False, None
+
+    # ---------- lookups ----------
+    some_unit = units[17]
+    some_hash = fake.files[next(iter(fake.files))]["content_hash"]
+    print(f"exists        {_timed(lambda i: mirror.exists(targets[i % len(targets)]), 5000):7.1f} us/op")
+    print(f"children      {_timed(lambda i: mirror.children(units[i % len(units)] + '/01_Photos'), 2000):7.1f} us/op"
+          f"  ({len(mirror.children(some_unit + '/01_Photos'))} under one unit's photos)")
+    print(f"subtree       {_timed(lambda i: mirror.subtree(units[i % len(units)].rsplit('/', 1)[0]), 500):7.1f} us/op"
+          f"  (one property: {mirror.subtree(some_unit.rsplit('/', 1)[0])})")
+    print(f"find_by_hash  {_timed(lambda i: mirror.find_by_hash(some_hash), 2000):7.1f} us/op"
+          f"  ({len(mirror.find_by_hash(some_hash))} copies)")
+
+    # ---------- catching up with changes ----------
+    for i in range(300):
+        fake.put(f"{rnd.choice(units)}/06_Media/direct-{i}.pdf", b"new")
+    dest = unit_root("Owner 4", 104, "Property 9", 4009, "Unit 77", 400977)
+    fake.move(units[5], dest)
+    for u in units[40:45]:
+        fake.delete(u + "/01_Photos")
+    fake.calls.clear()
+    t0 = time.perf_counter()
+    r = mirror.sync(client)
+    print(f"catch-up sync: {(time.perf_counter() - t0) * 1000:8.1f} ms  {r['entries']} change entries  "
+          f"list_folder/continue={fake.calls['files/list_folder/continue']}; matches: {_same(mirror, fake)}")
+    mirror.save_snapshot(snapshot)
+    for i in range(50):
+        fake.put(f"{rnd.choice(units)}/06_Media/late-{i}.pdf", b"late")
+
+    # ---------- second worker: cold start ----------
+    for label, snap in (("relist", None), ("snapshot", snapshot)):
+        fake.calls.clear()
+        t0 = time.perf_counter()
+        cold = NamespaceMirror(os.path.join(tmp, f"worker2-{label}.sqlite"), snapshot_path=snap)
+        r = cold.sync(client)
+        print(f"cold start ({label:<8}): {(time.perf_counter() - t0) * 1000:8.1f} ms  {r['entries']} entries  "
+              f"list_folder calls={sum(v for k, v in fake.calls.items() if 'list_folder' in k)}; "
+              f"matches: {_same(cold, fake)}")
+
+    # ---------- two processes' worth of writers on one file ----------
+    other = NamespaceMirror(mirror.path, snapshot_path=None)
+    for i in range(100):
+        fake.put(f"{rnd.choice(units)}/06_Media/race-{i}.pdf", b"race")
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        reports = list(pool.map(lambda m: m.sync(client), (mirror, other)))
+    print(f"concurrent syncs on one file: superseded={[r['superseded'] for r in reports]}  "
+          f"matches: {_same(mirror, fake)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# bench/bench_onboard.py
+"""
+Onboarding a portfolio of `--owners` x `--properties` x `--units` against
+the fake Dropbox (async create_folder_batch jobs that take `--job-ms` per
+entry): one dropbox_provision_folders call per inserted row, the way the
+row triggers provision today (timed on a sample of `--sample` rows and
+extrapolated), vs a single POST to functions/onboard_portfolio, with the
+batch jobs polled one at a time and `--workers` at a time. Run progress is
+written to a fake onboarding_runs table under a run id the bench picks, and
+polled through functions/onboard_portfolio_status while the POST runs.
+
+    python -m bench.bench_onboard [--owners 50] [--properties 20] [--units 10] [--workers 4]
+"""
+import argparse, json, logging, os, threading, time, uuid
+
+os.environ.update(DROPBOX_APP_KEY="k", DROPBOX_APP_SECRET="s", DROPBOX_REFRESH_TOKEN="r",
+                  SUPABASE_URL="http://fake-supabase", SUPABASE_SERVICE_ROLE_KEY="x")
+
+import azure.functions as func
+
+import lib.dropbox_client as dc
+from bench.fake_dropbox import FakeDropbox
+from bench.fake_postgrest import FakePostgrest
+from lib import supabase
+
+import dropbox_provision_folders as provision
+import functions.onboard_portfolio as onboard
+import functions.onboard_portfolio_status as status
+
+
+def _records(a):
+    out = []
+    for o in range(a.owners):
+        owner = {"owner_name": f"Owner Holdings {o} LLC", "owner_id": 100 + o}
+        out.append({"entity_type": "owner", "name": owner["owner_name"], "id": owner["owner_id"]})
+        for p in range(a.properties):
+            prop = dict(owner, property_name=f"Sunset Villas Phase {p}", property_id=1000 * o + p)
+            out.append(dict(owner, entity_type="property", name=prop["property_name"], id=prop["property_id"]))
+            for u in range(a.units):
+                out.append(dict(prop, entity_type="unit", name=f"Unit {u}B", id=100000 * o + 100 * p + u))
+    return out
+
+
+def _fresh(fake):
+    fake.calls.clear()
+    dc.create_session = lambda *args, **kw: fake.session()
+    dc.DropboxClient.reset_shared()
+
+
+def _per_row(a, records):
+    # every k-th row keeps the owner/property/unit mix of the full set
+    sample = records[::max(1, len(records) // a.sample)]
+    fake = FakeDropbox(rtt_ms=a.rtt_ms, connect_ms=0, token_ms=0, async_batches=True, folder_job_ms=a.job_ms)
+    _fresh(fake)
+    t0 = time.perf_counter()
+    for r in sample:
+        d = {k: v for k, v in r.items() if k != "entity_type"}
+        res = provision.main(func.HttpRequest("POST", "/api/dropbox_provision_folders",
+                                              body=json.dumps({"entity_type": r["entity_type"], "new": d}).encode()))
+        assert res.status_code == 200, res.get_body()
+    secs = time.perf_counter() - t0
+    scale = len(records) / len(sample)
+    calls = sum(fake.calls.values())
+    print(f"{'before: per-row provisioning':<38} {secs * scale:8.1f} s  {calls * scale:9,.0f} calls  "
+          f"(measured {len(sample)} rows: {secs:.1f} s, {calls} calls)")
+
+
+def _status(run_id):
+    res = status.main(func.HttpRequest("GET", f"/api/onboard_portfolio/{run_id}", body=b"",
+                                       route_params={"run_id": run_id}))
+    return json.loads(res.get_body()) if res.status_code == 200 else None
+
+
+def _bulk(a, body, workers):
+    fake = FakeDropbox(rtt_ms=a.rtt_ms, connect_ms=0, token_ms=0, async_batches=True, folder_job_ms=a.job_ms)
+    _fresh(fake)
+    onboard.WORKERS = workers
+    run_id, seen, stop = str(uuid.uuid4()), [], threading.Event()
+
+    def poll():
+        while not stop.wait(0.1):
+            row = _status(run_id)
+            # the fake table has no column defaults: no status yet means "running"
+            if row and row.get("status", "running") == "running":
+                seen.append(row.get("batches_done"))
+
+    poller = threading.Thread(target=poll)
+    poller.start()
+    t0 = time.perf_counter()
+    res = onboard.main(func.HttpRequest("POST", "/api/onboard_portfolio", body=body,
+                                        headers={"content-type": "application/x-ndjson", "X-Onboarding-Run": run_id}))
+    secs = time.perf_counter() - t0
+    stop.set()
+    poller.join()
+    events = [json.loads(line) for line in res.get_body().decode().splitlines()]
+    plan, done = events[0], events[-1]
+    assert res.status_code == 200 and done["ok"], done
+    print(f"{f'after: onboard_portfolio, {workers} poller(s)':<38} {secs:8.1f} s  {sum(fake.calls.values()):9,} calls  "
+          f"batch={fake.calls['files/create_folder_batch']} check={fake.calls['files/create_folder_batch/check']}  "
+          f"polled while running: {len(seen)}x, last {seen[-1] if seen else '-'}/{plan['batches']} batches")
+    assert res.headers["X-Onboarding-Run"] == run_id
+    return plan, done, run_id
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--owners", type=int, default=50)
+    ap.add_argument("--properties", type=int, default=20)
+    ap.add_argument("--units", type=int, default=10)
+    ap.add_argument("--sample", type=int, default=300, help="rows timed through the per-row path")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--rtt-ms", type=float, default=20)
+    ap.add_argument("--job-ms", type=float, default=0.2, help="fake batch job time per entry")
+    a = ap.parse_args()
+    logging.disable(logging.WARNING)
+    dc.JOB_POLL_INTERVAL = 0.05
+
+    pg = FakePostgrest(latency_ms=2)
+    pg.table("onboarding_runs", key="run_id")
+    supabase.reset_client(pg.transport())
+
+    records = _records(a)
+    body = "\n".join(json.dumps(r) for r in records).encode()
+    print(f"{len(records):,} records ({a.owners} owners, {a.owners * a.properties} properties, "
+          f"{a.owners * a.properties * a.units} units)")
+    _per_row(a, records)
+    _bulk(a, body, 1)
+    plan, done, run_id = _bulk(a, body, a.workers)
+    print(f"plan: {plan['folders']:,} folders, {plan['leaves']:,} leaves in {plan['batches']} batches; "
+          f"done: {done['created']:,} created, {done['existing']} existing, {done['errors']} errors")
+
+    row = _status(run_id)
+    print(f"status row: {row.get('status')} {row.get('batches_done')}/{row.get('batches')} batches")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# bench/bench_pathmap.py
+"""
+Upload routing throughput: the old functions/dropbox_upload `_path_for`
+(rebuilds property/unit roots and a dict of 16 f-strings per call, slugs
+recomputed every time) vs lib.pathmap.route_for (templates compiled at
+import, one evaluated per call, memoized slugs). Metas cycle through a
+portfolio of `--owners` x `--properties` x `--units`, the way upload
+traffic repeats the same names.
+
+    python -m bench.bench_pathmap [--calls 200000]
+"""
+import argparse, random, re, time
+
+from lib import pathmap
+
+_raw_slugify = pathmap.slugify.__wrapped__
+TYPES = ["UnitPhoto", "PropertyPhoto", "Inspection", "WorkOrder", "LeaseSigned", "TenantNotice",
+         "RentReceipt", "MoveInDoc"]
+
+
+# ---------- before: functions/dropbox_upload._path_for ----------
+def _tag(name, idlike):
+    return f"{_raw_slugify(name)}{'-' + str(idlike) if idlike not in (None, '', 'null') else ''}"
+
+
+def _property_root(on, oid, pn, pid):
+    return f"{pathmap.ROOT}/{pathmap.OWNERS_DIR}/{_tag(on, oid)}/{pathmap.AUM_DIR}/{_tag(pn, pid)}"
+
+
+def _unit_root(on, oid, pn, pid, un, uid):
+    return f"{_property_root(on, oid, pn, pid)}/01_Units/{_tag(un, uid)}"
+
+
+def _slug(s):
+    s = (s or "").strip().lower()
+    s = re.sub(r"[^a-z0-9]+", "-", s).strip("-")
+    return s or "unnamed"
+
+
+def _tenancy_key(tenant_name, lease_id=None, application_id=None, tenant_id=None):
+    tslug = _slug(tenant_name or "tenant")
+    if lease_id:       return f"{int(lease_id)}-{tslug}"
+    if application_id: return f"{int(application_id)}-{tslug}"
+    if tenant_id:      return f"{int(tenant_id)}-{tslug}"
+    return f"tenancy-{tslug}"
+
+
+def old_path_for(entity_type, meta):
+    unit_id = meta.get("unit_id")
+    prop_root = _property_root(meta.get("owner_name"), meta.get("owner_id"), meta.get("property_name"),
+                               meta.get("property_id"))
+    unit_base = _unit_root(meta.get("owner_name"), meta.get("owner_id"), meta.get("property_name"),
+                           meta.get("property_id"), meta.get("unit_name"), unit_id)
+    ten_key = _tenancy_key(meta.get("tenant_name"), meta.get("lease_id"), meta.get("application_id"),
+                           meta.get("tenant_id"))
+    PATHS = {
+        "PropertyPhoto":        f"{prop_root}/11_Media",
+        "UnitPhoto":            f"{unit_base}/06_Media",
+        "Inspection":           f"{(unit_base if unit_id else prop_root)}/04_Inspections",
+        "WorkOrder":            f"{(unit_base if unit_id else prop_root)}/05_Work_Orders",
+        "LeaseSigned":          f"{unit_base}/02_Tenancies/{ten_key}/02_Lease/Signed",
+        "LeaseAmendment":       f"{unit_base}/02_Tenancies/{ten_key}/02_Lease/Amendments",
+        "LeaseAddendum":        f"{unit_base}/02_Tenancies/{ten_key}/02_Lease/Addenda",
+        "TenantNotice":         f"{unit_base}/02_Tenancies/{ten_key}/04_Notices",
+        "TenantCorrespondence": f"{unit_base}/02_Tenancies/{ten_key}/03_Correspondence",
+        "RentReceipt":          f"{unit_base}/02_Tenancies/{ten_key}/05_Rent",
+        "SubsidyDoc":           f"{unit_base}/02_Tenancies/{ten_key}/06_Subsidy",
+        "MoveInDoc":            f"{unit_base}/02_Tenancies/{ten_key}/08_Move_In",
+        "MoveOutDoc":           f"{unit_base}/02_Tenancies/{ten_key}/09_Move_Out",
+        "TenantLegal":          f"{unit_base}/02_Tenancies/{ten_key}/10_Legal",
+        "TenantCompliance":     f"{unit_base}/02_Tenancies/{ten_key}/11_Compliance",
+        "TenantDocument":       f"{unit_base}/02_Tenancies/{ten_key}/12_Documents",
+    }
+    if entity_type not in PATHS:
+        raise ValueError(f"Unknown entity_type '{entity_type}'")
+    return PATHS[entity_type]
+
+
+def _workload(a):
+    rnd = random.Random(3)
+    metas = []
+    for o in range(a.owners):
+        for p in range(a.properties):
+            for u in range(a.units):
+                metas.append({"owner_name": f"Owner Holdings {o} LLC", "owner_id": 100 + o,
+                              "property_name": f"Sunset Villas Phase {p}", "property_id": 1000 * o + p,
+                              "unit_name": f"Unit {u}B", "unit_id": 100000 * o + 100 * p + u,
+                              "tenant_name": f"Tenant {u} Family", "lease_id": 50000 + u})
+    return [(rnd.choice(TYPES), rnd.choice(metas)) for _ in range(a.calls)]
+
+
+def _run(name, fn, work):
+    t0 = time.perf_counter()
+    for et, meta in work:
+        fn(et, meta)
+    secs = time.perf_counter() - t0
+    print(f"{name:<36} {len(work) / secs:>10,.0f} routes/s  {secs / len(work) * 1e6:6.2f} us/route")
+    return secs
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--calls", type=int, default=200000)
+    ap.add_argument("--owners", type=int, default=20)
+    ap.add_argument("--properties", type=int, default=10)
+    ap.add_argument("--units", type=int, default=12)
+    a = ap.parse_args()
+    work = _workload(a)
+
+    before = _run("before: per-call PATHS dict", old_path_for, work)
+    pathmap.slugify.cache_clear()
+    after = _run("after: compiled route table", pathmap.route_for, work)
+    info = pathmap.slugify.cache_info()
+    print(f"speedup {before / after:.1f}x  slug cache: {info.hits} hits, {info.misses} misses, "
+          f"size {info.currsize}/{info.maxsize}")
+
+
+if __name__ == "__main__":
+    main()
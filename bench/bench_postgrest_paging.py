@@ -0,0 +1,69 @@
+# bench/bench_postgrest_paging.py
+"""
+Peak client RSS while scanning N rows from a local PostgREST stand-in:
+one unbounded GET + .json() (old drift_detector) vs lib.supabase.iter_rows.
+The stand-in runs in its own process so only client memory is measured.
+
+    python -m bench.bench_postgrest_paging [--rows 100000] [--page-size 1000]
+"""
+import argparse, multiprocessing, os, subprocess, sys, time
+
+from bench.fake_postgrest import FakePostgrest, serve
+
+
+def _server(rows: int, ready):
+    fake = FakePostgrest()
+    fake.table("units", ({"id": i, "name": f"Unit {i}", "property_id": i // 20, "property_name": f"Property {i // 20}",
+                         "owner_id": i // 400, "owner_name": f"Owner {i // 400}", "notes": "x" * 120}
+                        for i in range(1, rows + 1)))
+    srv = serve(fake)
+    ready.put(srv.server_address[1])
+    srv.serve_forever()
+
+
+CLIENT = r'''
+import os, resource, sys, httpx
+mode, page = sys.argv[1], int(sys.argv[2])
+from lib.supabase import iter_rows
+base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+n = 0
+if mode == "unbounded":
+    with httpx.Client(timeout=300) as c:
+        r = c.get(os.environ["SUPABASE_URL"] + "/rest/v1/units",
+                  params={"select": "id,name,property_id,property_name,owner_id,owner_name"})
+        for u in r.json():
+            n += 1
+else:
+    for u in iter_rows("units", "id,name,property_id,property_name,owner_id,owner_name", page_size=page):
+        n += 1
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(n, base, peak)
+'''
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--page-size", type=int, default=1000)
+    a = ap.parse_args()
+
+    ready = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_server, args=(a.rows, ready), daemon=True)
+    proc.start()
+    port = ready.get(timeout=120)
+    env = dict(os.environ, SUPABASE_URL=f"http://127.0.0.1:{port}", SUPABASE_SERVICE_ROLE_KEY="x",
+               PYTHONPATH=os.getcwd())
+    try:
+        for mode in ("unbounded", "keyset"):
+            t0 = time.perf_counter()
+            out = subprocess.run([sys.executable, "-c", CLIENT, mode, str(a.page_size)], env=env,
+                                 capture_output=True, text=True, check=True).stdout.split()
+            n, base, peak = (int(x) for x in out)
+            print(f"{mode:<10} rows={n:>7}  peak RSS={peak / 1024:7.1f} MB  (+{(peak - base) / 1024:6.1f} MB over import)  "
+                  f"{time.perf_counter() - t0:5.2f}s")
+    finally:
+        proc.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# bench/bench_provision.py
+"""
+Dropbox API calls (and wall time) to provision one new entity: the old
+serial create-per-folder loop vs leaf-only create_folder_batch, run through
+the real dropbox_provision_folders handler.
+
+    python -m bench.bench_provision [--rtt-ms 20] [--async-batches]
+"""
+import argparse, json, os, time
+
+import azure.functions as func
+import dropbox
+
+import lib.dropbox_client as dc
+from bench.fake_dropbox import FakeDropbox
+from lib.pathmap import (
+    owner_root, property_root, unit_root, tenancy_root,
+    OWNER_SUBS, PROPERTY_SUBS, UNIT_SUBS, TENANCY_SUBS,
+)
+import dropbox_provision_folders as provision
+
+OWNER = {"owner_name": "Sunset Capital", "owner_id": 101}
+PROP = dict(OWNER, property_name="Sunset Villas", property_id=201)
+UNIT = dict(PROP, unit_name="Unit 4B", unit_id=301)
+
+CASES = {
+    "owner": {"name": "Sunset Capital", "id": 101},
+    "property": dict(OWNER, name="Sunset Villas", id=201),
+    "unit": dict(PROP, name="Unit 4B", id=301),
+    "tenancy": dict(UNIT, tenant_name="Jane Doe", lease_id=401),
+}
+
+
+def _serial_paths(entity, d):
+    # mirrors the pre-batch handler, including its explicit parent creates
+    if entity == "owner":
+        base, subs, pre = owner_root(d["name"], d["id"]), OWNER_SUBS, []
+    elif entity == "property":
+        base, subs, pre = property_root(d["owner_name"], d["owner_id"], d["name"], d["id"]), PROPERTY_SUBS, []
+    elif entity == "unit":
+        base, subs, pre = unit_root(d["owner_name"], d["owner_id"], d["property_name"], d["property_id"],
+                                    d["name"], d["id"]), UNIT_SUBS, []
+    else:
+        ub = unit_root(d["owner_name"], d["owner_id"], d["property_name"], d["property_id"], d["unit_name"], d["unit_id"])
+        base = tenancy_root(d["owner_name"], d["owner_id"], d["property_name"], d["property_id"],
+                            d["unit_name"], d["unit_id"], d)
+        subs, pre = TENANCY_SUBS, [ub, f"{ub}/02_Tenancies"]
+    return pre + [base] + [f"{base}/{s}" for s in subs]
+
+
+def _serial(fake, entity, d):
+    dbx = dropbox.Dropbox(oauth2_access_token="t", session=fake.session())
+    for p in _serial_paths(entity, d):
+        try:
+            dbx.files_create_folder_v2(p, autorename=False)
+        except dropbox.exceptions.ApiError as e:
+            if "conflict" not in str(e).lower():
+                raise
+
+
+def _batched(fake, entity, d):
+    dc.create_session = lambda *a, **kw: fake.session()
+    dc.DropboxClient.reset_shared()
+    req = func.HttpRequest("POST", "/api/dropbox_provision_folders",
+                           body=json.dumps({"entity_type": entity, "new": d}).encode())
+    res = provision.main(req)
+    assert res.status_code == 200, res.get_body()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rtt-ms", type=float, default=20)
+    ap.add_argument("--async-batches", action="store_true", help="make the fake defer every batch to a job")
+    a = ap.parse_args()
+    os.environ.update(DROPBOX_APP_KEY="k", DROPBOX_APP_SECRET="s", DROPBOX_REFRESH_TOKEN="r")
+    dc.JOB_POLL_INTERVAL = 0.01
+
+    print(f"{'entity':<10}{'serial calls':>14}{'serial ms':>11}{'batch calls':>13}{'batch ms':>10}")
+    for entity, d in CASES.items():
+        row = []
+        for fn in (_serial, _batched):
+            fake = FakeDropbox(rtt_ms=a.rtt_ms, connect_ms=0, token_ms=0, async_batches=a.async_batches)
+            t0 = time.perf_counter()
+            fn(fake, entity, d)
+            ms = (time.perf_counter() - t0) * 1000
+            calls = sum(n for r, n in fake.calls.items() if r != "oauth2/token")
+            row += [calls, ms]
+        print(f"{entity:<10}{row[0]:>14}{row[1]:>11.0f}{row[2]:>13}{row[3]:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# bench/bench_rate_limit.py
+"""
+lib/rate_limit.py against fakes that refuse requests above a set rate with
+429 + Retry-After (bench/fake_throttle.py).
+
+Dropbox: `--calls` files/get_metadata from `--threads` threads against a
+fake allowing `--dropbox-rps`, run through
+- the SDK's own retry loop (what every call did before: each thread sleeps
+  its own Retry-After and retries, forever);
+- the limiter starting unlimited and finding the rate from the 429s;
+- the limiter with RATE_LIMIT_DROPBOX_RPS set just under the limit.
+
+Supabase: the same with selects against a fake PostgREST allowing
+`--supabase-rps`, first with retries alone (no pacing, the old 3 attempts)
+and then with the adaptive limiter.
+
+Reported per run: wall time, the rate achieved, 429s the server sent,
+calls that failed and the limiter's counters.
+
+    python -m bench.bench_rate_limit [--calls 600] [--threads 16] [--dropbox-rps 40]
+"""
+import argparse, logging, os, time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.update(DROPBOX_APP_KEY="k", DROPBOX_APP_SECRET="s", DROPBOX_REFRESH_TOKEN="r",
+                  SUPABASE_URL="http://fake-supabase", SUPABASE_SERVICE_ROLE_KEY="x")
+
+import dropbox
+
+import lib.dropbox_client as dc
+from bench.fake_dropbox import FakeDropbox
+from bench.fake_postgrest import FakePostgrest
+from bench.fake_throttle import Throttle
+from lib import rate_limit, supabase
+
+
+def _run(label: str, fn, calls: int, threads: int, throttle: Throttle, stats=None):
+    throttle.refused = 0
+    failed = 0
+
+    def one(i):
+        nonlocal failed
+        try:
+            fn(i)
+        except Exception:
+            failed += 1
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, range(calls)))
+    secs = time.perf_counter() - t0
+    print(f"  {label:<34} {secs:7.2f} s  {(calls - failed) / secs:6.1f} ok/s  429s={throttle.refused:<5} "
+          f"failed={failed:<4} {stats() if stats else ''}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--calls", type=int, default=600)
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--dropbox-rps", type=float, default=40)
+    ap.add_argument("--supabase-rps", type=float, default=100)
+    ap.add_argument("--rtt-ms", type=float, default=20)
+    a = ap.parse_args()
+    logging.disable(logging.WARNING)
+
+    # ---------- Dropbox ----------
+    fake = FakeDropbox(rtt_ms=a.rtt_ms, connect_ms=0, token_ms=0)
+    fake._mkdirs("/bench/folder")
+    fake.throttle = Throttle(a.dropbox_rps, retry_after=1)
+    dc.create_session = lambda *args, **kw: fake.session()
+    print(f"Dropbox: {a.calls} get_metadata, {a.threads} threads, server allows {a.dropbox_rps:g}/s")
+
+    sdk = dropbox.Dropbox(oauth2_access_token="t", session=fake.session())
+    _run("SDK retry loop (before)", lambda i: sdk.files_get_metadata("/bench/folder"), a.calls, a.threads,
+         fake.throttle)
+
+    for label, kw in (("limiter, adaptive from unlimited", {}),
+                      (f"limiter, RPS={a.dropbox_rps * 0.9:g}", {"rate": a.dropbox_rps * 0.9})):
+        time.sleep(1)
+        lim = rate_limit.configure(dc.RATE_NAMESPACE, concurrency=a.threads, retries=20, base_delay=0.5,
+                                   max_delay=8.0, **kw)
+        dc.DropboxClient.reset_shared()
+        client = dc.DropboxClient.from_env()
+        _run(label, lambda i: client.dbx.files_get_metadata("/bench/folder"), a.calls, a.threads, fake.throttle,
+             lim.stats)
+
+    # ---------- Supabase ----------
+    pg = FakePostgrest(latency_ms=5)
+    pg.table("file_assets", [{"id": i} for i in range(10)])
+    pg.throttle = Throttle(a.supabase_rps, retry_after=0.5)
+    supabase.reset_client(pg.transport())
+    print(f"Supabase: {a.calls * 2} selects, {a.threads} threads, server allows {a.supabase_rps:g}/s")
+    for label, kw in (("retries only (3 attempts, no pacing)", {"adaptive": False, "retries": 3}),
+                      ("limiter, adaptive from unlimited", {"retries": 20})):
+        time.sleep(1)
+        lim = rate_limit.configure(supabase.NAMESPACE, concurrency=a.threads, base_delay=0.2, max_delay=2.0, **kw)
+        _run(label, lambda i: supabase.select("file_assets", "id", limit=1), a.calls * 2, a.threads, pg.throttle,
+             lim.stats)
+
+
+if __name__ == "__main__":
+    main()
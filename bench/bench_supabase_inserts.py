@@ -0,0 +1,65 @@
+# bench/bench_supabase_inserts.py
+"""
+Latency of 1,000 sequential file_assets inserts: a throwaway httpx client
+per call (old `_sb_insert` / `_save_asset`) vs the shared keep-alive client
+in lib.supabase. The fake charges `--connect-ms` for the first request on
+every new connection, standing in for DNS + TCP + TLS.
+
+    python -m bench.bench_supabase_inserts [--inserts 1000] [--latency-ms 5] [--connect-ms 30]
+"""
+import argparse, os, statistics, time
+
+os.environ.setdefault("SUPABASE_URL", "http://fake-supabase")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "x")
+
+import httpx
+
+from bench.fake_postgrest import FakePostgrest
+from lib import supabase
+
+
+def _row(i: int) -> dict:
+    return {"dropbox_path": f"/bench/{i}.bin", "original_name": f"{i}.bin", "scope": "unit", "unit_id": i}
+
+
+def _per_call(pg: FakePostgrest, i: int):
+    hdrs = {"apikey": "x", "Authorization": "Bearer x", "content-type": "application/json",
+            "prefer": "return=minimal"}
+    with httpx.Client(timeout=20, transport=pg.transport()) as c:
+        c.post(f"{supabase.SUPABASE_URL}/rest/v1/file_assets", headers=hdrs, json=_row(i)).raise_for_status()
+
+
+def _pooled(pg: FakePostgrest, i: int):
+    supabase.insert("file_assets", _row(i))
+
+
+def _run(name, fn, n, latency_ms, connect_ms):
+    pg = FakePostgrest(latency_ms=latency_ms, connect_ms=connect_ms)
+    supabase.reset_client(pg.transport())
+    lat = []
+    t0 = time.perf_counter()
+    for i in range(n):
+        s = time.perf_counter()
+        fn(pg, i)
+        lat.append((time.perf_counter() - s) * 1000)
+    wall = time.perf_counter() - t0
+    lat.sort()
+    assert len(pg.tables["file_assets"]) == n
+    print(f"{name:<24} mean={statistics.mean(lat):6.1f}ms p50={lat[len(lat)//2]:6.1f}ms "
+          f"p99={lat[int(len(lat)*0.99)-1]:6.1f}ms  total={wall:6.2f}s")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--inserts", type=int, default=1000)
+    ap.add_argument("--latency-ms", type=float, default=5)
+    ap.add_argument("--connect-ms", type=float, default=30)
+    a = ap.parse_args()
+
+    for name, fn in (("before: client per call", _per_call), ("after: shared client", _pooled)):
+        _run(name, fn, a.inserts, a.latency_ms, a.connect_ms)
+    supabase.reset_client()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# bench/bench_teamspace.py
+"""
+Team Space migration throughput between two fake Dropbox accounts: the old
+loop (download each file whole, files_upload it, one at a time) vs
+lib.teamspace.Migrator with copy references, and with copy references
+refused so every file streams through an upload session. Reports files/s,
+bytes/s and the peak memory the copy loop allocated.
+
+    python -m bench.bench_teamspace [--files 200] [--large 4] [--workers 8]
+"""
+import argparse, logging, os, random, time, tracemalloc
+
+import dropbox
+
+import lib.dropbox_client as dc
+from bench.fake_dropbox import FakeDropbox
+from lib.teamspace import Migrator
+
+MB = 1024 * 1024
+
+
+def _accounts(a, rows):
+    src_fake = FakeDropbox(rtt_ms=a.rtt_ms, connect_ms=0, token_ms=0, bandwidth_mbps=a.mbps)
+    dst_fake = FakeDropbox(rtt_ms=a.rtt_ms, connect_ms=0, token_ms=0, bandwidth_mbps=a.mbps)
+    for r, data in rows:
+        src_fake.put(r["dropbox_path"], data)
+    dc.create_session = lambda *args, **kw: src_fake.session()
+    src = dc.DropboxClient("k", "s", "src")
+    dc.create_session = lambda *args, **kw: dst_fake.session()
+    dst = dc.DropboxClient("k", "s", "dst")
+    return src, dst, dst_fake
+
+
+def _old_loop(src, dst, rows):
+    n = size = 0
+    for r in rows:
+        md, res = src.dbx.files_download(r["dropbox_path"])
+        data = res.content
+        dst.dbx.files_upload(data, r["dropbox_path"], mode=dropbox.files.WriteMode("add"), autorename=True, mute=True)
+        n += 1
+        size += len(data)
+    return n, size
+
+
+def _report(name, n, size, secs, peak):
+    print(f"{name:<30} files={n:>5} {n / secs:8.1f} files/s {size / secs / MB:8.1f} MB/s "
+          f"peak={peak / MB:7.1f} MB  ({secs:5.2f}s)")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=200, help="small files (64 KB - 2 MB)")
+    ap.add_argument("--large", type=int, default=4, help="files of --large-mb")
+    ap.add_argument("--large-mb", type=int, default=40)
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--rtt-ms", type=float, default=30)
+    ap.add_argument("--mbps", type=float, default=400, help="per-connection bandwidth")
+    a = ap.parse_args()
+    dc.UPLOAD_RETRY_DELAY = 0.01
+    logging.disable(logging.WARNING)
+
+    rnd = random.Random(1)
+    rows = [({"id": i, "dropbox_path": f"/Altus/o-{i % 7}/p-{i % 13}/f-{i}.pdf"},
+             os.urandom(rnd.randint(64 * 1024, 2 * MB))) for i in range(a.files)]
+    rows += [({"id": a.files + i, "dropbox_path": f"/Altus/media/walkthrough-{i}.mp4"}, os.urandom(a.large_mb * MB))
+             for i in range(a.large)]
+    plain = [r for r, _ in rows]
+
+    src, dst, _ = _accounts(a, rows)
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    n, size = _old_loop(src, dst, plain)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    _report("before: download + upload", n, size, time.perf_counter() - t0, peak)
+
+    for name, refs in (("after: copy references", True), ("after: streamed fallback", False)):
+        src, dst, dst_fake = _accounts(a, rows)
+        dst_fake.accept_copy_refs = refs
+        tracemalloc.start()
+        rep = Migrator(src, dst, workers=a.workers).run(plain)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert rep["failed"] == 0, rep["errors"][:3]
+        _report(f"{name} x{a.workers}", rep["copied"], rep["bytes"], rep["seconds"], peak)
+
+    rep = Migrator(src, dst, workers=a.workers).run(plain)
+    print(f"re-run over migrated rows: {rep['by_method']}")
+
+
+if __name__ == "__main__":
+    main()
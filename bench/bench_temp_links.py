@@ -0,0 +1,92 @@
+# bench/bench_temp_links.py
+"""
+Links for a 100-photo gallery through functions/get_temp_link: 100
+sequential single-item calls (one file_assets lookup and one
+files_get_temporary_link each) vs one batch call with `asset_ids`
+(one `id=in.(...)` lookup, links fetched on the bounded pool). The link
+cache is cleared before every run, so both pay for every link; a final
+warm batch shows the cached case. A few ids are unknown and one file is
+missing, to show per-item errors.
+
+    python -m bench.bench_temp_links [--items 100] [--rtt-ms 40] [--latency-ms 15]
+"""
+import argparse, json, logging, os, time
+
+os.environ.update(DROPBOX_APP_KEY="k", DROPBOX_APP_SECRET="s", DROPBOX_REFRESH_TOKEN="r",
+                  SUPABASE_URL="http://fake-supabase", SUPABASE_SERVICE_ROLE_KEY="x")
+
+import azure.functions as func
+
+import lib.dropbox_client as dc
+from bench.fake_dropbox import FakeDropbox
+from bench.fake_postgrest import FakePostgrest
+from lib import link_cache, supabase
+
+import functions.get_temp_link as handler
+
+
+def _get(params: dict):
+    res = handler.main(func.HttpRequest("GET", "/api/get_temp_link", params=params, body=b""))
+    assert res.status_code == 200, res.get_body()
+    return json.loads(res.get_body())
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--items", type=int, default=100)
+    ap.add_argument("--rtt-ms", type=float, default=40)
+    ap.add_argument("--latency-ms", type=float, default=15)
+    ap.add_argument("--workers", type=int, default=link_cache.WORKERS)
+    a = ap.parse_args()
+    logging.disable(logging.WARNING)
+    link_cache.WORKERS = a.workers
+
+    n = a.items
+    pg = FakePostgrest(latency_ms=a.latency_ms)
+    pg.table("file_assets", [{"id": i, "dropbox_path": f"/Altus/o-1/p-2/Units/4B/Photos/img-{i}.jpg"}
+                             for i in range(1, n + 1)])
+    supabase.reset_client(pg.transport())
+    fake = FakeDropbox(rtt_ms=a.rtt_ms, connect_ms=0, token_ms=0)
+    for i in range(2, n + 1):  # img-1 is gone from Dropbox
+        fake.put(f"/Altus/o-1/p-2/Units/4B/Photos/img-{i}.jpg", b"x")
+    dc.create_session = lambda *args, **kw: fake.session()
+    dc.DropboxClient.reset_shared()
+
+    ids = list(range(1, n + 1))
+    link_cache.clear()
+    t0 = time.perf_counter()
+    ok = 0
+    for i in ids:
+        try:
+            _get({"asset_id": str(i)})
+            ok += 1
+        except Exception:
+            pass
+    seq = time.perf_counter() - t0
+    print(f"before: {n} sequential calls   {seq * 1000:8.1f} ms  ({ok} links)  "
+          f"postgrest={sum(pg.calls.values())} dropbox={fake.calls['files/get_temporary_link']}")
+
+    pg.calls.clear()
+    fake.calls.clear()
+    link_cache.clear()
+    asked = ids + [n + 1, n + 2]
+    t0 = time.perf_counter()
+    out = _get({"asset_ids": ",".join(map(str, asked))})
+    batch = time.perf_counter() - t0
+    errors = [(r["asset_id"], r["error"][:40]) for r in out["results"] if not r["ok"]]
+    assert [r["asset_id"] for r in out["results"]] == asked
+    print(f"after:  one batch of {len(asked)} (x{a.workers}) {batch * 1000:8.1f} ms  "
+          f"({sum(r['ok'] for r in out['results'])} links)  postgrest={sum(pg.calls.values())} "
+          f"dropbox={fake.calls['files/get_temporary_link']}  speedup {seq / batch:.1f}x")
+    print(f"per-item errors, in order: {errors}")
+
+    pg.calls.clear()
+    fake.calls.clear()
+    t0 = time.perf_counter()
+    _get({"asset_ids": ",".join(map(str, ids))})
+    print(f"warm batch (cached)               {(time.perf_counter() - t0) * 1000:8.1f} ms  "
+          f"postgrest={sum(pg.calls.values())} dropbox={fake.calls['files/get_temporary_link']}")
+
+
+if __name__ == "__main__":
+    main()
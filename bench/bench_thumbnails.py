@@ -0,0 +1,104 @@
+# bench/bench_thumbnails.py
+"""
+A 40-photo unit gallery through functions/thumbnail against the fake
+Dropbox: bytes the portal pulls as full-size temp links vs thumbnails, the
+Dropbox calls a cold grid costs when its concurrent <img> requests are
+coalesced into files_get_thumbnail_batch, a warm grid served from the disk
+cache, browser revalidation (If-None-Match -> 304) once the cached revisions
+are due for a check, a new revision of one photo, and LRU eviction under a
+small cache bound.
+
+    python -m bench.bench_thumbnails [--photos 40] [--photo-mb 4] [--concurrency 40]
+"""
+import argparse, logging, os, shutil, tempfile, time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.update(DROPBOX_APP_KEY="k", DROPBOX_APP_SECRET="s", DROPBOX_REFRESH_TOKEN="r",
+                  SUPABASE_URL="http://fake-supabase", SUPABASE_SERVICE_ROLE_KEY="x",
+                  THUMBNAIL_CACHE_DIR=tempfile.mkdtemp(prefix="thumb_bench_"))
+
+import azure.functions as func
+
+import lib.dropbox_client as dc
+from bench.fake_dropbox import FakeDropbox
+from lib import thumbnails
+
+import functions.thumbnail as handler
+
+MB = 1024 * 1024
+
+
+def _get(path: str, size: str, etag=None):
+    headers = {"if-none-match": etag} if etag else {}
+    res = handler.main(func.HttpRequest("GET", "/api/thumbnail", params={"path": path, "size": size},
+                                        headers=headers, body=b""))
+    assert res.status_code in (200, 304), (res.status_code, res.get_body())
+    return res
+
+
+def _grid(paths, size, concurrency, etags=None):
+    etags = etags or {}
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        res = list(pool.map(lambda p: _get(p, size, etags.get(p)), paths))
+    return res, (time.perf_counter() - t0) * 1000
+
+
+def _report(name, fake, res, ms):
+    body = sum(len(r.get_body()) for r in res)
+    codes = sorted({r.status_code for r in res})
+    print(f"{name:<34} {ms:7.1f} ms  to browser {body / 1024:8.1f} KB  status {codes}  "
+          f"batch={fake.calls['files/get_thumbnail_batch']} metadata={fake.calls['files/get_metadata']}")
+    fake.calls.clear()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--photos", type=int, default=40)
+    ap.add_argument("--photo-mb", type=float, default=4)
+    ap.add_argument("--size", default="w256h256")
+    ap.add_argument("--concurrency", type=int, default=40, help="browser requests in flight")
+    ap.add_argument("--rtt-ms", type=float, default=40)
+    a = ap.parse_args()
+    logging.disable(logging.WARNING)
+
+    fake = FakeDropbox(rtt_ms=a.rtt_ms, connect_ms=0, token_ms=0)
+    paths = [f"/Altus/o-1/p-2/01_Units/4B/01_Photos/img-{i}.jpg" for i in range(a.photos)]
+    for p in paths:
+        fake.put(p, os.urandom(int(a.photo_mb * MB)))
+    dc.create_session = lambda *args, **kw: fake.session()
+    dc.DropboxClient.reset_shared()
+
+    print(f"before: full-size temp links      to browser {a.photos * a.photo_mb:8.1f} MB")
+    fake.calls.clear()
+
+    res, ms = _grid(paths, a.size, a.concurrency)
+    _report("cold grid (coalesced batches)", fake, res, ms)
+    etags = {p: r.headers["ETag"] for p, r in zip(paths, res)}
+    thumb_bytes = len(res[0].get_body())
+
+    res, ms = _grid(paths, a.size, a.concurrency)
+    _report("warm grid (disk cache)", fake, res, ms)
+
+    thumbnails.REV_TTL = 0  # cached revisions now due for a check
+    res, ms = _grid(paths, a.size, a.concurrency, etags)
+    _report("revalidate (If-None-Match)", fake, res, ms)
+
+    fake.put(paths[0], os.urandom(1024))
+    res, ms = _grid(paths, a.size, a.concurrency, etags)
+    changed = [p for p, r in zip(paths, res) if r.status_code == 200]
+    _report("one photo replaced", fake, res, ms)
+    print(f"  refreshed: {changed == paths[:1]}, new ETag: {res[0].headers['ETag'] != etags[paths[0]]}")
+
+    thumbnails.REV_TTL = 600
+    thumbnails.cache.clear()
+    thumbnails.cache.max_bytes = 10 * thumb_bytes
+    _grid(paths, a.size, a.concurrency)
+    on_disk = sum(os.path.getsize(os.path.join(thumbnails.CACHE_DIR, f)) for f in os.listdir(thumbnails.CACHE_DIR))
+    print(f"cache bound {thumbnails.cache.max_bytes / 1024:.0f} KB: {len(os.listdir(thumbnails.CACHE_DIR))} files, "
+          f"{on_disk / 1024:.0f} KB on disk")
+    shutil.rmtree(thumbnails.CACHE_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# bench/bench_upload_memory.py
+"""
+Peak memory the dropbox_upload handler allocates per request, on top of the
+request body the host already holds, for the legacy JSON/base64 body vs a
+raw octet-stream body vs multipart/form-data. Each case runs in its own
+subprocess against the in-process fake Dropbox.
+
+    python -m bench.bench_upload_memory [--sizes 10,100,300]
+"""
+import argparse, base64, json, os, subprocess, sys, time, tracemalloc
+
+MB = 1024 * 1024
+MODES = ("json", "raw", "multipart")
+META = {"owner_name": "Sunset Capital", "owner_id": 101, "property_name": "Sunset Villas",
+        "property_id": 201, "unit_name": "Unit 4B", "unit_id": 301}
+
+
+def _request(mode: str, size: int):
+    import azure.functions as func
+
+    data = os.urandom(size)
+    if mode == "json":
+        body = json.dumps({"entity_type": "UnitPhoto", "original_filename": "big.bin", "meta": META,
+                           "file_base64": base64.b64encode(data).decode()}).encode()
+        headers = {"content-type": "application/json"}
+    elif mode == "raw":
+        body = data
+        headers = {"content-type": "application/octet-stream", "x-upload-entity-type": "UnitPhoto",
+                   "x-upload-original-filename": "big.bin", "x-upload-meta": json.dumps(META)}
+    else:
+        b = "benchboundary"
+        head = (f'--{b}\r\nContent-Disposition: form-data; name="entity_type"\r\n\r\nUnitPhoto\r\n'
+                f'--{b}\r\nContent-Disposition: form-data; name="meta"\r\n\r\n{json.dumps(META)}\r\n'
+                f'--{b}\r\nContent-Disposition: form-data; name="file"; filename="big.bin"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n').encode()
+        body = head + data + f"\r\n--{b}--\r\n".encode()
+        headers = {"content-type": f"multipart/form-data; boundary={b}"}
+    del data
+    return func.HttpRequest("POST", "/api/dropbox_upload", headers=headers, body=body)
+
+
+def _child(mode: str, size_mb: int):
+    os.environ.update(DROPBOX_APP_KEY="k", DROPBOX_APP_SECRET="s", DROPBOX_REFRESH_TOKEN="r")
+    os.environ.pop("SUPABASE_URL", None)
+    import lib.dropbox_client as dc
+    from bench.fake_dropbox import FakeDropbox
+    import dropbox_upload as handler
+
+    fake = FakeDropbox(rtt_ms=0, connect_ms=0, token_ms=0)
+    dc.create_session = lambda *a, **kw: fake.session()
+    req = _request(mode, size_mb * MB)
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    res = handler.main(req)
+    ms = (time.perf_counter() - t0) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    assert res.status_code == 200, res.get_body()
+    print(json.dumps({"peak": peak, "ms": ms}))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10,100,300", help="file sizes in MB")
+    ap.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    a = ap.parse_args()
+    if a.child:
+        return _child(a.child[0], int(a.child[1]))
+
+    print(f"{'size MB':>8}" + "".join(f"{m + ' peak MB':>18}" for m in MODES))
+    for size in (int(s) for s in a.sizes.split(",")):
+        row = []
+        for mode in MODES:
+            out = subprocess.run([sys.executable, "-m", "bench.bench_upload_memory", "--child", mode, str(size)],
+                                 capture_output=True, text=True, check=True).stdout
+            row.append(json.loads(out.strip().splitlines()[-1])["peak"] / MB)
+        print(f"{size:>8}" + "".join(f"{v:>18.1f}" for v in row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# bench/bench_upload_stream.py
+"""
+Throughput of DropboxClient.upload_stream against the fake Dropbox as the
+number of upload workers grows. The fake charges `--rtt-ms` per request
+and caps each connection at `--mbps`, so a single sequential session is
+latency- and bandwidth-bound the way a real one is. `--drop N` loses the
+first N appends to show chunk retries.
+
+    python -m bench.bench_upload_stream [--size-mb 256] [--workers 1,2,4,8]
+"""
+import argparse, io, os, time
+
+import lib.dropbox_client as dc
+from bench.fake_dropbox import FakeDropbox
+
+MB = 1024 * 1024
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--size-mb", type=int, default=256)
+    ap.add_argument("--workers", default="1,2,4,8")
+    ap.add_argument("--rtt-ms", type=float, default=40)
+    ap.add_argument("--mbps", type=float, default=200, help="per-connection bandwidth")
+    ap.add_argument("--drop", type=int, default=0, help="appends to drop (retried)")
+    a = ap.parse_args()
+    dc.UPLOAD_RETRY_DELAY = 0.01
+    data = os.urandom(a.size_mb * MB)
+
+    print(f"{'workers':>8}{'seconds':>10}{'MB/s':>9}{'appends':>9}{'dropped':>9}")
+    for workers in (int(w) for w in a.workers.split(",")):
+        fake = FakeDropbox(rtt_ms=a.rtt_ms, connect_ms=0, token_ms=0, bandwidth_mbps=a.mbps)
+        fake.drop_next = ["files/upload_session/append_v2"] * a.drop
+        dc.create_session = lambda *args, **kw: fake.session()
+        dc.DropboxClient.reset_shared()
+        client = dc.DropboxClient("k", "s", "r")
+
+        t0 = time.perf_counter()
+        md = client.upload_stream("/bench/big.bin", io.BytesIO(data), len(data), workers=workers)
+        secs = time.perf_counter() - t0
+        assert md.size == len(data), (md.size, len(data))
+        print(f"{workers:>8}{secs:>10.2f}{a.size_mb / secs:>9.1f}"
+              f"{fake.calls['files/upload_session/append_v2']:>9}"
+              f"{fake.calls['dropped files/upload_session/append_v2']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+# bench/fake_dropbox.py
+"""
+In-process stand-in for the Dropbox HTTP API, used by the local benchmarks.
+
+It plugs in as a `requests` transport adapter, so the real SDK (and
+lib.dropbox_client) run unchanged. Latency is modelled explicitly:
+`connect_ms` is charged the first time a given adapter talks to a host
+(a cold TCP + TLS handshake on a fresh pool), `rtt_ms` on every request,
+and request bodies take `len / bandwidth_mbps` on top when that is set (a
+per-connection cap, so parallel requests add up). Routes listed in
+`drop_next` fail once each with a ConnectionError before reaching the
+namespace.
+
+Two instances stand in for two accounts: copy references minted by one can
+be saved by another (unless `accept_copy_refs` is off), and files stored
+with `put()` keep their bytes so `files/download` can stream them.
+`files/get_thumbnail_batch` answers with deterministic bytes per file
+revision and size, roughly the size of a real JPEG thumbnail.
+"""
+import base64, hashlib, io, json, threading, time, uuid
+from collections import Counter
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from lib.content_hash import block_digests, combine
+
+
+# copy reference -> source file metadata, shared by every fake account
+_COPY_REFS: Dict[str, dict] = {}
+
+
+class _Download:
+    def __init__(self, md: dict, data: bytes):
+        self.md, self.data = md, data
+
+
+def _folder_md(path: str) -> dict:
+    return {".tag": "folder", "name": path.rsplit("/", 1)[-1], "id": f"id:{abs(hash(path.lower()))}",
+            "path_lower": path.lower(), "path_display": path}
+
+
+def _file_md(path: str, size: int, rev: str, content_hash: str = "0" * 64) -> dict:
+    return {".tag": "file", "name": path.rsplit("/", 1)[-1], "id": f"id:{abs(hash(path.lower()))}",
+            "path_lower": path.lower(), "path_display": path, "rev": rev, "size": size,
+            "client_modified": "2025-01-01T00:00:00Z", "server_modified": "2025-01-01T00:00:00Z",
+            "content_hash": content_hash}
+
+
+class FakeDropbox:
+    """
+    Shared namespace + call counters. Create one per benchmark run and hand
+    `session()` / `adapter()` to whatever needs an HTTP transport.
+    """
+
+    def __init__(self, rtt_ms: float = 20.0, connect_ms: float = 60.0, token_ms: float = 80.0,
+                 async_batches: bool = False, bandwidth_mbps: float = 0.0, folder_job_ms: float = 0.0):
+        self.rtt = rtt_ms / 1000.0
+        self.bandwidth = bandwidth_mbps * 1024 * 1024 / 8
+        self.connect = connect_ms / 1000.0
+        self.token = token_ms / 1000.0
+        self.folders = {""}
+        self.files: Dict[str, dict] = {}
+        self.calls = Counter()
+        self.async_batches = async_batches
+        # an async create_folder_batch job runs this long per entry before /check reports it complete
+        self.folder_job_ms = folder_job_ms
+        self._jobs: Dict[str, list] = {}
+        self.log: list = []  # change feed for list_folder/continue
+        self.sessions: Dict[str, dict] = {}  # upload sessions: offset + received ranges
+        self.page_size = 2000
+        self.drop_next: list = []
+        self.blobs: Dict[str, bytes] = {}  # file bytes, for files stored with put()
+        self.accept_copy_refs = True
+        self.throttle = None  # bench.fake_throttle.Throttle: 429 too_many_requests above its rate
+        self._lock = threading.Lock()
+
+    # ---------- transport ----------
+    def adapter(self) -> "FakeAdapter":
+        return FakeAdapter(self)
+
+    def session(self) -> requests.Session:
+        s = requests.Session()
+        s.mount("https://", self.adapter())
+        return s
+
+    # ---------- namespace helpers ----------
+    def _exists_folder(self, path: str) -> bool:
+        return path.lower().rstrip("/") in self.folders
+
+    def _mkdirs(self, path: str):
+        parts = path.rstrip("/").split("/")
+        for i in range(2, len(parts) + 1):
+            p = "/".join(parts[:i])
+            if p.lower() not in self.folders:
+                self.folders.add(p.lower())
+                self.log.append(_folder_md(p))
+
+    def put(self, path: str, data: bytes) -> dict:
+        """Test hook: store a file (bytes kept for downloads) out-of-band."""
+        with self._lock:
+            self._mkdirs(path.rsplit("/", 1)[0])
+            md = _file_md(path, len(data), uuid.uuid4().hex[:16], combine(block_digests(data)))
+            self.files[path.lower()] = md
+            self.blobs[path.lower()] = data
+            self.log.append(md)
+            return md
+
+    def move(self, src: str, dst: str):
+        """Test hook: move a file or folder out-of-band; files keep their id, as in Dropbox."""
+        with self._lock:
+            k, d = src.lower().rstrip("/"), dst.rstrip("/")
+            self._mkdirs(d.rsplit("/", 1)[0])
+            self.log.append({".tag": "deleted", "name": k.rsplit("/", 1)[-1], "path_lower": k, "path_display": src})
+            for f in sorted(f for f in self.folders if f == k or f.startswith(k + "/")):
+                self.folders.discard(f)
+                new = d + f[len(k):]
+                self.folders.add(new.lower())
+                self.log.append(_folder_md(new))
+            for f in sorted(f for f in self.files if f == k or f.startswith(k + "/")):
+                new = d + f[len(k):]
+                md = dict(self.files.pop(f), name=new.rsplit("/", 1)[-1], path_lower=new.lower(), path_display=new)
+                self.files[new.lower()] = md
+                if f in self.blobs:
+                    self.blobs[new.lower()] = self.blobs.pop(f)
+                self.log.append(md)
+
+    def delete(self, path: str):
+        """Test hook: remove a folder/file (and descendants) out-of-band."""
+        with self._lock:
+            k = path.lower().rstrip("/")
+            for f in [f for f in self.folders if f == k or f.startswith(k + "/")]:
+                self.folders.discard(f)
+            for f in [f for f in self.files if f.startswith(k + "/") or f == k]:
+                del self.files[f]
+            self.log.append({".tag": "deleted", "name": k.rsplit("/", 1)[-1], "path_lower": k, "path_display": path})
+
+    def _page(self, entries: list, start: int, end_cursor: int, limit: int):
+        page = entries[start:start + limit]
+        more = start + limit < len(entries)
+        return {"entries": page, "cursor": f"{end_cursor}:{start + limit if more else -1}", "has_more": more}
+
+    # ---------- routes ----------
+    def handle(self, route: str, arg: dict, body: bytes):
+        """Returns (status, payload) for one API call."""
+        if route == "oauth2/token":
+            time.sleep(self.token)
+        with self._lock:
+            self.calls[route] += 1
+            if route == "oauth2/token":
+                return 200, {"access_token": uuid.uuid4().hex, "expires_in": 14400, "token_type": "bearer"}
+            if self.throttle is not None and not self.throttle.allow():
+                self.calls[f"throttled {route}"] += 1
+                return 429, {"error_summary": "too_many_requests/..",
+                             "error": {"reason": {".tag": "too_many_requests"},
+                                       "retry_after": int(self.throttle.retry_after)}}
+
+            if route == "files/get_metadata":
+                p = arg["path"]
+                if self._exists_folder(p):
+                    return 200, _folder_md(p)
+                if p.lower() in self.files:
+                    return 200, self.files[p.lower()]
+                return 409, _path_error("not_found")
+
+            if route == "files/create_folder_v2":
+                p = arg["path"]
+                if self._exists_folder(p) or p.lower() in self.files:
+                    kind = "file" if p.lower() in self.files else "folder"
+                    return 409, _path_error("conflict", nested={".tag": kind})
+                self._mkdirs(p)
+                return 200, {"metadata": _folder_md(p)}
+
+            if route == "files/create_folder_batch":
+                entries = []
+                for p in arg["paths"]:
+                    if self._exists_folder(p) or p.lower() in self.files:
+                        kind = "file" if p.lower() in self.files else "folder"
+                        entries.append({".tag": "failure", "failure": _path_error("conflict", nested={".tag": kind})["error"]})
+                    else:
+                        self._mkdirs(p)
+                        entries.append({".tag": "success", "metadata": _folder_md(p)})
+                if self.async_batches or arg.get("force_async"):
+                    job = uuid.uuid4().hex
+                    self._jobs[job] = [1, {".tag": "complete", "entries": entries},
+                                       time.monotonic() + len(entries) * self.folder_job_ms / 1000]
+                    return 200, {".tag": "async_job_id", "async_job_id": job}
+                return 200, {".tag": "complete", "entries": entries}
+
+            if route == "files/move_batch_v2":
+                results = []
+                for e in arg["entries"]:
+                    src, dst = e["from_path"].lower().rstrip("/"), e["to_path"]
+                    if src not in self.folders:
+                        results.append({".tag": "failure", "failure": {".tag": "relocation_error", "relocation_error":
+                                        {".tag": "from_lookup", "from_lookup": {".tag": "not_found"}}}})
+                        continue
+                    moved = [f for f in self.folders if f == src or f.startswith(src + "/")]
+                    self.folders.difference_update(moved)
+                    for f in moved:
+                        self.folders.add(dst.lower() + f[len(src):])
+                    self._mkdirs(dst)
+                    results.append({".tag": "success", "success": _folder_md(dst)})
+                job = uuid.uuid4().hex
+                self._jobs[job] = [1, {".tag": "complete", "entries": results}]
+                return 200, {".tag": "async_job_id", "async_job_id": job}
+
+            if route.endswith("/check") or route.endswith("/check_v2"):
+                job = self._jobs.get(arg["async_job_id"])
+                if job is None:
+                    return 409, {"error_summary": "invalid_async_job_id/..", "error": {".tag": "invalid_async_job_id"}}
+                if job[0] > 0 or (len(job) > 2 and time.monotonic() < job[2]):
+                    job[0] -= 1
+                    return 200, {".tag": "in_progress"}
+                return 200, job[1]
+
+            if route == "files/list_folder":
+                root = arg["path"].lower().rstrip("/")
+                if root and root not in self.folders:
+                    return 409, _path_error("not_found")
+                entries = [_folder_md(f) for f in sorted(self.folders) if f.startswith(root + "/")]
+                entries += [md for k, md in sorted(self.files.items()) if k.startswith(root + "/")]
+                self._listing = entries
+                return 200, self._page(entries, 0, len(self.log), arg.get("limit") or self.page_size)
+
+            if route == "files/list_folder/continue":
+                version, pos = (int(x) for x in arg["cursor"].split(":"))
+                if pos >= 0:  # still paging through the initial listing
+                    return 200, self._page(self._listing, pos, version, self.page_size)
+                changes = self.log[version:version + self.page_size]
+                end = version + len(changes)
+                return 200, {"entries": changes, "cursor": f"{end}:-1", "has_more": end < len(self.log)}
+
+            if route == "files/list_folder/get_latest_cursor":
+                return 200, {"cursor": f"{len(self.log)}:-1"}
+
+            if route == "files/upload":
+                p = arg["path"]
+                parent = p.rsplit("/", 1)[0]
+                self._mkdirs(parent)
+                md = _file_md(p, len(body), uuid.uuid4().hex[:16], combine(block_digests(body)))
+                self.files[p.lower()] = md
+                self.log.append(md)
+                return 200, md
+
+            if route == "files/upload_session/start":
+                sid = uuid.uuid4().hex
+                self.sessions[sid] = {"offset": len(body), "concurrent": bool(arg.get("session_type")),
+                                      "ranges": {0: (len(body), block_digests(body))} if body else {}}
+                return 200, {"session_id": sid}
+
+            if route in ("files/upload_session/append_v2", "files/upload_session/finish"):
+                cur = arg["cursor"]
+                sess = self.sessions.get(cur["session_id"])
+                if sess is None:
+                    return 409, {"error_summary": "not_found/..", "error": {".tag": "not_found"}}
+                if not sess["concurrent"] and cur["offset"] != sess["offset"]:
+                    return 409, {"error_summary": "incorrect_offset/..",
+                                 "error": {".tag": "incorrect_offset", "correct_offset": sess["offset"]}}
+                if sess["concurrent"] and len(body) % (4 * 1024 * 1024) and not arg.get("close"):
+                    return 409, {"error_summary": "concurrent_session_invalid_data_size/..",
+                                 "error": {".tag": "concurrent_session_invalid_data_size"}}
+                if body:
+                    sess["ranges"][cur["offset"]] = (len(body), block_digests(body))
+                sess["offset"] = max(sess["offset"], cur["offset"] + len(body))
+                if route.endswith("append_v2"):
+                    return 200, None
+                del self.sessions[cur["session_id"]]
+                p = arg["commit"]["path"]
+                self._mkdirs(p.rsplit("/", 1)[0])
+                parts = [sess["ranges"][o] for o in sorted(sess["ranges"])]
+                md = _file_md(p, sum(n for n, _ in parts), uuid.uuid4().hex[:16],
+                              combine(d for _, ds in parts for d in ds))
+                self.files[p.lower()] = md
+                self.log.append(md)
+                return 200, md
+
+            if route == "files/copy_v2":
+                src, dst = arg["from_path"], arg["to_path"]
+                if src.lower() not in self.files:
+                    return 409, {"error_summary": "from_lookup/not_found/..",
+                                 "error": {".tag": "from_lookup", "from_lookup": {".tag": "not_found"}}}
+                self._mkdirs(dst.rsplit("/", 1)[0])
+                old = self.files[src.lower()]
+                md = _file_md(dst, old["size"], uuid.uuid4().hex[:16], old["content_hash"])
+                self.files[dst.lower()] = md
+                self.log.append(md)
+                return 200, {"metadata": md}
+
+            if route == "files/copy_reference/get":
+                md = self.files.get(arg["path"].lower())
+                if md is None:
+                    return 409, _path_error("not_found")
+                ref = uuid.uuid4().hex
+                _COPY_REFS[ref] = dict(md, _blob=self.blobs.get(arg["path"].lower()))
+                return 200, {"metadata": md, "copy_reference": ref, "expires": "2030-01-01T00:00:00Z"}
+
+            if route == "files/copy_reference/save":
+                src = _COPY_REFS.get(arg["copy_reference"])
+                if src is None or not self.accept_copy_refs:
+                    tag = "invalid_copy_reference" if src is None else "no_permission"
+                    return 409, {"error_summary": f"{tag}/..", "error": {".tag": tag}}
+                p = arg["path"]
+                if p.lower() in self.files or self._exists_folder(p):
+                    return 409, {"error_summary": "path/conflict/file/..", "error": {
+                        ".tag": "path", "path": {".tag": "conflict", "conflict": {".tag": "file"}}}}
+                self._mkdirs(p.rsplit("/", 1)[0])
+                md = _file_md(p, src["size"], uuid.uuid4().hex[:16], src["content_hash"])
+                self.files[p.lower()] = md
+                if src["_blob"] is not None:
+                    self.blobs[p.lower()] = src["_blob"]
+                self.log.append(md)
+                return 200, {"metadata": md}
+
+            if route == "files/download":
+                p = arg["path"]
+                md = self.files.get(p.lower())
+                if md is None:
+                    return 409, _path_error("not_found")
+                return 200, _Download(md, self.blobs.get(p.lower(), bytes(md["size"])))
+
+            if route == "files/get_thumbnail_batch":
+                out = []
+                for e in arg["entries"]:
+                    md = self.files.get(e["path"].lower())
+                    if md is None:
+                        out.append({".tag": "failure", "failure": {".tag": "path", "path": {".tag": "not_found"}}})
+                        continue
+                    size = e.get("size", {}).get(".tag", "w64h64")
+                    w, h = (int(x) for x in size[1:].split("h"))
+                    seed = hashlib.sha256(f"{md['rev']}|{size}".encode()).digest()
+                    thumb = (seed * (w * h // 5 // len(seed) + 1))[:w * h // 5]
+                    out.append({".tag": "success", "metadata": md, "thumbnail": base64.b64encode(thumb).decode()})
+                return 200, {"entries": out}
+
+            if route == "files/get_temporary_link":
+                p = arg["path"]
+                if p.lower() not in self.files:
+                    return 409, _path_error("not_found")
+                return 200, {"metadata": self.files[p.lower()], "link": f"https://dl.example/{uuid.uuid4().hex}"}
+
+        return 400, {"error_summary": f"unsupported route {route}"}
+
+
+def _path_error(tag: str, nested: Optional[dict] = None) -> dict:
+    inner = {".tag": tag}
+    if nested:
+        inner[tag] = nested
+    return {"error_summary": f"path/{tag}/..", "error": {".tag": "path", "path": inner}}
+
+
+class FakeAdapter(BaseAdapter):
+    """One adapter == one connection pool; first use per host pays `connect`."""
+
+    def __init__(self, fake: FakeDropbox):
+        super().__init__()
+        self.fake = fake
+        self._warm = set()
+        self._lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        host = request.url.split("/", 3)[2]
+        with self._lock:
+            cold = host not in self._warm
+            self._warm.add(host)
+        route = request.url.split("/", 3)[3]
+        route = route[2:] if route.startswith("2/") else route
+        body = request.body or b""
+        if isinstance(body, str):
+            body = body.encode()
+        wire = len(body) / self.fake.bandwidth if self.fake.bandwidth else 0.0
+        time.sleep(self.fake.rtt + wire + (self.fake.connect if cold else 0.0))
+        with self.fake._lock:
+            if route in self.fake.drop_next:
+                self.fake.drop_next.remove(route)
+                self.fake.calls[f"dropped {route}"] += 1
+                raise requests.exceptions.ConnectionError(f"fake dropped {route}")
+
+        arg_hdr = request.headers.get("Dropbox-API-Arg")
+        if arg_hdr:
+            arg = json.loads(arg_hdr)
+        elif route == "oauth2/token" or not body:
+            arg = {}
+        else:
+            arg = json.loads(body)
+            body = b""
+        status, payload = self.fake.handle(route, arg, body)
+
+        resp = requests.Response()
+        resp.status_code = status
+        if isinstance(payload, _Download):
+            # content route: metadata in a header, bytes as a streamable body
+            if self.fake.bandwidth:
+                time.sleep(len(payload.data) / self.fake.bandwidth)
+            resp.headers = CaseInsensitiveDict({"content-type": "application/octet-stream",
+                                                "dropbox-api-result": json.dumps(payload.md)})
+            resp.raw = io.BytesIO(payload.data)
+            resp.request = request
+            resp.url = request.url
+            return resp
+        resp.headers = CaseInsensitiveDict({"content-type": "application/json"})
+        resp._content = json.dumps(payload).encode()
+        if self.fake.bandwidth:
+            time.sleep(len(resp._content) / self.fake.bandwidth)
+        resp.request = request
+        resp.url = request.url
+        resp.encoding = "utf-8"
+        return resp
+
+    def close(self):
+        pass
@@ -0,0 +1,275 @@
+# bench/fake_postgrest.py
+"""
+In-process PostgREST stand-in for the local benchmarks.
+
+`FakePostgrest.transport()` is an httpx transport, so code under test keeps
+building real requests against `SUPABASE_URL`. Supports the subset of the
+PostgREST query language the functions use: column projection, `eq`, `neq`,
+`gt`, `gte`, `lt`, `lte`, `in`, `is`, `like`/`ilike`, `and=(...)`, `order`, `limit`,
+`offset`, bulk inserts, upserts (`resolution=merge-duplicates` /
+`ignore-duplicates`), PATCH, DELETE and `/rpc/<fn>` via registered handlers.
+Tables registered with `columns` reject unknown columns, and NULLs in
+`required` ones, with PostgREST's 400s; others accept anything.
+"""
+import bisect, itertools, json, re, threading, time
+from collections import Counter
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import parse_qsl
+
+import httpx
+
+
+def _coerce(v: str, like):
+    if isinstance(like, bool):
+        return v.lower() == "true"
+    if isinstance(like, int):
+        try: return int(v)
+        except ValueError: return v
+    if isinstance(like, float):
+        return float(v)
+    return v
+
+
+def _like(val: str, pat: str, fold: bool) -> bool:
+    """SQL LIKE with PostgREST's * for %: % and * match any run, _ one character, \\ escapes."""
+    rx, chars = [], iter(pat)
+    for ch in chars:
+        if ch == "\\":
+            rx.append(re.escape(next(chars, "")))
+        elif ch in "*%":
+            rx.append(".*")
+        elif ch == "_":
+            rx.append(".")
+        else:
+            rx.append(re.escape(ch))
+    return re.fullmatch("".join(rx), val, re.S | (re.I if fold else 0)) is not None
+
+
+def _match(row: dict, col: str, expr: str) -> bool:
+    op, _, arg = expr.partition(".")
+    val = row.get(col)
+    if op == "is":
+        return val is None if arg == "null" else val == (arg == "true")
+    if op == "in":
+        items = [x.strip().strip('"') for x in arg.strip("()").split(",") if x.strip()]
+        return val is not None and str(val) in items
+    if val is None:
+        return False
+    if op in ("like", "ilike"):
+        return _like(str(val), arg, op == "ilike")
+    other = _coerce(arg, val)
+    return {"eq": val == other, "neq": val != other, "gt": val > other, "gte": val >= other,
+            "lt": val < other, "lte": val <= other}[op]
+
+
+_RESERVED = ("select", "order", "limit", "offset", "on_conflict")
+
+# file_assets as db/migrations leave it (001_init, V2, V12, V17).
+FILE_ASSETS_COLUMNS = ("id", "entity_type", "entity_id", "original_filename", "stored_filename", "dropbox_path",
+                       "content_hash", "size_bytes", "uploaded_by", "created_at", "property_id", "unit_id",
+                       "lease_id", "log_id", "dropbox_id", "dropbox_rev", "deleted_at", "synced_at",
+                       "dropbox_path_lower")
+FILE_ASSETS_REQUIRED = ("entity_type", "entity_id", "original_filename", "stored_filename", "dropbox_path")
+
+
+def _filters(q) -> list:
+    """(column, "op.arg") pairs, with `and=(a.op.x,b.op.y)` flattened."""
+    out = []
+    for c, e in q:
+        if c == "and":
+            for part in e.strip("()").split(","):
+                col, _, expr = part.partition(".")
+                out.append((col, expr))
+        elif c not in _RESERVED:
+            out.append((c, e))
+    return out
+
+
+class FakePostgrest:
+    def __init__(self, latency_ms: float = 0.0, connect_ms: float = 0.0):
+        self.latency = latency_ms / 1000.0
+        self.connect = connect_ms / 1000.0
+        self.tables: Dict[str, List[dict]] = {}
+        self.keys: Dict[str, str] = {}
+        self.columns: Dict[str, Tuple[set, tuple]] = {}  # table -> (known columns, NOT NULL columns)
+        self.rpcs: Dict[str, Callable[[dict], object]] = {}
+        self.calls = Counter()
+        self.fail_next: List[int] = []  # status codes to return for the next requests
+        self.throttle = None  # bench.fake_throttle.Throttle: 429 + Retry-After above its rate
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def table(self, name: str, rows=(), key: str = "id", columns=None, required=()) -> List[dict]:
+        self.tables[name] = list(rows)
+        self.keys[name] = key
+        if columns:
+            self.columns[name] = (set(columns), tuple(required))
+        return self.tables[name]
+
+    def _reject(self, path: str, body: List[dict]):
+        """PostgREST's 400 for a write it would refuse, or None."""
+        known, required = self.columns.get(path, (None, ()))
+        if known is None:
+            return None
+        for b in body:
+            for c in b:
+                if c not in known:
+                    return httpx.Response(400, json={"code": "PGRST204", "message":
+                                                     f"Could not find the '{c}' column of '{path}' in the schema cache"})
+            for c in required:
+                if b.get(c) is None:
+                    return httpx.Response(400, json={"code": "23502", "message":
+                                                     f'null value in column "{c}" violates not-null constraint'})
+        return None
+
+    def rpc(self, name: str):
+        def deco(fn):
+            self.rpcs[name] = fn
+            return fn
+        return deco
+
+    # ---------- transport ----------
+    def transport(self) -> httpx.MockTransport:
+        warm = set()
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            # one MockTransport per client: its first request pays connect
+            cold = not warm
+            warm.add(True)
+            time.sleep(self.latency + (self.connect if cold else 0.0))
+            return self.handle(request)
+        return httpx.MockTransport(handler)
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path.split("/rest/v1/", 1)[-1]
+        q = parse_qsl(request.url.query.decode(), keep_blank_values=True)
+        with self._lock:
+            self.calls[f"{request.method} {path}"] += 1
+            if self.throttle is not None and not self.throttle.allow():
+                self.calls[f"throttled {request.method} {path}"] += 1
+                return httpx.Response(429, headers={"retry-after": str(self.throttle.retry_after)},
+                                      json={"message": "rate limit exceeded"})
+            if self.fail_next:
+                status = self.fail_next.pop(0)
+                return httpx.Response(status, headers={"retry-after": "0"}, json={"message": "injected"})
+            if path.startswith("rpc/"):
+                fn = self.rpcs.get(path[4:])
+                if fn is None:
+                    return httpx.Response(404, json={"message": f"function {path[4:]} not found"})
+                args = json.loads(request.content or b"{}")
+                out = fn(args)
+                # a handler may answer with its own error response
+                return out if isinstance(out, httpx.Response) else httpx.Response(200, json=out)
+            rows = self.tables.setdefault(path, [])
+            key = self.keys.setdefault(path, "id")
+            prefer = request.headers.get("prefer", "")
+
+            if request.method == "GET":
+                known = self.columns.get(path, (None,))[0]
+                unknown = [c for c, _ in _filters(q) if known is not None and c not in known]
+                if unknown:
+                    return httpx.Response(400, json={"code": "42703",
+                                                     "message": f"column {path}.{unknown[0]} does not exist"})
+                return httpx.Response(200, json=self._select(rows, q, key))
+
+            if request.method == "POST":
+                body = json.loads(request.content)
+                body = body if isinstance(body, list) else [body]
+                rejected = self._reject(path, body)
+                if rejected is not None:
+                    return rejected
+                on_conflict = dict(q).get("on_conflict", key)
+                out = []
+                for b in body:
+                    b = dict(b)
+                    if key == "id" and "id" not in b:
+                        b["id"] = next(self._ids)
+                    hit = next((r for r in rows if r.get(on_conflict) == b.get(on_conflict)), None)
+                    if hit is not None:
+                        if "merge-duplicates" in prefer:
+                            hit.update(b); out.append(hit)
+                        elif "ignore-duplicates" in prefer:
+                            continue
+                        else:
+                            return httpx.Response(409, json={"code": "23505", "message": "duplicate key"})
+                    else:
+                        rows.append(b); out.append(b)
+                if "return=representation" in prefer:
+                    return httpx.Response(201, json=self._project(out, dict(q).get("select", "*")))
+                return httpx.Response(201)
+
+            filt = _filters(q)
+            hits = [r for r in rows if all(_match(r, c, e) for c, e in filt)]
+            if request.method == "PATCH":
+                rejected = self._reject(path, [json.loads(request.content)])
+                if rejected is not None:
+                    return rejected
+                patch = json.loads(request.content)
+                for r in hits:
+                    r.update(patch)
+            elif request.method == "DELETE":
+                ids = {id(r) for r in hits}
+                rows[:] = [r for r in rows if id(r) not in ids]
+            if "return=representation" in prefer:
+                return httpx.Response(200, json=hits)
+            return httpx.Response(204)
+
+    # ---------- query helpers ----------
+    @staticmethod
+    def _project(rows, select):
+        if select in ("", "*"):
+            return rows
+        cols = [c.strip() for c in select.split(",")]
+        return [{c: r.get(c) for c in cols} for r in rows]
+
+    def _select(self, rows, q, key="id"):
+        params = dict(q)
+        filt = _filters(q)
+        # keyset fast path: rows are kept in insertion (= key) order
+        ks = [e for c, e in filt if c == key and e.startswith("gt.")]
+        if ks and params.get("order", "").startswith(f"{key}.asc") and rows and isinstance(rows[0].get(key), int):
+            rows = rows[bisect.bisect_right(rows, int(ks[0][3:]), key=lambda r: r[key]):]
+            filt = [(c, e) for c, e in filt if not (c == key and e == ks[0])]
+        hits = [r for r in rows if all(_match(r, c, e) for c, e in filt)]
+        if "order" in params:
+            col, _, direction = params["order"].split(",")[0].partition(".")
+            hits.sort(key=lambda r: (r.get(col) is None, r.get(col)), reverse=direction.startswith("desc"))
+        off = int(params.get("offset", 0))
+        hits = hits[off:]
+        if "limit" in params:
+            hits = hits[:int(params["limit"])]
+        return self._project(hits, params.get("select", "*"))
+
+
+def serve(fake: FakePostgrest, port: int = 0):
+    """
+    Binds an HTTP server for `fake` on 127.0.0.1 (port 0 picks a free one) and
+    returns it; call `serve_forever()` on it. Used when the client must not
+    share a process with the stand-in, e.g. RSS benchmarks.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _do(self):
+            n = int(self.headers.get("content-length") or 0)
+            body = self.rfile.read(n) if n else b""
+            req = httpx.Request(self.command, f"http://fake{self.path}", headers=dict(self.headers), content=body)
+            time.sleep(fake.latency)
+            res = fake.handle(req)
+            data = res.content
+            self.send_response(res.status_code)
+            for k, v in res.headers.items():
+                if k.lower() not in ("content-length", "transfer-encoding"):
+                    self.send_header(k, v)
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = do_PATCH = do_DELETE = _do
+
+        def log_message(self, *args):
+            pass
+
+    return ThreadingHTTPServer(("127.0.0.1", port), Handler)
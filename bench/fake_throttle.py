@@ -0,0 +1,29 @@
+# bench/fake_throttle.py
+"""
+Server-side rate limit for the fakes: `FakeDropbox.throttle` and
+`FakePostgrest.throttle` refuse requests above `rps` (bursts of `burst`)
+with a 429 carrying `retry_after`, like the real services do.
+"""
+import threading, time
+
+
+class Throttle:
+    def __init__(self, rps: float, burst: float = 0.0, retry_after: float = 1.0):
+        self.rps = rps
+        self.burst = burst or max(rps / 10, 1.0)
+        self.retry_after = retry_after
+        self.refused = 0
+        self._tokens = self.burst
+        self._at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._at) * self.rps)
+            self._at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            self.refused += 1
+            return False
@@ -0,0 +1,251 @@
+# bench/outbox_pg.py
+"""
+Provisioning outbox (migration V16, lib/provisioning_outbox.py) against a
+real local Postgres, with the fake Dropbox on the other side. Needs a
+throwaway database and psycopg 3 (`pip install "psycopg[binary]"`; a
+harness dependency only, not deployed):
+
+    docker run --rm -d -p 5432:5432 -e POSTGRES_PASSWORD=pg postgres:16
+    python -m bench.outbox_pg --dsn postgresql://postgres:pg@localhost:5432/postgres
+
+Creates minimal public.properties/units/leases where missing, then:
+
+1. insert latency from `--writers` concurrent writers with the old
+   synchronous trigger (a pg_sleep of `--http-ms` standing in for the
+   extensions.http round trip) vs the V16 outbox trigger;
+2. `--consumers` concurrent lib.provisioning_outbox.run() calls drain the
+   outbox: every row done, each claimed exactly once (skip locked);
+3. a Dropbox outage during the first batch: rows back off and are done on
+   their second claim;
+4. poison rows: an entity type pathmap can't route is dead at once, a
+   folder Dropbox always refuses is dead after MAX_ATTEMPTS;
+5. a consumer that claims and dies: its rows are claimed again once the
+   lease runs out, and its late write-back changes nothing.
+
+Each step asserts on the table's final state; exits non-zero on the first failure.
+"""
+import argparse, logging, os, statistics, threading, time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.update(DROPBOX_APP_KEY="k", DROPBOX_APP_SECRET="s", DROPBOX_REFRESH_TOKEN="r")
+
+try:
+    import psycopg
+    from psycopg.rows import dict_row
+    from psycopg.types.json import Jsonb
+except ImportError:  # pragma: no cover
+    raise SystemExit('bench.outbox_pg needs psycopg 3: pip install "psycopg[binary]"')
+
+import lib.dropbox_client as dc
+from bench.fake_dropbox import FakeDropbox
+from lib import provisioning_outbox as outbox
+
+MIGRATION = os.path.join(os.path.dirname(__file__), "..", "db", "migrations", "V16__provisioning_outbox.sql")
+
+SETUP = """
+create table if not exists public.properties (id bigserial primary key, name text,
+                                              created_at timestamptz default now());
+create table if not exists public.units (id bigserial primary key, unit_number text,
+                                         created_at timestamptz default now());
+create table if not exists public.leases (id bigserial primary key, property_id bigint, unit_id bigint,
+                                          status text default 'active', created_at timestamptz default now());
+do $$ begin create role service_role; exception when duplicate_object then null; end $$;
+"""
+
+# The 002 trigger shape, with the HTTP call replaced by a sleep of the same length.
+SYNC_TRIGGERS = """
+create or replace function public.notify_dropbox_sync() returns trigger language plpgsql as $$
+begin
+  perform pg_sleep({seconds});
+  return NEW;
+end $$;
+drop trigger if exists t_dropbox_property on public.properties;
+create trigger t_dropbox_property after insert on public.properties for each row execute function public.notify_dropbox_sync();
+drop trigger if exists t_dropbox_unit on public.units;
+create trigger t_dropbox_unit after insert on public.units for each row execute function public.notify_dropbox_sync();
+drop trigger if exists t_dropbox_lease on public.leases;
+create trigger t_dropbox_lease after insert on public.leases for each row execute function public.notify_dropbox_sync();
+"""
+
+INSERTS = [
+    ("insert into public.properties (name) values (%s)", lambda i: (f"Sunset Villas {i}",)),
+    ("insert into public.units (unit_number) values (%s)", lambda i: (f"{i}B",)),
+    ("insert into public.leases (property_id, unit_id) values (%s, %s)", lambda i: (i, i)),
+]
+
+
+def _connect(dsn):
+    return psycopg.connect(dsn, autocommit=True, row_factory=dict_row)
+
+
+def _rpc(conn, seen: Counter = None):
+    """supabase.rpc over a psycopg connection: setof functions give rows, scalar ones their value."""
+    lock = threading.Lock()
+
+    def call(fn, args):
+        sig = ", ".join(f"{k} => %({k})s" for k in args)
+        params = {k: Jsonb(v) if isinstance(v, (list, dict)) else v for k, v in args.items()}
+        with lock:
+            rows = conn.execute(f"select * from public.{fn}({sig})", params).fetchall()
+        if len(rows) == 1 and list(rows[0]) == [fn]:
+            return rows[0][fn]
+        if seen is not None and fn == "provisioning_outbox_claim":
+            seen.update(r["id"] for r in rows)
+        return rows
+    return call
+
+
+class _Dropbox:
+    """DropboxClient with scripted failures: `outages` whole-batch errors, then paths containing `refuse` fail."""
+
+    def __init__(self, client):
+        self.client, self.outages, self.refuse = client, 0, ()
+        self._lock = threading.Lock()
+
+    def create_folders(self, paths, **kw):
+        with self._lock:
+            down, self.outages = self.outages > 0, max(self.outages - 1, 0)
+        if down:
+            raise RuntimeError("simulated Dropbox outage")
+        bad = [p for p in paths if any(s in p for s in self.refuse)]
+        out = self.client.create_folders([p for p in paths if p not in bad], **kw)
+        out.update({p: "error: path/disallowed_name" for p in bad})
+        return out
+
+
+def _status(conn) -> dict:
+    return {r["status"]: r["n"] for r in
+            conn.execute("select status, count(*) as n from public.provisioning_outbox group by status")}
+
+
+def _reset(conn):
+    conn.execute("truncate public.provisioning_outbox restart identity")
+
+
+def _check(cond, what):
+    if not cond:
+        raise SystemExit(f"FAIL: {what}")
+    print(f"  ok: {what}")
+
+
+def _insert_latency(dsn, rows, writers) -> list:
+    def write(k):
+        lat = []
+        with _connect(dsn) as conn:
+            for i in range(k, rows, writers):
+                sql, args = INSERTS[i % len(INSERTS)]
+                t0 = time.perf_counter()
+                conn.execute(sql, args(i))
+                lat.append((time.perf_counter() - t0) * 1000)
+        return lat
+    with ThreadPoolExecutor(max_workers=writers) as pool:
+        return [ms for part in pool.map(write, range(writers)) for ms in part]
+
+
+def _report_latency(name, lat, secs):
+    q = statistics.quantiles(lat, n=100)
+    print(f"{name:<30} p50 {q[49]:7.1f} ms  p95 {q[94]:7.1f} ms  {len(lat) / secs:8.0f} inserts/s")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dsn", default=os.getenv("OUTBOX_PG_DSN", "postgresql://postgres@localhost:5432/postgres"))
+    ap.add_argument("--rows", type=int, default=600, help="inserts per latency run")
+    ap.add_argument("--writers", type=int, default=8)
+    ap.add_argument("--http-ms", type=float, default=250, help="old trigger's Function + Dropbox round trip")
+    ap.add_argument("--consumers", type=int, default=4)
+    ap.add_argument("--batch", type=int, default=50)
+    ap.add_argument("--rtt-ms", type=float, default=20)
+    a = ap.parse_args()
+    logging.disable(logging.ERROR)
+
+    fake = FakeDropbox(rtt_ms=a.rtt_ms, connect_ms=0, token_ms=0, async_batches=True)
+    dc.create_session = lambda *args, **kw: fake.session()
+    dc.DropboxClient.reset_shared()
+    dc.JOB_POLL_INTERVAL = 0.02
+    dbx = _Dropbox(dc.DropboxClient.from_env())
+    outbox.BATCH = a.batch
+
+    admin = _connect(a.dsn)
+    admin.execute(SETUP)
+
+    print(f"1) {a.rows} inserts from {a.writers} writers")
+    admin.execute(SYNC_TRIGGERS.format(seconds=a.http_ms / 1000))
+    t0 = time.perf_counter()
+    lat = _insert_latency(a.dsn, a.rows, a.writers)
+    _report_latency(f"before: sync trigger ({a.http_ms:.0f} ms)", lat, time.perf_counter() - t0)
+    with open(MIGRATION) as f:
+        admin.execute(f.read())
+    admin.execute("drop function if exists public.notify_dropbox_sync()")
+    _reset(admin)
+    t0 = time.perf_counter()
+    lat = _insert_latency(a.dsn, a.rows, a.writers)
+    _report_latency("after: outbox trigger", lat, time.perf_counter() - t0)
+    _check(_status(admin) == {"pending": a.rows}, f"{a.rows} pending outbox rows")
+
+    print(f"2) {a.consumers} consumers drain the outbox in batches of {a.batch}")
+    seen = Counter()
+    conns = [_connect(a.dsn) for _ in range(a.consumers)]
+    fake.calls.clear()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=a.consumers) as pool:
+        reports = list(pool.map(lambda i: outbox.run(dbx, 120, owner=f"consumer-{i}", rpc=_rpc(conns[i], seen)),
+                                range(a.consumers)))
+    secs = time.perf_counter() - t0
+    print(f"  {a.rows} rows in {secs:.2f} s, {sum(r['batches'] for r in reports)} batches, "
+          f"create_folder_batch={fake.calls['files/create_folder_batch']}, "
+          f"per consumer {[r['claimed'] for r in reports]}")
+    _check(_status(admin) == {"done": a.rows}, "every row done")
+    _check(len(seen) == a.rows and set(seen.values()) == {1}, "each row claimed exactly once")
+
+    print("3) Dropbox outage on the first batch")
+    _reset(admin)
+    outbox.RETRY_DELAY = 0
+    _insert_latency(a.dsn, 30, 1)
+    dbx.outages = 1
+    rpc = _rpc(conns[0])
+    first = outbox.run(dbx, 30, owner="consumer-0", rpc=rpc)
+    _check(first["retry"] == 30 and _status(admin) == {"pending": 30}, "outage: 30 rows back to pending")
+    outbox.run(dbx, 30, owner="consumer-0", rpc=rpc)
+    attempts = {r["attempts"] for r in admin.execute("select attempts from public.provisioning_outbox")}
+    _check(_status(admin) == {"done": 30} and attempts == {2}, "done on the second claim")
+
+    print(f"4) poison rows (MAX_ATTEMPTS={outbox.MAX_ATTEMPTS})")
+    _reset(admin)
+    admin.execute("insert into public.properties (name) values ('Poison Pill'), ('Fine Place')")
+    admin.execute("insert into public.provisioning_outbox (entity_type, entity_id, payload) "
+                  "values ('garage', 1, '{\"id\": 1}')")
+    dbx.refuse = ("poison-pill",)
+    for _ in range(outbox.MAX_ATTEMPTS + 1):
+        outbox.run(dbx, 30, owner="consumer-0", rpc=rpc)
+    rows = {r["entity_type"] + ":" + (r["payload"].get("name") or ""): r for r in
+            admin.execute("select entity_type, payload, status, attempts from public.provisioning_outbox")}
+    _check(rows["garage:"]["status"] == "dead" and rows["garage:"]["attempts"] == 1, "unroutable row dead at once")
+    _check(rows["property:Poison Pill"]["status"] == "dead"
+           and rows["property:Poison Pill"]["attempts"] == outbox.MAX_ATTEMPTS,
+           f"refused row dead after {outbox.MAX_ATTEMPTS} attempts")
+    _check(rows["property:Fine Place"]["status"] == "done", "its batch-mate done on the first claim")
+    dbx.refuse = ()
+
+    print("5) a consumer dies holding a claim")
+    _reset(admin)
+    _insert_latency(a.dsn, 10, 1)
+    lease, outbox.LEASE_SECONDS = outbox.LEASE_SECONDS, 1
+    held = outbox.claim("crashed", 10, rpc)
+    outbox.LEASE_SECONDS = lease
+    _check(len(held) == 10 and outbox.run(dbx, 30, owner="consumer-0", rpc=rpc)["claimed"] == 0,
+           "claimed rows invisible to other consumers while leased")
+    time.sleep(1.2)
+    _check(outbox.run(dbx, 30, owner="consumer-0", rpc=rpc)["done"] == 10, "reclaimed and done after the lease")
+    late = rpc("provisioning_outbox_finish", {"p_owner": "crashed", "p_results": [
+        {"id": r["id"], "status": "pending", "last_error": "late", "next_attempt_at": None} for r in held]})
+    _check(late == 0 and _status(admin) == {"done": 10}, "late write-back from the dead consumer ignored")
+
+    for c in conns:
+        c.close()
+    admin.close()
+
+
+if __name__ == "__main__":
+    main()
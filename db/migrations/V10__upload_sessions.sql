@@ -0,0 +1,53 @@
+-- db/migrations/V10__upload_sessions.sql
+-- Server-side state for resumable uploads (functions/upload_session).
+-- block_hashes maps 4 MB block index -> SHA-256 hex of that block; together
+-- they give the Dropbox content_hash at finish. committed_offset is the end
+-- of the unbroken run of blocks from 0, i.e. where a client should resume.
+create table if not exists public.upload_sessions (
+  session_id text primary key,          -- Dropbox upload session id
+  dest_path text not null,
+  size bigint not null,
+  block_hashes jsonb not null default '{}'::jsonb,
+  committed_offset bigint not null default 0,
+  result jsonb,                         -- finish response, kept for retried finishes
+  created_at timestamptz not null default now(),
+  expires_at timestamptz not null
+);
+
+create index if not exists idx_upload_sessions_expires on public.upload_sessions(expires_at);
+
+-- Merges newly appended block digests and pushes the expiry forward in one
+-- statement (the row lock serialises appends from different workers).
+-- Returns the updated row, or null if the session is unknown.
+create or replace function public.upload_session_ack(
+  p_session_id text,
+  p_hashes jsonb,
+  p_ttl_seconds integer default 86400
+) returns public.upload_sessions
+language plpgsql
+as $$
+declare
+  r public.upload_sessions;
+  n bigint := 0;
+begin
+  update public.upload_sessions
+     set block_hashes = block_hashes || p_hashes,
+         expires_at = now() + make_interval(secs => p_ttl_seconds)
+   where session_id = p_session_id
+  returning * into r;
+  if not found then
+    return null;
+  end if;
+
+  while r.block_hashes ? n::text loop
+    n := n + 1;
+  end loop;
+
+  update public.upload_sessions
+     set committed_offset = least(n * 4194304, size)
+   where session_id = p_session_id
+  returning * into r;
+  return r;
+end $$;
+
+grant execute on function public.upload_session_ack(text, jsonb, integer) to service_role;
@@ -0,0 +1,22 @@
+-- db/migrations/V11__idempotency_ttl.sql
+-- upload_requests doubles as the reservation for an in-flight upload:
+-- a row starts as status 'pending' with a short expiry and becomes 'done'
+-- with the stored response and a full-TTL expiry. Expired rows are ignored
+-- by the upload path and deleted by functions/idempotency_purge.
+alter table public.upload_requests alter column response drop not null;
+alter table public.upload_requests add column if not exists status text not null default 'done';
+alter table public.upload_requests add column if not exists expires_at timestamptz not null
+  default now() + interval '24 hours';
+
+create index if not exists idx_upload_requests_expires on public.upload_requests(expires_at);
+
+create or replace function public.purge_upload_requests() returns integer
+language sql
+as $$
+  with gone as (
+    delete from public.upload_requests where expires_at < now() returning 1
+  )
+  select count(*)::integer from gone;
+$$;
+
+grant execute on function public.purge_upload_requests() to service_role;
@@ -0,0 +1,8 @@
+-- db/migrations/V12__file_assets_log_id.sql
+-- file_assets rows are written behind the upload (lib/asset_log.py) and may
+-- be replayed from a local journal after an outage. Each row carries a
+-- client-generated log_id; the writer inserts with
+-- `on conflict (log_id) do nothing`, so a replay never duplicates a row.
+alter table public.file_assets add column if not exists log_id uuid;
+
+create unique index if not exists file_assets_log_id_key on public.file_assets (log_id);
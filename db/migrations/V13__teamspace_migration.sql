@@ -0,0 +1,91 @@
+-- db/migrations/V13__teamspace_migration.sql
+-- Job state for functions/migrate_to_teamspace (replaces the V6 placeholder).
+--
+-- file_assets ids are split into fixed-size shards (shard_id * size, (shard_id
+-- + 1) * size]. An invocation leases one open shard at a time, copies its
+-- assets into teamspace_migration, works the due rows and either closes the
+-- shard or releases it until its next retry is due. Leases expire, so a
+-- crashed invocation's shard is picked up by the next one.
+
+create table if not exists public.teamspace_migration_shards (
+  shard_id bigint primary key,
+  lo bigint not null,                      -- exclusive
+  hi bigint not null,                      -- inclusive
+  seeded_to bigint not null,               -- file_assets ids up to here are in teamspace_migration
+  status text not null default 'open',     -- open|done
+  lease_owner text,
+  lease_expires_at timestamptz,
+  not_before timestamptz,                  -- earliest retry of a failed row in the shard
+  updated_at timestamptz not null default now()
+);
+
+create table if not exists public.teamspace_migration (
+  asset_id bigint primary key,             -- file_assets.id
+  shard_id bigint not null,
+  dropbox_path text,
+  status text not null default 'pending',  -- pending|done|failed|dead|skipped
+  attempts integer not null default 0,
+  last_error text,
+  method text,                             -- reference|streamed|exists
+  dest_rev text,
+  bytes bigint,
+  next_attempt_at timestamptz not null default now(),
+  updated_at timestamptz not null default now()
+);
+
+create index if not exists idx_teamspace_migration_due
+  on public.teamspace_migration (shard_id, next_attempt_at) where status in ('pending', 'failed');
+create index if not exists idx_teamspace_migration_status
+  on public.teamspace_migration (status, updated_at);
+
+-- Leases the lowest open shard that isn't leased or waiting on a retry.
+-- `skip locked` lets concurrent invocations claim different shards at once.
+create or replace function public.teamspace_claim_shard(
+  p_owner text,
+  p_lease_seconds integer default 300
+) returns setof public.teamspace_migration_shards
+language sql
+as $$
+  update public.teamspace_migration_shards s
+     set lease_owner = p_owner,
+         lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+         updated_at = now()
+   where s.shard_id = (
+     select shard_id from public.teamspace_migration_shards
+      where status = 'open'
+        and (lease_expires_at is null or lease_expires_at < now())
+        and (not_before is null or not_before <= now())
+      order by shard_id
+      for update skip locked
+      limit 1)
+  returning s.*;
+$$;
+
+-- Counts for the progress endpoint; the ETA is derived from done_recent.
+create or replace function public.teamspace_migration_progress(p_window_seconds integer default 900)
+returns json
+language sql
+stable
+as $$
+  select json_build_object(
+    'assets', (select count(*) from public.file_assets),
+    'tracked', count(*),
+    'done', count(*) filter (where status = 'done'),
+    'pending', count(*) filter (where status = 'pending'),
+    'failed', count(*) filter (where status = 'failed'),
+    'dead', count(*) filter (where status = 'dead'),
+    'skipped', count(*) filter (where status = 'skipped'),
+    'bytes_done', coalesce(sum(bytes) filter (where status = 'done'), 0),
+    'done_recent', count(*) filter (where status = 'done'
+                                     and updated_at > now() - make_interval(secs => p_window_seconds)),
+    'shards', (select json_build_object(
+                 'total', count(*),
+                 'done', count(*) filter (where status = 'done'),
+                 'leased', count(*) filter (where status = 'open' and lease_expires_at > now()))
+               from public.teamspace_migration_shards)
+  )
+  from public.teamspace_migration;
+$$;
+
+grant execute on function public.teamspace_claim_shard(text, integer) to service_role;
+grant execute on function public.teamspace_migration_progress(integer) to service_role;
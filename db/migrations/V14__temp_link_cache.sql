@@ -0,0 +1,13 @@
+-- db/migrations/V14__temp_link_cache.sql
+-- Temporary links shared by every get_temp_link worker (lib/link_cache.py,
+-- enabled with TEMP_LINK_CACHE_SHARED=1). Keyed by the lower-cased Dropbox
+-- path; expires_at is kept under Dropbox's four-hour link lifetime. Transfers
+-- delete the rows under a moved property root; expired rows are deleted
+-- opportunistically by the writers.
+create table if not exists public.temp_link_cache (
+  path_lower text primary key,
+  link text not null,
+  expires_at timestamptz not null
+);
+
+create index if not exists idx_temp_link_cache_expires on public.temp_link_cache (expires_at);
@@ -0,0 +1,21 @@
+-- db/migrations/V15__onboarding_runs.sql
+-- Progress of bulk portfolio onboarding runs (functions/onboard_portfolio).
+-- The POST answers with NDJSON progress lines once the run ends; this row is
+-- updated after every create_folder_batch so GET /api/onboard_portfolio/{run_id}
+-- shows a run while it is still going.
+create table if not exists public.onboarding_runs (
+  run_id uuid primary key,
+  status text not null default 'running',   -- running|done|failed
+  records integer not null default 0,       -- entities accepted
+  rejected integer not null default 0,      -- lines that couldn't be routed
+  folders integer not null default 0,       -- distinct folders named by the batch
+  leaves integer not null default 0,        -- folders actually requested
+  batches integer not null default 0,
+  batches_done integer not null default 0,
+  created integer not null default 0,
+  existing integer not null default 0,
+  errors integer not null default 0,
+  detail jsonb,                             -- rejected lines / error samples at the end
+  started_at timestamptz not null default now(),
+  updated_at timestamptz not null default now()
+);
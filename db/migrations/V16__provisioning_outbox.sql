@@ -0,0 +1,127 @@
+-- db/migrations/V16__provisioning_outbox.sql
+-- Folder provisioning leaves the insert transaction.
+--
+-- The 002 triggers called the Function over extensions.http inside the
+-- insert, so every properties/units/leases insert waited on an Azure Function
+-- plus Dropbox round trip. They now only add a row to provisioning_outbox,
+-- committed (or rolled back) with the insert itself. functions/provisioning_outbox_tick
+-- claims due rows in batches (`for update skip locked`, so concurrent
+-- consumers take disjoint rows), creates the folders through
+-- create_folder_batch (lib/provisioning_outbox.py) and records the outcome.
+-- Failed rows are retried with backoff and become `dead` after
+-- PROVISIONING_OUTBOX_MAX_ATTEMPTS. A claim is a lease: rows of a consumer
+-- that died are claimed again once locked_until has passed.
+--
+-- Requeue dead letters once the cause is fixed with
+--   update public.provisioning_outbox set status = 'pending', attempts = 0, next_attempt_at = now()
+--    where status = 'dead';
+
+create table if not exists public.provisioning_outbox (
+  id bigserial primary key,
+  entity_type text not null,               -- property|unit|lease (lib.pathmap.entity_folders)
+  entity_id bigint,
+  payload jsonb not null,                  -- the inserted row
+  status text not null default 'pending',  -- pending|processing|done|dead
+  attempts integer not null default 0,     -- claims so far, counted when claimed
+  last_error text,
+  next_attempt_at timestamptz not null default now(),
+  locked_by text,
+  locked_until timestamptz,
+  created_at timestamptz not null default now(),
+  updated_at timestamptz not null default now()
+);
+
+create index if not exists idx_provisioning_outbox_due
+  on public.provisioning_outbox (id) where status = 'pending';
+create index if not exists idx_provisioning_outbox_leased
+  on public.provisioning_outbox (locked_until) where status = 'processing';
+create index if not exists idx_provisioning_outbox_status
+  on public.provisioning_outbox (status, updated_at);
+
+-- Same trigger functions as 002, now enqueueing instead of calling out.
+create or replace function public.notify_dropbox_property()
+returns trigger language plpgsql as $$
+begin
+  insert into public.provisioning_outbox (entity_type, entity_id, payload)
+  values ('property', NEW.id, to_jsonb(NEW));
+  return NEW;
+end $$;
+
+create or replace function public.notify_dropbox_unit()
+returns trigger language plpgsql as $$
+begin
+  insert into public.provisioning_outbox (entity_type, entity_id, payload)
+  values ('unit', NEW.id, to_jsonb(NEW));
+  return NEW;
+end $$;
+
+create or replace function public.notify_dropbox_lease()
+returns trigger language plpgsql as $$
+begin
+  insert into public.provisioning_outbox (entity_type, entity_id, payload)
+  values ('lease', NEW.id, to_jsonb(NEW));
+  return NEW;
+end $$;
+
+drop trigger if exists t_dropbox_property on public.properties;
+create trigger t_dropbox_property after insert on public.properties
+  for each row execute function public.notify_dropbox_property();
+drop trigger if exists t_dropbox_unit on public.units;
+create trigger t_dropbox_unit after insert on public.units
+  for each row execute function public.notify_dropbox_unit();
+drop trigger if exists t_dropbox_lease on public.leases;
+create trigger t_dropbox_lease after insert on public.leases
+  for each row execute function public.notify_dropbox_lease();
+
+-- Leases up to p_limit due rows, oldest first: pending rows whose retry is
+-- due, and rows whose previous claim expired. `skip locked` lets concurrent
+-- consumers claim disjoint batches without waiting on each other.
+create or replace function public.provisioning_outbox_claim(
+  p_owner text,
+  p_limit integer default 200,
+  p_lease_seconds integer default 120
+) returns setof public.provisioning_outbox
+language sql
+as $$
+  update public.provisioning_outbox o
+     set status = 'processing',
+         locked_by = p_owner,
+         locked_until = now() + make_interval(secs => p_lease_seconds),
+         attempts = o.attempts + 1,
+         updated_at = now()
+   where o.id in (
+     select id from public.provisioning_outbox
+      where (status = 'pending' and next_attempt_at <= now())
+         or (status = 'processing' and locked_until < now())
+      order by id
+      for update skip locked
+      limit p_limit)
+  returning o.*;
+$$;
+
+-- Records a batch's outcomes: [{id, status, last_error, next_attempt_at}].
+-- Rows whose lease p_owner no longer holds are left alone; returns the count written.
+create or replace function public.provisioning_outbox_finish(p_owner text, p_results jsonb)
+returns integer
+language sql
+as $$
+  with r as (
+    select * from jsonb_to_recordset(p_results)
+      as x(id bigint, status text, last_error text, next_attempt_at timestamptz)
+  ), u as (
+    update public.provisioning_outbox o
+       set status = r.status,
+           last_error = r.last_error,
+           next_attempt_at = coalesce(r.next_attempt_at, o.next_attempt_at),
+           locked_by = null,
+           locked_until = null,
+           updated_at = now()
+      from r
+     where o.id = r.id and o.status = 'processing' and o.locked_by = p_owner
+    returning 1
+  )
+  select count(*)::integer from u;
+$$;
+
+grant execute on function public.provisioning_outbox_claim(text, integer, integer) to service_role;
+grant execute on function public.provisioning_outbox_finish(text, jsonb) to service_role;
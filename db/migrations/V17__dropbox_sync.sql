@@ -0,0 +1,138 @@
+-- db/migrations/V17__dropbox_sync.sql
+-- Keeps file_assets in step with changes made directly in Dropbox
+-- (functions/dropbox_webhook + functions/dropbox_sync_tick, lib/dropbox_sync.py).
+--
+-- The webhook only calls dropbox_sync_request(), which bumps requested_at on
+-- the one state row per synced root: any number of notifications leave a
+-- single pending pull. The tick claims the row (a lease) once the
+-- notifications have been quiet for the debounce window, replays
+-- files/list_folder/continue from `cursor`, applies each page with
+-- file_assets_apply_changes() and only then stores the page's cursor, so a
+-- page replayed after a crash is applied twice to the same effect.
+-- The first pull lists the whole root once, which attaches Dropbox file ids
+-- to the rows uploads wrote (matched on path) so later moves can be followed.
+
+alter table public.file_assets add column if not exists dropbox_id text;      -- Dropbox file id; survives moves
+alter table public.file_assets add column if not exists dropbox_rev text;
+alter table public.file_assets add column if not exists deleted_at timestamptz; -- deleted in Dropbox
+alter table public.file_assets add column if not exists synced_at timestamptz;
+alter table public.file_assets
+  add column if not exists dropbox_path_lower text generated always as (lower(dropbox_path)) stored;
+
+create index if not exists file_assets_dropbox_id_idx on public.file_assets (dropbox_id);
+create index if not exists file_assets_path_lower_idx on public.file_assets (dropbox_path_lower text_pattern_ops);
+
+create table if not exists public.dropbox_sync_state (
+  root text primary key,                   -- lib.pathmap.ROOT
+  cursor text,                             -- list_folder cursor, advanced after each applied page
+  requested_at timestamptz,                -- last webhook notification
+  notifications bigint not null default 0,
+  claimed_at timestamptz,                  -- start of the current / last pull
+  pulled_at timestamptz,                   -- changes notified before this are applied
+  lease_owner text,
+  lease_expires_at timestamptz,
+  deferred jsonb not null default '[]'::jsonb,  -- new files held back until their upload row lands
+  changes bigint not null default 0,       -- entries applied, all time
+  last_error text,
+  updated_at timestamptz not null default now()
+);
+
+-- One notification: coalesced into the root's pending pull. Returns the running count.
+create or replace function public.dropbox_sync_request(p_root text)
+returns bigint
+language sql
+as $$
+  insert into public.dropbox_sync_state as s (root, requested_at, notifications)
+  values (p_root, now(), 1)
+  on conflict (root) do update
+    set requested_at = now(), notifications = s.notifications + 1, updated_at = now()
+  returning s.notifications;
+$$;
+
+-- Leases the root's state row when a pull is due: notified since the last
+-- pull and quiet for p_debounce_seconds (or the last pull is p_max_wait_seconds
+-- old), or no pull for p_poll_seconds at all (a safety net for lost webhooks).
+create or replace function public.dropbox_sync_claim(
+  p_root text,
+  p_owner text,
+  p_lease_seconds integer default 120,
+  p_debounce_seconds integer default 10,
+  p_max_wait_seconds integer default 60,
+  p_poll_seconds integer default 900
+) returns setof public.dropbox_sync_state
+language sql
+as $$
+  insert into public.dropbox_sync_state (root) values (p_root) on conflict (root) do nothing;
+  update public.dropbox_sync_state s
+     set lease_owner = p_owner,
+         lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+         claimed_at = now(),
+         updated_at = now()
+   where s.root = p_root
+     and (s.lease_expires_at is null or s.lease_expires_at < now())
+     and ((s.requested_at > coalesce(s.pulled_at, '-infinity')
+           and (s.requested_at <= now() - make_interval(secs => p_debounce_seconds)
+                or coalesce(s.pulled_at, '-infinity') <= now() - make_interval(secs => p_max_wait_seconds)))
+          or coalesce(s.pulled_at, '-infinity') <= now() - make_interval(secs => p_poll_seconds))
+  returning s.*;
+$$;
+
+-- One page of changes, in one transaction. p_deleted are lower-cased paths
+-- (files or whole folders); p_files are
+-- [{dropbox_id, path, path_lower, name, rev, size, content_hash, entity_type, entity_id, property_id, unit_id}].
+-- Deletes go first: a move arrives as a delete of the old path plus the file
+-- (same dropbox_id) at the new one, which then revives and re-points the row.
+-- Rows from uploads that predate dropbox_id are matched on their path.
+create or replace function public.file_assets_apply_changes(p_files jsonb, p_deleted text[])
+returns json
+language plpgsql
+as $$
+declare
+  n_deleted integer;
+  n_by_id integer;
+  n_by_path integer;
+  n_created integer;
+begin
+  update public.file_assets a
+     set deleted_at = now(), synced_at = now()
+    from unnest(coalesce(p_deleted, '{}')) d(path)
+   where a.deleted_at is null
+     and (a.dropbox_path_lower = d.path
+          or a.dropbox_path_lower like replace(replace(replace(d.path, '\', '\\'), '%', '\%'), '_', '\_') || '/%');
+  get diagnostics n_deleted = row_count;
+
+  drop table if exists _f;
+  create temporary table _f on commit drop as
+    select * from jsonb_to_recordset(coalesce(p_files, '[]'::jsonb)) as x(
+      dropbox_id text, path text, path_lower text, name text, rev text, size bigint, content_hash text,
+      entity_type text, entity_id bigint, property_id bigint, unit_id bigint);
+
+  update public.file_assets a
+     set dropbox_path = f.path, dropbox_rev = f.rev, size_bytes = f.size,
+         content_hash = coalesce(f.content_hash, a.content_hash), deleted_at = null, synced_at = now()
+    from _f f
+   where a.dropbox_id = f.dropbox_id;
+  get diagnostics n_by_id = row_count;
+
+  update public.file_assets a
+     set dropbox_id = f.dropbox_id, dropbox_rev = f.rev, size_bytes = f.size,
+         content_hash = coalesce(f.content_hash, a.content_hash), deleted_at = null, synced_at = now()
+    from _f f
+   where a.dropbox_id is null and a.dropbox_path_lower = f.path_lower;
+  get diagnostics n_by_path = row_count;
+
+  insert into public.file_assets (entity_type, entity_id, property_id, unit_id, original_filename,
+                                  stored_filename, dropbox_path, dropbox_id, dropbox_rev, size_bytes,
+                                  content_hash, uploaded_by, synced_at)
+  select f.entity_type, f.entity_id, f.property_id, f.unit_id, f.name, f.name, f.path, f.dropbox_id, f.rev,
+         f.size, f.content_hash, 'dropbox_sync', now()
+    from _f f
+   where not exists (select 1 from public.file_assets a where a.dropbox_id = f.dropbox_id);
+  get diagnostics n_created = row_count;
+
+  return json_build_object('deleted', n_deleted, 'updated', n_by_id + n_by_path, 'created', n_created);
+end $$;
+
+grant execute on function public.dropbox_sync_request(text) to service_role;
+grant execute on function public.dropbox_sync_claim(text, text, integer, integer, integer, integer) to service_role;
+grant execute on function public.file_assets_apply_changes(jsonb, text[]) to service_role;
@@ -0,0 +1,69 @@
+-- db/migrations/V18__drift_snapshot_folders.sql
+-- drift_detector's folder snapshot, one row per folder instead of one jsonb
+-- array per root. drift_snapshots keeps only the root's list_folder cursor.
+-- Each page of changes is applied with drift_snapshot_apply(), which deletes
+-- the page's removed subtrees, inserts its new folders and stores the page's
+-- cursor in one transaction, so a run that dies mid-way resumes from the last
+-- applied page instead of rewriting the whole set.
+
+create table if not exists public.drift_snapshot_folders (
+  root text not null references public.drift_snapshots(root) on delete cascade,
+  path_lower text not null,                -- lower-cased folder path
+  primary key (root, path_lower)
+);
+
+-- prefix matches for subtree deletes
+create index if not exists drift_snapshot_folders_prefix_idx
+  on public.drift_snapshot_folders (root, path_lower text_pattern_ops);
+
+do $$
+begin
+  if exists (select 1 from information_schema.columns
+              where table_schema = 'public' and table_name = 'drift_snapshots' and column_name = 'folders') then
+    insert into public.drift_snapshot_folders (root, path_lower)
+    select s.root, f.path from public.drift_snapshots s, jsonb_array_elements_text(s.folders) f(path)
+    on conflict do nothing;
+    alter table public.drift_snapshots drop column folders;
+  end if;
+end $$;
+
+-- One page of changes for p_root. p_deleted are lower-cased paths whose whole
+-- subtree goes; p_added are lower-cased folders. Deletes go first, so the
+-- caller nets out a folder added and deleted within the page. p_reset clears
+-- the root's folders first (the first page of a full listing).
+create or replace function public.drift_snapshot_apply(
+  p_root text,
+  p_cursor text,
+  p_added text[],
+  p_deleted text[],
+  p_reset boolean default false
+) returns json
+language plpgsql
+as $$
+declare
+  n_deleted integer;
+  n_added integer;
+begin
+  insert into public.drift_snapshots as s (root, cursor) values (p_root, p_cursor)
+  on conflict (root) do update set cursor = excluded.cursor, updated_at = now();
+
+  if p_reset then
+    delete from public.drift_snapshot_folders where root = p_root;
+  end if;
+
+  delete from public.drift_snapshot_folders f
+   using unnest(coalesce(p_deleted, '{}')) d(path)
+   where f.root = p_root
+     and (f.path_lower = d.path
+          or f.path_lower like replace(replace(replace(d.path, '\', '\\'), '%', '\%'), '_', '\_') || '/%');
+  get diagnostics n_deleted = row_count;
+
+  insert into public.drift_snapshot_folders (root, path_lower)
+  select p_root, a.path from unnest(coalesce(p_added, '{}')) a(path)
+  on conflict do nothing;
+  get diagnostics n_added = row_count;
+
+  return json_build_object('deleted', n_deleted, 'added', n_added);
+end $$;
+
+grant execute on function public.drift_snapshot_apply(text, text, text[], text[], boolean) to service_role;
@@ -0,0 +1,85 @@
+-- db/migrations/V19__dropbox_sync_resolve_ids.sql
+-- file_assets_apply_changes (V17) inserted the property/unit ids that
+-- lib.pathmap.ids_from_path reads from `-<id>` folder suffixes. Those are
+-- only candidates: a folder made by hand ("building-2024", "apt-3") or a
+-- file under a deleted property names ids with no row behind them, and the
+-- V2 foreign keys then failed the whole page; an id that happens to exist
+-- elsewhere tagged the file to the wrong entity. Ids are now kept only when
+-- the owner/property/unit exists (a unit only under its own property), and
+-- the row's entity falls back to the most specific id left (or 'dropbox', 0).
+create or replace function public.file_assets_apply_changes(p_files jsonb, p_deleted text[])
+returns json
+language plpgsql
+as $$
+declare
+  n_deleted integer;
+  n_by_id integer;
+  n_by_path integer;
+  n_created integer;
+begin
+  update public.file_assets a
+     set deleted_at = now(), synced_at = now()
+    from unnest(coalesce(p_deleted, '{}')) d(path)
+   where a.deleted_at is null
+     and (a.dropbox_path_lower = d.path
+          or a.dropbox_path_lower like replace(replace(replace(d.path, '\', '\\'), '%', '\%'), '_', '\_') || '/%');
+  get diagnostics n_deleted = row_count;
+
+  drop table if exists _f;
+  create temporary table _f on commit drop as
+    select * from jsonb_to_recordset(coalesce(p_files, '[]'::jsonb)) as x(
+      dropbox_id text, path text, path_lower text, name text, rev text, size bigint, content_hash text,
+      entity_type text, entity_id bigint, owner_id bigint, property_id bigint, unit_id bigint);
+
+  -- ids from folder names count only if their rows exist, and a unit only
+  -- under its own property (owners change through property_ownerships, so
+  -- a property isn't held to the owner folder it sits in)
+  if to_regclass('public.properties') is not null then
+    update _f set property_id = null
+     where property_id is not null and not exists (select 1 from public.properties p where p.id = _f.property_id);
+  end if;
+  if to_regclass('public.units') is not null then
+    update _f set unit_id = null
+     where unit_id is not null
+       and not exists (select 1 from public.units u
+                        where u.id = _f.unit_id and u.property_id is not distinct from _f.property_id);
+  end if;
+  if to_regclass('public.owners') is not null then
+    update _f set owner_id = null
+     where owner_id is not null and not exists (select 1 from public.owners o where o.id = _f.owner_id);
+  end if;
+  update _f
+     set entity_type = case when unit_id is not null then 'unit'
+                            when property_id is not null then 'property'
+                            when owner_id is not null then 'owner'
+                            else 'dropbox' end,
+         entity_id = coalesce(unit_id, property_id, owner_id, 0)
+   where entity_type in ('unit', 'property', 'owner');
+
+  update public.file_assets a
+     set dropbox_path = f.path, dropbox_rev = f.rev, size_bytes = f.size,
+         content_hash = coalesce(f.content_hash, a.content_hash), deleted_at = null, synced_at = now()
+    from _f f
+   where a.dropbox_id = f.dropbox_id;
+  get diagnostics n_by_id = row_count;
+
+  update public.file_assets a
+     set dropbox_id = f.dropbox_id, dropbox_rev = f.rev, size_bytes = f.size,
+         content_hash = coalesce(f.content_hash, a.content_hash), deleted_at = null, synced_at = now()
+    from _f f
+   where a.dropbox_id is null and a.dropbox_path_lower = f.path_lower;
+  get diagnostics n_by_path = row_count;
+
+  insert into public.file_assets (entity_type, entity_id, property_id, unit_id, original_filename,
+                                  stored_filename, dropbox_path, dropbox_id, dropbox_rev, size_bytes,
+                                  content_hash, uploaded_by, synced_at)
+  select f.entity_type, f.entity_id, f.property_id, f.unit_id, f.name, f.name, f.path, f.dropbox_id, f.rev,
+         f.size, f.content_hash, 'dropbox_sync', now()
+    from _f f
+   where not exists (select 1 from public.file_assets a where a.dropbox_id = f.dropbox_id);
+  get diagnostics n_created = row_count;
+
+  return json_build_object('deleted', n_deleted, 'updated', n_by_id + n_by_path, 'created', n_created);
+end $$;
+
+grant execute on function public.file_assets_apply_changes(jsonb, text[]) to service_role;
@@ -0,0 +1,12 @@
+-- db/migrations/V8__drift_snapshot.sql
+-- Folder snapshot of the Dropbox tree used by drift_detector.
+-- `cursor` is the list_folder cursor the snapshot is current as of; the next
+-- run pulls only changes since then via list_folder/continue.
+create table if not exists public.drift_snapshots (
+  root text primary key,
+  cursor text not null,
+  folders jsonb not null default '[]'::jsonb, -- lower-cased folder paths
+  updated_at timestamptz default now()
+);
+
+create index if not exists idx_drift_audit_created on public.drift_audit(created_at);
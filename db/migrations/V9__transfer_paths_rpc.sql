@@ -0,0 +1,37 @@
+-- db/migrations/V9__transfer_paths_rpc.sql
+-- Set-based path rewrite for ownership transfers, callable as
+--   POST /rest/v1/rpc/transfer_property_paths
+-- Rewrites every file_assets.dropbox_path under p_src_path to live under
+-- p_dst_path in one statement and records the ownership_transfers audit row
+-- in the same transaction. Returns the number of rewritten rows.
+create or replace function public.transfer_property_paths(
+  p_property_id bigint,
+  p_from_owner_id bigint,
+  p_to_owner_id bigint,
+  p_src_path text,
+  p_dst_path text,
+  p_cutoff_date date default current_date
+) returns integer
+language plpgsql
+as $$
+declare
+  n integer;
+begin
+  -- exact folder-prefix match (case-insensitive like Dropbox); no LIKE
+  -- wildcards, so '_' in slugs and '/prop-1' vs '/prop-10' can't collide
+  update public.file_assets
+     set dropbox_path = p_dst_path || substr(dropbox_path, length(p_src_path) + 1)
+   where property_id = p_property_id
+     and (lower(dropbox_path) = lower(p_src_path)
+          or left(lower(dropbox_path), length(p_src_path) + 1) = lower(p_src_path) || '/');
+  get diagnostics n = row_count;
+
+  insert into public.ownership_transfers
+    (property_id, from_owner_id, to_owner_id, cutoff_date, src_path, dst_path, moved_count)
+  values
+    (p_property_id, p_from_owner_id, p_to_owner_id, coalesce(p_cutoff_date, current_date), p_src_path, p_dst_path, n);
+
+  return n;
+end $$;
+
+grant execute on function public.transfer_property_paths(bigint, bigint, bigint, text, text, date) to service_role;
@@ -1,7 +1,7 @@
 
 import json
 import azure.functions as func
-from .transfer_logic import do_transfer
+from .transfer_logic import do_bulk_transfer
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
     try:
@@ -13,13 +13,11 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     to_owner   = body.get('to_owner') or {}
     properties = body.get('properties') or []
     dry        = bool(body.get('dry_run') or False)
+    cutoff     = body.get('cutoff_date')
 
     if not properties:
         return func.HttpResponse('Provide properties[]', status_code=400)
 
-    results = []
-    for p in properties:
-        res = do_transfer(from_owner, to_owner, p, dry)
-        results.append(res)
+    results = do_bulk_transfer(from_owner, to_owner, properties, dry, cutoff)
 
     return func.HttpResponse(json.dumps({'ok': True, 'results': results}), mimetype='application/json')
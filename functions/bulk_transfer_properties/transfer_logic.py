@@ -1,14 +1,14 @@
 
-import os, json
-import httpx, dropbox
+import os
+from concurrent.futures import ThreadPoolExecutor
+import dropbox
 from lib.dropbox_client import DropboxClient
 from lib.pathmap import owner_root, property_root
+from lib import link_cache
+from lib.supabase import rpc
 
-SUPABASE_URL = os.getenv('SUPABASE_URL')
-SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
-
-def _hdrs():
-    return {'apikey': SUPABASE_KEY, 'Authorization': f'Bearer {SUPABASE_KEY}', 'content-type': 'application/json'}
+# Concurrent Supabase path rewrites during a bulk transfer.
+REWRITE_WORKERS = int(os.getenv('TRANSFER_REWRITE_WORKERS', '8'))
 
 def _ensure_owner_folders(dbx, owner_name, owner_id):
     base = owner_root(owner_name, owner_id)
@@ -17,42 +17,65 @@ def _ensure_owner_folders(dbx, owner_name, owner_id):
     except dropbox.exceptions.ApiError as e:
         if 'conflict' not in str(e).lower(): pass
 
-def do_transfer(src, dst, prop, dry):
+def _rewrite_paths(res, src_id, dst_id, cutoff_date):
+    try:
+        res['updated_rows'] = rpc('transfer_property_paths', {
+            'p_property_id': int(res['property_id']), 'p_from_owner_id': int(src_id), 'p_to_owner_id': int(dst_id),
+            'p_src_path': res['old_root'], 'p_dst_path': res['new_root'], 'p_cutoff_date': cutoff_date,
+        })
+    except Exception as e:
+        res['supabase_error'] = str(e)
+
+def do_bulk_transfer(src, dst, props, dry, cutoff_date=None):
+    """
+    Transfers many properties from one owner to another. The property roots
+    move in files_move_batch_v2 jobs; as each job finishes, the Supabase
+    rewrites for the properties it moved go to a bounded worker pool, so a
+    folder that failed to move keeps its old paths in file_assets.
+
+    Returns one dict per property, in input order: property_id, old_root,
+    new_root, moved (the folder reached new_root) and updated_rows (the
+    transfer_property_paths count), plus dropbox_error or supabase_error
+    when that step failed. A dry run returns the planned roots only.
+    """
     src_name = src.get('name'); src_id = src.get('id')
     dst_name = dst.get('name'); dst_id = dst.get('id')
-    p_name   = prop.get('name'); p_id  = prop.get('id')
+
+    results = []
+    for prop in props:
+        p_name = prop.get('name'); p_id = prop.get('id')
+        results.append({'property_id': p_id,
+                        'old_root': property_root(src_name, src_id, p_name, p_id),
+                        'new_root': property_root(dst_name, dst_id, p_name, p_id),
+                        'moved': False, 'updated_rows': 0})
+    if dry or not results:
+        return results
 
     client = DropboxClient.from_env()
-    dbx = client.dbx
+    _ensure_owner_folders(client.dbx, dst_name, dst_id)
 
-    old_root = property_root(src_name, src_id, p_name, p_id)
-    new_root = property_root(dst_name, dst_id, p_name, p_id)
+    with ThreadPoolExecutor(max_workers=REWRITE_WORKERS) as pool:
+        rewrites = []
+        done = [0]
 
-    result = {'property_id': p_id, 'old_root': old_root, 'new_root': new_root, 'moved': False, 'updated_rows': 0}
+        def on_chunk(start, errors):
+            for r, err in zip(results[start:], errors):
+                if err is None:
+                    r['moved'] = True
+                    rewrites.append(pool.submit(_rewrite_paths, r, src_id, dst_id, cutoff_date))
+                else:
+                    r['dropbox_error'] = err
+            done[0] = start + len(errors)
 
-    if not dry:
         try:
-            _ensure_owner_folders(dbx, dst_name, dst_id)
-            dbx.files_move_v2(from_path=old_root, to_path=new_root, allow_shared_folder=True, autorename=False)
-            result['moved'] = True
-        except dropbox.exceptions.ApiError as e:
-            result['dropbox_error'] = str(e)
-
-        # update file_assets paths
-        updated = 0; page = 0
-        while True:
-            params = {'select':'id,dropbox_path', 'property_id': f'eq.{p_id}', 'dropbox_path': f'ilike.{old_root}%',
-                      'limit':'1000', 'offset': str(page*1000)}
-            r = httpx.get(f"{SUPABASE_URL}/rest/v1/file_assets", headers=_hdrs(), params=params, timeout=30.0)
-            if r.status_code != 200: break
-            rows = r.json()
-            if not rows: break
-            for row in rows:
-                newp = row["dropbox_path"].replace(old_root, new_root, 1)
-                httpx.patch(f"{SUPABASE_URL}/rest/v1/file_assets", headers=_hdrs(),
-                            params={'id': f"eq.{row["id"]}"}, json={'dropbox_path': newp}, timeout=30.0)
-                updated += 1
-            page += 1
-        result['updated_rows'] = updated
-
-    return result
+            client.move_batch([(r['old_root'], r['new_root']) for r in results], on_chunk=on_chunk)
+        except (dropbox.exceptions.ApiError, RuntimeError, TimeoutError) as e:
+            # jobs that finished before the failure keep their results
+            for r in results[done[0]:]:
+                r['dropbox_error'] = str(e)
+        for f in rewrites:
+            f.result()
+    for r in results:
+        link_cache.invalidate_prefix(r['old_root'])
+
+    return results
@@ -1,4 +1,5 @@
 import os, json, httpx, azure.functions as func
+from lib import rate_limit, supabase
 
 def _mask(s: str):
     if not s: return None
@@ -22,17 +23,14 @@ def _check_dropbox():
         return {"ok": False, "error": str(e)}
 
 def _check_supabase():
-    url = os.getenv("SUPABASE_URL"); key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-    if not (url and key):
-        return {"ok": False, "error": "Missing SUPABASE_* envs"}
-    headers = {"apikey": key, "Authorization": f"Bearer {key}"}
+    if not supabase.configured():
+        return {"ok": False, "stage": "env", "error": "Missing SUPABASE_* envs"}
     try:
-        with httpx.Client(timeout=20) as c:
-            r = c.get(f"{url}/rest/v1/file_assets", headers=headers, params={"select":"id","limit":"1"})
-            if r.status_code == 200:
-                body = r.json()
-                return {"ok": True, "table":"file_assets", "row_example": body[0] if body else None}
-            return {"ok": False, "status": r.status_code, "body": r.text[:200]}
+        # ping health via simple GET on file_assets (exists in our schema)
+        rows = supabase.select("file_assets", "id", limit=1)
+        return {"ok": True, "table": "file_assets", "row_example": rows[0] if rows else None}
+    except httpx.HTTPStatusError as e:
+        return {"ok": False, "status": e.response.status_code, "body": e.response.text[:300]}
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
@@ -40,12 +38,12 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     present = {n: bool(os.getenv(n)) for n in ["DROPBOX_APP_KEY","DROPBOX_APP_SECRET","DROPBOX_REFRESH_TOKEN","SUPABASE_URL","SUPABASE_SERVICE_ROLE_KEY"]}
     masked  = {n: _mask(os.getenv(n,"")) for n in ["DROPBOX_APP_KEY","DROPBOX_APP_SECRET","DROPBOX_REFRESH_TOKEN","SUPABASE_URL","SUPABASE_SERVICE_ROLE_KEY"]}
     dropbox = _check_dropbox()
-    supabase = _check_supabase()
+    supabase_check = _check_supabase()
     greens = []; reds = []
     if all(present.values()): greens.append("All required env vars present")
     else: reds.append("Missing envs")
     greens.append(f"Dropbox OK ({dropbox.get('account_email')})" if dropbox.get("ok") else "Dropbox failed")
-    greens.append("Supabase REST OK (file_assets reachable)" if supabase.get("ok") else "Supabase failed")
-    ok = dropbox.get("ok") and supabase.get("ok")
-    payload = {"ok": ok, "checks":{"env_present": present, "env_masked_preview": masked, "dropbox": dropbox, "supabase": supabase}, "summary":{"greens":greens,"reds":reds}}
+    greens.append("Supabase REST OK (file_assets reachable)" if supabase_check.get("ok") else "Supabase failed")
+    ok = dropbox.get("ok") and supabase_check.get("ok")
+    payload = {"ok": ok, "checks":{"env_present": present, "env_masked_preview": masked, "dropbox": dropbox, "supabase": supabase_check, "rate_limits": rate_limit.stats()}, "summary":{"greens":greens,"reds":reds}}
     return func.HttpResponse(json.dumps(payload, indent=2), mimetype="application/json")
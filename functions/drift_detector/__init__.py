@@ -1,83 +1,165 @@
 
 # functions/drift_detector/__init__.py
-import os, json, logging
-import httpx
-from lib.pathmap import owner_root, property_root, unit_root, tenancy_root, OWNER_SUBS, PROPERTY_SUBS, UNIT_SUBS, TENANCY_SUBS
+import logging
+import dropbox
+from lib.pathmap import (
+    ROOT, owner_root, property_root, unit_root, tenancy_root,
+    OWNER_SUBS, PROPERTY_SUBS, UNIT_SUBS, TENANCY_SUBS,
+    with_subs, leaf_paths,
+)
 from lib.dropbox_client import DropboxClient
+from lib import namespace_mirror, supabase
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+# ---------- snapshot of the Dropbox tree ----------
+# One row per folder in drift_snapshot_folders, the cursor in drift_snapshots
+# (db/migrations/V18__drift_snapshot_folders.sql).
+def _load_snapshot():
+    row = supabase.select_one("drift_snapshots", "cursor", {"root": f"eq.{ROOT}"})
+    if not row:
+        return None, set()
+    folders = {r["path_lower"] for r in supabase.iter_rows("drift_snapshot_folders", "path_lower",
+                                                            {"root": f"eq.{ROOT}"}, key="path_lower")}
+    return row["cursor"], folders
 
-def _hdrs():
-    return {"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"}
+def _delta(entries):
+    """
+    (added, deleted) for one page, netted in page order: a folder added and
+    then deleted within the page is dropped from `added`, so applying the
+    deletes before the adds gives the same result as replaying the page.
+    """
+    added, deleted = set(), []
+    for e in entries:
+        if isinstance(e, dropbox.files.FolderMetadata):
+            added.add(e.path_lower)
+        elif isinstance(e, dropbox.files.DeletedMetadata):
+            gone = e.path_lower
+            added.difference_update([f for f in added if f == gone or f.startswith(gone + "/")])
+            deleted.append(gone)
+    return added, deleted
 
-def _ensure(dbx, p):
+def _apply(folders: set, added: set, deleted: list):
+    if deleted:
+        gone, under = set(deleted), tuple(d + "/" for d in deleted)
+        folders.difference_update([f for f in folders if f in gone or f.startswith(under)])
+    folders.update(added)
+
+def _replay(folders: set, pages, reset: bool):
+    """Applies each page to `folders` and stores its delta and cursor."""
+    for entries, cursor in pages:
+        added, deleted = _delta(entries)
+        _apply(folders, added, deleted)
+        supabase.rpc("drift_snapshot_apply", {"p_root": ROOT, "p_cursor": cursor, "p_added": sorted(added),
+                                              "p_deleted": deleted, "p_reset": reset})
+        reset = False
+
+def _snapshot(client: DropboxClient) -> set:
+    """
+    Folder set (lower-cased) under ROOT. The first run lists ROOT recursively;
+    later runs replay only the changes since the stored cursor, writing each
+    page's delta rather than the whole set. With the namespace mirror enabled
+    the mirror holds the tree and its cursor instead.
+    """
+    mirror = namespace_mirror.shared()
+    if mirror is not None:
+        try:
+            mirror.sync(client)
+        except dropbox.exceptions.ApiError as e:
+            err = getattr(e, "error", None)
+            if err is not None and hasattr(err, "is_path") and err.is_path() and err.get_path().is_not_found():
+                return set()
+            raise
+        return mirror.folders() | {ROOT.lower()}
+    cursor, folders = _load_snapshot()
+    try:
+        _replay(folders, client.list_folder_pages(ROOT, cursor), reset=cursor is None)
+    except dropbox.exceptions.ApiError as e:
+        err = getattr(e, "error", None)
+        if err is not None and hasattr(err, "is_reset") and err.is_reset():
+            logging.warning("drift snapshot cursor reset; relisting %s", ROOT)
+            folders = set()
+            _replay(folders, client.list_folder_pages(ROOT), reset=True)
+        elif err is not None and hasattr(err, "is_path") and err.is_path() and err.get_path().is_not_found():
+            return set()
+        else:
+            raise
+    folders.add(ROOT.lower())
+    return folders
+
+# ---------- expected tree from Supabase ----------
+def _expected() -> dict:
+    """
+    {path: entity} for every folder the database says should exist.
+    """
+    expected = {}
+
+    def rows(table, columns):
+        return supabase.iter_rows(table, columns)
+
+    try:
+        for o in rows("owners", "id,name"):
+            for p in with_subs(owner_root(o["name"], o["id"]), OWNER_SUBS):
+                expected[p] = "owner"
+    except Exception:
+        logging.exception("drift: owners fetch failed")
+
+    try:
+        for p in rows("properties", "id,name,owner_id,owner_name"):
+            base = property_root(p.get("owner_name"), p.get("owner_id"), p["name"], p["id"])
+            for path in with_subs(base, PROPERTY_SUBS):
+                expected[path] = "property"
+    except Exception:
+        logging.exception("drift: properties fetch failed")
+
+    try:
+        for u in rows("units", "id,name,property_id,property_name,owner_id,owner_name"):
+            base = unit_root(u.get("owner_name"), u.get("owner_id"), u.get("property_name"), u.get("property_id"), u["name"], u["id"])
+            for path in with_subs(base, UNIT_SUBS):
+                expected[path] = "unit"
+    except Exception:
+        logging.exception("drift: units fetch failed")
+
+    try:
+        for l in rows("leases", "id,tenant_id,tenant_name,unit_id,unit_name,property_id,property_name,owner_id,owner_name"):
+            base = tenancy_root(l.get("owner_name"), l.get("owner_id"),
+                                l.get("property_name"), l.get("property_id"),
+                                l.get("unit_name"), l.get("unit_id"),
+                                {"lease_id": l["id"], "tenant_id": l.get("tenant_id"), "tenant_name": l.get("tenant_name")})
+            for path in with_subs(base, TENANCY_SUBS):
+                expected[path] = "tenancy"
+    except Exception:
+        logging.exception("drift: leases fetch failed")
+
+    return expected
+
+def _audit(rows: list):
+    if not rows:
+        return
     try:
-        dbx.files_create_folder_v2(p, autorename=False)
-        logging.info("create %s", p)
-    except Exception as e:
-        if "conflict" in str(e).lower(): return
-        raise
+        supabase.insert("drift_audit", rows)
+    except Exception:
+        logging.exception("drift: audit insert failed")
 
 def main(mytimer):
     logging.info("drift_detector starting")
-    if not (SUPABASE_URL and SUPABASE_KEY):
+    if not supabase.configured():
         logging.warning("missing supabase config; skipping")
         return
 
     client = DropboxClient.from_env()
-    dbx = client.dbx
 
-    with httpx.Client(timeout=30) as c:
-        # Owners
-        try:
-            ro = c.get(f"{SUPABASE_URL}/rest/v1/owners", headers=_hdrs(), params={"select":"id,name"})
-            ro.raise_for_status()
-            for o in ro.json():
-                o_base = owner_root(o["name"], o["id"])
-                _ensure(dbx, o_base)
-                for s in OWNER_SUBS:
-                    _ensure(dbx, f"{o_base}/{s}")
-        except Exception:
-            pass
-
-        # Properties
-        try:
-            rp = c.get(f"{SUPABASE_URL}/rest/v1/properties", headers=_hdrs(), params={"select":"id,name,owner_id,owner_name"})
-            rp.raise_for_status()
-            for p in rp.json():
-                p_base = property_root(p.get("owner_name"), p.get("owner_id"), p["name"], p["id"])
-                _ensure(dbx, p_base)
-                for s in PROPERTY_SUBS:
-                    _ensure(dbx, f"{p_base}/{s}")
-        except Exception:
-            pass
-
-        # Units
-        try:
-            ru = c.get(f"{SUPABASE_URL}/rest/v1/units", headers=_hdrs(), params={"select":"id,name,property_id,property_name,owner_id,owner_name"})
-            ru.raise_for_status()
-            for u in ru.json():
-                u_base = unit_root(u.get("owner_name"), u.get("owner_id"), u.get("property_name"), u.get("property_id"), u["name"], u["id"])
-                _ensure(dbx, u_base)
-                for s in UNIT_SUBS:
-                    _ensure(dbx, f"{u_base}/{s}")
-        except Exception:
-            pass
-
-        # Tenancies (leases)
-        try:
-            rl = c.get(f"{SUPABASE_URL}/rest/v1/leases", headers=_hdrs(), params={"select":"id,tenant_id,tenant_name,unit_id,unit_name,property_id,property_name,owner_id,owner_name"})
-            rl.raise_for_status()
-            for l in rl.json():
-                base = tenancy_root(l.get("owner_name"), l.get("owner_id"),
-                                    l.get("property_name"), l.get("property_id"),
-                                    l.get("unit_name"), l.get("unit_id"),
-                                    {"lease_id": l["id"], "tenant_id": l.get("tenant_id"), "tenant_name": l.get("tenant_name")})
-                _ensure(dbx, base)
-                for s in TENANCY_SUBS:
-                    _ensure(dbx, f"{base}/{s}")
-        except Exception:
-            pass
-
-    logging.info("drift_detector done")
+    existing = _snapshot(client)
+    expected = _expected()
+
+    missing = [p for p in expected if p.lower() not in existing]
+    leaves = leaf_paths(missing)
+    results = client.create_folders(leaves, use_cache=False) if leaves else {}
+
+    audit = []
+    for path, res in results.items():
+        action = "error" if res.startswith("error") else ("created" if res == "created" else "exists")
+        audit.append({"entity": expected.get(path, "folder"), "key": path, "action": action,
+                      "detail": res if action == "error" else None})
+    _audit(audit)
+
+    logging.info("drift_detector done: expected=%d existing=%d missing=%d leaves=%d",
+                 len(expected), len(existing), len(missing), len(leaves))
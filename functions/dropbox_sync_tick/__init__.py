@@ -0,0 +1,15 @@
+# functions/dropbox_sync_tick/__init__.py
+import logging, os
+from lib import dropbox_sync, supabase
+from lib.dropbox_client import DropboxClient
+
+# A pull still going at the end of its budget keeps its cursor and carries on next tick.
+BUDGET = float(os.getenv("DROPBOX_SYNC_BUDGET", "60"))
+
+def main(mytimer):
+    if not supabase.configured():
+        logging.warning("missing supabase config; skipping")
+        return
+    report = dropbox_sync.pull(DropboxClient.from_env(), BUDGET)
+    if report["pulled"]:
+        logging.info("dropbox_sync_tick: %s", report)
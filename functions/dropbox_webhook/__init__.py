@@ -0,0 +1,30 @@
+# functions/dropbox_webhook/__init__.py
+# Dropbox webhook (anonymous: Dropbox can't send a function key, so POSTs are
+# authenticated by X-Dropbox-Signature instead). GET is the verification
+# handshake; a POST only records that a pull is due (lib/dropbox_sync.py), so
+# it answers well inside Dropbox's 10 s and bursts collapse into one pull.
+import logging, os
+import azure.functions as func
+from lib import dropbox_sync, supabase
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    if req.method == "GET":
+        challenge = req.params.get("challenge")
+        if not challenge:
+            return func.HttpResponse("Missing challenge", status_code=400)
+        return func.HttpResponse(challenge, mimetype="text/plain",
+                                 headers={"X-Content-Type-Options": "nosniff"})
+
+    body = req.get_body()
+    if not dropbox_sync.signature_ok(body, req.headers.get("x-dropbox-signature"), os.getenv("DROPBOX_APP_SECRET")):
+        logging.warning("dropbox_webhook: bad or missing signature")
+        return func.HttpResponse("Invalid signature", status_code=403)
+    if not supabase.configured():
+        return func.HttpResponse("Missing SUPABASE_* envs", status_code=500)
+    try:
+        dropbox_sync.request()
+    except Exception:
+        # a non-2xx makes Dropbox retry the notification
+        logging.exception("dropbox_webhook: could not record the notification")
+        return func.HttpResponse("Could not record notification", status_code=500)
+    return func.HttpResponse("ok", mimetype="text/plain")
@@ -1,43 +1,98 @@
 
 import os, json
 import azure.functions as func
-import httpx
+from lib import link_cache, supabase
 from lib.dropbox_client import DropboxClient
 
-SUPABASE_URL = os.getenv('SUPABASE_URL')
-SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
-
-def _hdrs():
-    return {'apikey': SUPABASE_KEY, 'Authorization': f'Bearer {SUPABASE_KEY}'}
+# Most items one batch request may ask for.
+MAX_BATCH = int(os.getenv('TEMP_LINK_MAX_BATCH', '500'))
 
 def _lookup_path_by_asset_id(asset_id: int):
-    with httpx.Client(timeout=10) as c:
-        r = c.get(f"{SUPABASE_URL}/rest/v1/file_assets", headers=_hdrs(), params={'id': f'eq.{asset_id}', 'select': 'dropbox_path'})
-        if r.status_code == 200 and r.json():
-            return r.json()[0]['dropbox_path']
-    return None
+    row = supabase.select_one('file_assets', 'dropbox_path', {'id': f'eq.{asset_id}'})
+    return row['dropbox_path'] if row else None
+
+def _lookup_paths_by_asset_ids(asset_ids):
+    rows = supabase.select('file_assets', 'id,dropbox_path', {'id': f"in.({','.join(str(a) for a in asset_ids)})"})
+    return {r['id']: r['dropbox_path'] for r in rows}
+
+def _list_param(source, name):
+    """`name` or `name[]`: a JSON list, or a comma-separated string (query params)."""
+    val = source.get(name)
+    if val is None:
+        val = source.get(name + '[]')
+    if val is None or isinstance(val, list):
+        return val
+    return [v for v in str(val).split(',') if v.strip()]
+
+def _batch(asset_ids, paths):
+    """One result per requested item, asset ids first then paths, each in request order."""
+    items = []
+    for a in asset_ids:
+        try:
+            items.append({'asset_id': int(a)})
+        except (TypeError, ValueError):
+            items.append({'asset_id': a, 'ok': False, 'error': 'invalid asset_id'})
+    items += [{'path': p} for p in paths]
+
+    ids = [it['asset_id'] for it in items if 'ok' not in it and 'asset_id' in it]
+    if ids:
+        try:
+            found = link_cache.asset_paths(ids, _lookup_paths_by_asset_ids)
+        except Exception as e:
+            found, lookup_error = {}, f'asset lookup failed: {e}'
+        else:
+            lookup_error = 'asset not found'
+        for it in items:
+            if 'ok' in it or 'asset_id' not in it:
+                continue
+            if it['asset_id'] in found:
+                it['path'] = found[it['asset_id']]
+            else:
+                it.update(ok=False, error=lookup_error)
+
+    todo = [it for it in items if 'ok' not in it]
+    if todo:
+        links = link_cache.temp_links(DropboxClient.from_env(), [it['path'] for it in todo])
+        for it, res in zip(todo, links):
+            if isinstance(res, Exception):
+                # ApiError: report the Dropbox error union, not the request id
+                it.update(ok=False, error=str(getattr(res, 'error', None) or res))
+            else:
+                it.update(ok=True, link=res[0], expires_at=res[1])
+    return items
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
     if req.method == 'GET':
-        asset_id = req.params.get('asset_id')
-        path = req.params.get('path')
+        source = req.params
     else:
         try:
-            body = req.get_json()
+            source = req.get_json()
         except Exception:
-            body = {}
-        asset_id = body.get('asset_id')
-        path = body.get('path')
+            source = {}
+    asset_id = source.get('asset_id')
+    path = source.get('path')
+    asset_ids = _list_param(source, 'asset_ids')
+    paths = _list_param(source, 'paths')
+
+    if asset_ids is not None or paths is not None:
+        asset_ids, paths = asset_ids or [], paths or []
+        if not (asset_ids or paths):
+            return func.HttpResponse('Provide asset_ids or paths', status_code=400)
+        if len(asset_ids) + len(paths) > MAX_BATCH:
+            return func.HttpResponse(f'At most {MAX_BATCH} items per request', status_code=400)
+        results = _batch(asset_ids, paths)
+        return func.HttpResponse(json.dumps({'ok': all(r['ok'] for r in results), 'results': results}),
+                                 mimetype='application/json')
 
     if asset_id and not path:
         try:
-            path = _lookup_path_by_asset_id(int(asset_id))
+            path = link_cache.asset_path(int(asset_id), _lookup_path_by_asset_id)
         except Exception:
             path = None
 
     if not path:
         return func.HttpResponse('Provide asset_id or path', status_code=400)
 
-    client = DropboxClient.from_env()
-    link = client.dbx.files_get_temporary_link(path).link
-    return func.HttpResponse(json.dumps({'ok': True, 'path': path, 'link': link}), mimetype='application/json')
+    link, expires_at = link_cache.temp_link(DropboxClient.from_env(), path)
+    return func.HttpResponse(json.dumps({'ok': True, 'path': path, 'link': link, 'expires_at': expires_at}),
+                             mimetype='application/json')
@@ -0,0 +1,14 @@
+# functions/idempotency_purge/__init__.py
+import logging
+from lib import supabase
+
+def main(mytimer):
+    if not supabase.configured():
+        logging.warning("missing supabase config; skipping")
+        return
+    try:
+        n = supabase.rpc("purge_upload_requests", {}, idempotent=True)
+    except Exception:
+        logging.exception("idempotency_purge: purge failed")
+        return
+    logging.info("idempotency_purge: deleted %s expired upload_requests rows", n)
@@ -1,35 +1,41 @@
 
 import os, json, base64, re
 import azure.functions as func
-import dropbox
+from lib import dedup
 from lib.dropbox_client import DropboxClient
-from lib.pathmap import property_root, unit_root
+from lib.upload_body import UploadBody, is_binary_upload, read_upload
+from lib.pathmap import route_for
 
-def _slug(s):
-    return re.sub(r'[^a-z0-9]+','-', (s or '').strip().lower()).strip('-') or 'file'
+# ingest categories -> upload entity types (lib.pathmap.ROUTES)
+_CATEGORY_TYPES = {
+    'media-unit': 'UnitPhoto',
+    'media-property': 'PropertyPhoto',
+    'inspection': 'Inspection',
+    'workorder': 'WorkOrder',
+}
 
 def _path_for(meta, category):
-    owner_name   = meta.get('owner_name');   owner_id   = meta.get('owner_id')
-    property_nm  = meta.get('property_name');property_id= meta.get('property_id')
-    unit_name    = meta.get('unit_name');    unit_id    = meta.get('unit_id')
-
-    prop_root = property_root(owner_name, owner_id, property_nm, property_id)
-    unit_base = unit_root(owner_name, owner_id, property_nm, property_id, unit_name, unit_id)
-
-    if category == 'media-unit': return f'{unit_base}/06_Media'
-    if category == 'media-property': return f'{prop_root}/11_Media'
-    if category == 'inspection': return f'{unit_base}/03_Inspections'
-    if category == 'workorder': return f'{unit_base}/04_Work_Orders'
-    return f'{unit_base}/06_Media'
+    return route_for(_CATEGORY_TYPES.get(category, 'UnitPhoto'), meta)
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
-    try:
-        body = req.get_json()
-    except Exception:
-        return func.HttpResponse('Invalid JSON', status_code=400)
+    up = None
+    if is_binary_upload(req):
+        # raw/multipart: `source`, `file_name`, `category` and the ids/names as
+        # fields (X-Upload-* headers or form fields), the bytes as the body
+        try:
+            up = read_upload(req)
+        except ValueError as e:
+            return func.HttpResponse(f'Invalid upload body: {e}', status_code=400)
+        source  = (up.fields.get('source') or '').lower()
+        payload = dict(up.fields, file_name=up.fields.get('file_name') or up.filename)
+    else:
+        try:
+            body = req.get_json()
+        except Exception:
+            return func.HttpResponse('Invalid JSON', status_code=400)
 
-    source  = (body.get('source') or '').lower()
-    payload = body.get('payload') or {}
+        source  = (body.get('source') or '').lower()
+        payload = body.get('payload') or {}
 
     meta = {}
     filename = None
@@ -64,20 +70,22 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     else:
         return func.HttpResponse('Unknown source', status_code=400)
 
-    if not raw_b64:
-        return func.HttpResponse('Missing file_base64', status_code=400)
-
-    data = base64.b64decode(raw_b64)
+    if up is None:
+        if not raw_b64:
+            return func.HttpResponse('Missing file_base64', status_code=400)
+        up = UploadBody.from_bytes(base64.b64decode(raw_b64))
     client = DropboxClient.from_env()
 
     folder = _path_for(meta, category)
     try:
-        client.create_folder_if_not_exists(folder)
+        client.ensure_folder(folder)
     except Exception:
         pass
 
     safe = re.sub(r'[\\/:*?"<>|]+', '-', filename).strip() or 'file.bin'
     path = f'{folder}/{safe}'
-    res = client.upload_bytes(path, data)
+    res, deduped = dedup.store(client, path, up, meta)
+    up.close()
 
-    return func.HttpResponse(json.dumps({'ok': True, 'path': getattr(res, 'path_display', None) or path}), mimetype='application/json')
+    return func.HttpResponse(json.dumps({'ok': True, 'path': getattr(res, 'path_display', None) or path,
+                                         'deduplicated': bool(deduped)}), mimetype='application/json')
@@ -0,0 +1,138 @@
+# functions/onboard_portfolio/__init__.py
+# Folders for a whole batch of new entities (JSON lines, or CSV with a header
+# row) in one call. Shared prefixes are requested once via a PathTrie and only
+# leaves go to create_folder_batch; progress comes back as NDJSON and, with
+# Supabase configured, in onboarding_runs (GET /api/onboard_portfolio/{run_id}).
+# Callers that want to poll while the request runs pass their own run id (a
+# UUID) as ?run_id= or in the X-Onboarding-Run header.
+import csv, io, json, logging, os, time, uuid
+from datetime import datetime, timezone
+import azure.functions as func
+import httpx
+from lib import supabase
+from lib.dropbox_client import DropboxClient, FOLDER_BATCH_SIZE
+from lib.pathmap import PathTrie, entity_folders
+
+WORKERS = int(os.getenv('ONBOARD_BATCH_WORKERS', '4'))
+# Rejected lines / folder errors listed in the final line (the counts are always complete).
+SAMPLE = 100
+
+def _records(req: func.HttpRequest):
+    """Yields (line number, record or None, error or None)."""
+    text = req.get_body().decode('utf-8-sig')
+    if 'csv' in (req.headers.get('content-type') or '').lower():
+        for n, row in enumerate(csv.DictReader(io.StringIO(text)), start=2):
+            yield n, {k.strip(): (v.strip() if isinstance(v, str) else v) for k, v in row.items() if k}, None
+        return
+    for n, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            rec = json.loads(line)
+        except ValueError as e:
+            yield n, None, f'invalid JSON: {e}'
+            continue
+        if not isinstance(rec, dict):
+            yield n, None, 'expected a JSON object'
+            continue
+        yield n, rec, None
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+def _run_id(req: func.HttpRequest):
+    """The caller's run id (normalized), a fresh one if none was sent, or None if it isn't a UUID."""
+    given = req.params.get('run_id') or req.headers.get('X-Onboarding-Run')
+    if not given:
+        return str(uuid.uuid4())
+    try:
+        return str(uuid.UUID(given.strip()))
+    except ValueError:
+        return None
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    t0 = time.perf_counter()
+    run_id = _run_id(req)
+    if run_id is None:
+        return func.HttpResponse(json.dumps({'ok': False, 'error': 'run_id must be a UUID'}),
+                                 mimetype='application/json', status_code=400)
+    trie = PathTrie()
+    records, rejected = 0, []
+    for n, rec, err in _records(req):
+        if rec is not None:
+            try:
+                for p in entity_folders(rec.get('entity_type'), rec):
+                    trie.add(p)
+                records += 1
+                continue
+            except ValueError as e:
+                err = str(e)
+        rejected.append({'line': n, 'error': err})
+    if not records:
+        return func.HttpResponse(json.dumps({'ok': False, 'error': 'no valid records', 'rejected': rejected[:SAMPLE]}),
+                                 mimetype='application/json', status_code=400)
+
+    leaves = trie.leaves()
+    batches = -(-len(leaves) // FOLDER_BATCH_SIZE)
+    track = supabase.configured()
+    lines = []
+    totals = {'batches_done': 0, 'created': 0, 'existing': 0, 'errors': 0}
+    errors = {}
+
+    def emit(event: dict):
+        lines.append(json.dumps(event))
+        logging.info('onboard_portfolio %s %s', run_id, lines[-1])
+
+    def save(patch: dict):
+        if not track:
+            return
+        try:
+            supabase.update('onboarding_runs', {'run_id': f'eq.{run_id}'}, dict(patch, updated_at=_now()))
+        except Exception:
+            logging.exception('onboarding_runs update failed for %s', run_id)
+
+    plan = {'records': records, 'rejected': len(rejected), 'folders': trie.folders, 'leaves': len(leaves),
+            'batches': batches}
+    if track:
+        try:
+            supabase.insert('onboarding_runs', dict(plan, run_id=run_id))
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 409:
+                return func.HttpResponse(json.dumps({'ok': False, 'error': f'run {run_id} already exists'}),
+                                         mimetype='application/json', status_code=409)
+            logging.exception('onboarding_runs insert failed')
+            track = False
+        except Exception:
+            logging.exception('onboarding_runs insert failed')
+            track = False
+    emit(dict(plan, event='plan', run_id=run_id))
+
+    def on_chunk(res):
+        totals['batches_done'] += 1
+        for p, r in res.items():
+            if r == 'created':
+                totals['created'] += 1
+            elif r == 'exists':
+                totals['existing'] += 1
+            else:
+                totals['errors'] += 1
+                if len(errors) < SAMPLE:
+                    errors[p] = r
+        emit(dict(totals, event='batch', seconds=round(time.perf_counter() - t0, 2)))
+        save(totals)
+
+    try:
+        DropboxClient.from_env().create_folders(leaves, workers=WORKERS, on_chunk=on_chunk)
+    except Exception as e:
+        logging.exception('onboard_portfolio %s failed', run_id)
+        emit(dict(totals, event='done', ok=False, error=str(e), seconds=round(time.perf_counter() - t0, 2)))
+        save(dict(totals, status='failed', detail={'error': str(e), 'rejected': rejected[:SAMPLE]}))
+        return func.HttpResponse('\n'.join(lines) + '\n', mimetype='application/x-ndjson', status_code=500,
+                                 headers={'X-Onboarding-Run': run_id})
+
+    ok = totals['errors'] == 0
+    emit(dict(totals, event='done', ok=ok, seconds=round(time.perf_counter() - t0, 2),
+              rejected=rejected[:SAMPLE], error_sample=errors))
+    save(dict(totals, status='done', detail={'rejected': rejected[:SAMPLE], 'errors': errors}))
+    return func.HttpResponse('\n'.join(lines) + '\n', mimetype='application/x-ndjson',
+                             status_code=200 if ok else 500, headers={'X-Onboarding-Run': run_id})
@@ -0,0 +1,13 @@
+# functions/onboard_portfolio_status/__init__.py
+import json
+import azure.functions as func
+from lib import supabase
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    if not supabase.configured():
+        return func.HttpResponse('Missing SUPABASE_* envs', status_code=500)
+    run_id = req.route_params.get('run_id')
+    row = supabase.select_one('onboarding_runs', '*', {'run_id': f'eq.{run_id}'})
+    if not row:
+        return func.HttpResponse('Unknown run_id', status_code=404)
+    return func.HttpResponse(json.dumps(row), mimetype='application/json')
@@ -0,0 +1,19 @@
+# functions/provisioning_outbox_tick/__init__.py
+import logging, os
+from lib import provisioning_outbox as outbox, supabase
+from lib.dropbox_client import DropboxClient
+
+# Stays under the 30 s schedule so ticks of one instance don't overlap.
+BUDGET = float(os.getenv("PROVISIONING_OUTBOX_BUDGET", "25"))
+
+def main(mytimer):
+    if not supabase.configured():
+        logging.warning("missing supabase config; skipping")
+        return
+    report = outbox.run(DropboxClient.from_env(), BUDGET)
+    if report["claimed"]:
+        logging.info("provisioning_outbox_tick: %s", {k: v for k, v in report.items() if k != "owner"})
+    try:
+        outbox.purge()
+    except Exception:
+        logging.exception("provisioning_outbox_tick: purge failed")
@@ -0,0 +1,9 @@
+# functions/teamspace_migration_status/__init__.py
+import json
+import azure.functions as func
+from lib import supabase, teamspace_jobs
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    if not supabase.configured():
+        return func.HttpResponse('Missing SUPABASE_* envs', status_code=500)
+    return func.HttpResponse(json.dumps(teamspace_jobs.progress()), mimetype='application/json')
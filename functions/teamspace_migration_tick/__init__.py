@@ -0,0 +1,18 @@
+# functions/teamspace_migration_tick/__init__.py
+import logging, os
+from lib import supabase, teamspace_jobs
+from lib.dropbox_client import DropboxClient
+from lib.teamspace import Migrator, TeamDropboxClient
+
+BUDGET = 240
+
+def main(mytimer):
+    # opt-in: runs the migration unattended while TEAMSPACE_MIGRATION_ENABLED=1
+    if os.getenv("TEAMSPACE_MIGRATION_ENABLED") != "1":
+        return
+    if not supabase.configured():
+        logging.warning("missing supabase config; skipping")
+        return
+    migrator = Migrator(DropboxClient.from_env(), TeamDropboxClient.from_env())
+    report = teamspace_jobs.run(migrator, BUDGET)
+    logging.info("teamspace_migration_tick: %s", {k: v for k, v in report.items() if k != "owner"})
@@ -0,0 +1,49 @@
+# functions/thumbnail/__init__.py
+import os
+import azure.functions as func
+from lib import link_cache, supabase, thumbnails
+from lib.dropbox_client import DropboxClient
+
+# Browsers reuse a thumbnail this long, then revalidate with If-None-Match.
+MAX_AGE = int(os.getenv('THUMBNAIL_MAX_AGE', '60'))
+
+def _lookup_path_by_asset_id(asset_id: int):
+    row = supabase.select_one('file_assets', 'dropbox_path', {'id': f'eq.{asset_id}'})
+    return row['dropbox_path'] if row else None
+
+def _error_status(error: str) -> int:
+    e = error.lower()
+    if 'not_found' in e:
+        return 404
+    if 'unsupported' in e:
+        return 415
+    return 502
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    asset_id = req.params.get('asset_id')
+    path = req.params.get('path')
+    size = req.params.get('size') or thumbnails.DEFAULT_SIZE
+    fmt = (req.params.get('format') or thumbnails.DEFAULT_FORMAT).lower()
+
+    if size not in thumbnails.SIZES:
+        return func.HttpResponse(f"size must be one of {', '.join(thumbnails.SIZES)}", status_code=400)
+    if fmt not in thumbnails.FORMATS:
+        return func.HttpResponse(f"format must be one of {', '.join(thumbnails.FORMATS)}", status_code=400)
+
+    if asset_id and not path:
+        try:
+            path = link_cache.asset_path(int(asset_id), _lookup_path_by_asset_id)
+        except Exception:
+            path = None
+    if not path:
+        return func.HttpResponse('Provide asset_id or path', status_code=400)
+
+    res = thumbnails.thumbnails(DropboxClient.from_env(), [path], size, fmt,
+                                [req.headers.get('if-none-match')])[0]
+    if isinstance(res, str):
+        return func.HttpResponse(res, status_code=_error_status(res))
+
+    headers = {'ETag': res.etag, 'Cache-Control': f'private, max-age={MAX_AGE}, must-revalidate'}
+    if res.data is None:
+        return func.HttpResponse(status_code=304, headers=headers)
+    return func.HttpResponse(res.data, status_code=200, mimetype=res.content_type, headers=headers)
@@ -1,15 +1,11 @@
 
-import os, json
+import json
 import azure.functions as func
-import httpx, dropbox
+import dropbox
 from lib.dropbox_client import DropboxClient
 from lib.pathmap import owner_root, property_root
-
-SUPABASE_URL = os.getenv('SUPABASE_URL')
-SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
-
-def _hdrs():
-    return {'apikey': SUPABASE_KEY, 'Authorization': f'Bearer {SUPABASE_KEY}', 'content-type': 'application/json'}
+from lib import link_cache
+from lib.supabase import rpc
 
 def _ensure_owner_folders(dbx, owner_name, owner_id):
     base = owner_root(owner_name, owner_id)
@@ -29,6 +25,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     dst = body.get('to_owner') or {}
     prop = body.get('property') or {}
     dry = bool(body.get('dry_run') or False)
+    cutoff = body.get('cutoff_date')
 
     src_name = src.get('name'); src_id = src.get('id')
     dst_name = dst.get('name'); dst_id = dst.get('id')
@@ -58,28 +55,13 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             result['moved'] = False
             result['dropbox_error'] = str(e)
 
-        # 2) update Supabase file paths for this property
-        # fetch in pages of 1000
-        updated = 0
-        offset = 0
-        page = 0
-        while True:
-            # get rows for this property_id whose path starts with old_root
-            # PostgREST: use ilike for prefix match
-            params = {'select':'id,dropbox_path', 'property_id': f'eq.{p_id}', 'dropbox_path': f'ilike.{old_root}%' , 'limit':'1000', 'offset': str(page*1000)}
-            r = httpx.get(f"{SUPABASE_URL}/rest/v1/file_assets", headers=_hdrs(), params=params, timeout=30.0)
-            if r.status_code != 200:
-                break
-            rows = r.json()
-            if not rows: break
-            for row in rows:
-                old = row["dropbox_path"]
-                new = old.replace(old_root, new_root, 1)
-                patch = httpx.patch(f"{SUPABASE_URL}/rest/v1/file_assets", headers=_hdrs(),
-                                    params={'id': f'eq.{row["id"]}'}, json={'dropbox_path': new}, timeout=30.0)
-                if patch.status_code in (200,204):
-                    updated += 1
-            page += 1
-        result['updated_rows'] = updated
+        # 2) rewrite Supabase file paths for this property in one statement
+        # (also writes the ownership_transfers audit row; see V9 migration)
+        result['updated_rows'] = rpc('transfer_property_paths', {
+            'p_property_id': int(p_id), 'p_from_owner_id': int(src_id), 'p_to_owner_id': int(dst_id),
+            'p_src_path': old_root, 'p_dst_path': new_root, 'p_cutoff_date': cutoff,
+        })
+        # cached temp links and asset paths under the old root are stale now
+        link_cache.invalidate_prefix(old_root)
 
     return func.HttpResponse(json.dumps(result), mimetype='application/json')
@@ -1,42 +1,138 @@
 
-import os, re, json, base64
+import os, re, json, base64, logging
 import azure.functions as func
+import dropbox
+from lib.content_hash import BLOCK_SIZE, block_digests, combine
 from lib.dropbox_client import DropboxClient
-from lib.pathmap import property_root, unit_root
-
-def _slug(s: str):
-    import re
-    s = (s or '').strip().lower()
-    return re.sub(r'[^a-z0-9]+','-',s).strip('-') or 'file'
+from lib.upload_body import is_binary_upload, read_upload
+from lib.upload_sessions import block_count, missing_offsets, session_store
+from lib.pathmap import route_for
 
 def _path(meta, filename):
-    owner_name   = meta.get('owner_name')
-    owner_id     = meta.get('owner_id')
-    property_nm  = meta.get('property_name')
-    property_id  = meta.get('property_id')
-    unit_name    = meta.get('unit_name')
-    unit_id      = meta.get('unit_id')
-
-    prop_root = property_root(owner_name, owner_id, property_nm, property_id)
-    if unit_id:
-        base = unit_root(owner_name, owner_id, property_nm, property_id, unit_name, unit_id) + '/06_Media'
-    else:
-        base = prop_root + '/11_Media'
+    # unit media folder, or the property's when there is no unit
+    base = route_for('UnitPhoto', meta)
     safe = re.sub(r'[\\/:*?"<>|]+', '-', filename).strip() or 'file.bin'
     return f'{base}/{safe}'
 
+def _json(obj, status=200):
+    return func.HttpResponse(json.dumps(obj), status_code=status, mimetype='application/json')
+
+def _state(rec):
+    return {
+        'session_id': rec['session_id'],
+        'dest_path': rec['dest_path'],
+        'size': rec['size'],
+        'offset': rec['committed_offset'],
+        'received_blocks': len(rec['block_hashes']),
+        'total_blocks': block_count(rec['size']),
+        'missing_offsets': missing_offsets(rec),
+        'expires_at': rec['expires_at'],
+    }
+
+def _append(client, store, rec, offset, chunk):
+    """
+    Appends the blocks of `chunk` that the session doesn't have yet. Blocks
+    already received (a retried or duplicated chunk) are skipped; a block
+    whose bytes differ from what was received is a conflict, and so is
+    Dropbox answering incorrect_offset: the runs appended before it are
+    recorded and the caller gets the session's status to resend from.
+    """
+    size = rec['size']
+    end = offset + len(chunk)
+    if offset % BLOCK_SIZE:
+        return None, f'offset must be a multiple of {BLOCK_SIZE}'
+    if end > size:
+        return None, f'chunk ends at {end}, past the declared size {size}'
+    if not chunk or (len(chunk) % BLOCK_SIZE and end != size):
+        return None, f'chunk length must be a multiple of {BLOCK_SIZE} except for the last chunk'
+
+    first = offset // BLOCK_SIZE
+    have = rec['block_hashes']
+    digests = block_digests(chunk, offset)
+    new = {}
+    for i, d in enumerate(digests):
+        prior = have.get(str(first + i))
+        if prior is not None and prior != d:
+            return None, f'block at offset {(first + i) * BLOCK_SIZE} differs from the one already received'
+        if prior is None:
+            new[str(first + i)] = d
+    if not new:
+        return rec, None
+
+    # append each unbroken run of missing blocks as one request
+    idx = sorted(int(k) for k in new)
+    run = [idx[0]]
+    sent = {}
+    for i in idx[1:] + [None]:
+        if i is not None and i == run[-1] + 1:
+            run.append(i)
+            continue
+        lo = (run[0] - first) * BLOCK_SIZE
+        hi = min((run[-1] + 1 - first) * BLOCK_SIZE, len(chunk))
+        try:
+            client.session_append(rec['session_id'], offset + lo, chunk[lo:hi], close=offset + hi >= size)
+        except dropbox.exceptions.ApiError as e:
+            if not e.error.is_incorrect_offset():
+                raise
+            if sent:
+                store.ack(rec['session_id'], sent)
+            return None, f'Dropbox rejected the append at offset {offset + lo} (incorrect_offset)'
+        sent.update((str(b), new[str(b)]) for b in run)
+        run = [i]
+    return store.ack(rec['session_id'], new), None
+
+def _read_append(req):
+    """(session_id, offset, chunk) from a JSON body or a raw/multipart one."""
+    if is_binary_upload(req):
+        up = read_upload(req)
+        chunk = up.file.read()
+        up.close()
+        return up.fields.get('session_id'), int(up.fields.get('offset') or 0), chunk
+    body = req.get_json()
+    return body.get('session_id'), int(body.get('offset') or 0), base64.b64decode(body.get('chunk_base64') or '')
+
 def main(req: func.HttpRequest) -> func.HttpResponse:
     action = (req.route_params.get('action') or '').lower()
+    client = DropboxClient.from_env()
+    store = session_store()
+
+    if action == 'append':
+        try:
+            sid, off, chunk = _read_append(req)
+        except Exception:
+            return func.HttpResponse('invalid append body', status_code=400)
+        rec = store.get(sid) if sid else None
+        if rec is None:
+            return func.HttpResponse('unknown or expired session_id', status_code=404)
+        if rec.get('result'):
+            return _json(dict(_state(rec), ok=False, error='session already finished'), 409)
+        # a session that expired or was purged meanwhile reads back as None; report the last state seen
+        try:
+            rec, err = _append(client, store, rec, off, chunk)
+        except dropbox.exceptions.ApiError as e:
+            logging.warning('upload_session %s: append at %s failed: %s', sid, off, e)
+            return _json(dict(_state(store.get(sid) or rec), ok=False, error=f'Dropbox append failed: {e.error}'), 502)
+        if err:
+            return _json(dict(_state(store.get(sid) or rec), ok=False, error=err), 409)
+        return _json(dict(_state(rec), ok=True))
+
     try:
         body = req.get_json()
     except Exception:
+        body = {}
+    if not body and req.method != 'GET':
         return func.HttpResponse('Invalid JSON', status_code=400)
-
-    client = DropboxClient.from_env()
+    body = dict(req.params, **(body or {}))
 
     if action == 'start':
         meta = body.get('meta') or {}
         filename = body.get('filename') or 'file.bin'
+        try:
+            size = int(body.get('size'))
+        except (TypeError, ValueError):
+            size = 0
+        if size <= 0:
+            return func.HttpResponse("Missing or invalid 'size' (total bytes)", status_code=400)
         first_b64 = body.get('first_chunk_base64') or ''
         try:
             first = base64.b64decode(first_b64) if first_b64 else b''
@@ -44,25 +140,51 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             return func.HttpResponse('invalid first_chunk_base64', status_code=400)
 
         dest = _path(meta, filename)
+        rec = store.create(client.session_start(), dest, size)
         if first:
-            session_id, offset = client.session_start(first)
-        else:
-            session_id, offset = client.session_start(b'')
-        return func.HttpResponse(json.dumps({'ok': True, 'session_id': session_id, 'offset': offset, 'dest_path': dest}), mimetype='application/json')
+            try:
+                rec, err = _append(client, store, rec, 0, first)
+            except dropbox.exceptions.ApiError as e:
+                logging.warning('upload_session %s: first chunk failed: %s', rec['session_id'], e)
+                return _json(dict(_state(store.get(rec['session_id']) or rec), ok=False,
+                                  error=f'Dropbox append failed: {e.error}'), 502)
+            if err:
+                return func.HttpResponse(err, status_code=400)
+        return _json(dict(_state(rec), ok=True, block_size=BLOCK_SIZE))
 
-    elif action == 'append':
-        sid = body.get('session_id'); off = int(body.get('offset') or 0)
-        try:
-            chunk = base64.b64decode(body.get('chunk_base64') or '')
-        except Exception:
-            return func.HttpResponse('invalid chunk_base64', status_code=400)
-        new_off = client.session_append(sid, off, chunk)
-        return func.HttpResponse(json.dumps({'ok': True, 'offset': new_off}), mimetype='application/json')
+    sid = body.get('session_id')
+    rec = store.get(sid) if sid else None
+    if action in ('status', 'finish') and rec is None:
+        return func.HttpResponse('unknown or expired session_id', status_code=404)
+
+    if action == 'status':
+        return _json(dict(_state(rec), ok=True, complete=not missing_offsets(rec, 1), result=rec.get('result')))
 
     elif action == 'finish':
-        sid = body.get('session_id'); off = int(body.get('offset') or 0); dest = body.get('dest_path')
-        res = client.session_finish(sid, off, dest)
-        return func.HttpResponse(json.dumps({'ok': True, 'path': getattr(res, 'path_display', None) or dest, 'rev': getattr(res, 'rev', None)}), mimetype='application/json')
+        if rec.get('result'):
+            return _json(rec['result'])
+        if missing_offsets(rec, 1):
+            return _json(dict(_state(rec), ok=False, error='session is missing blocks'), 409)
+        content_hash = combine(rec['block_hashes'][str(i)] for i in range(block_count(rec['size'])))
+        try:
+            res = client.session_finish(sid, rec['size'], rec['dest_path'])
+        except dropbox.exceptions.ApiError as e:
+            # the commit may have landed before its response was lost
+            res = client.get_file(rec['dest_path'])
+            if res is None or res.content_hash != content_hash:
+                logging.warning('upload_session %s: finish failed: %s', sid, e)
+                err = e.error
+                if err.is_lookup_failed() and err.get_lookup_failed().is_incorrect_offset():
+                    return _json(dict(_state(rec), ok=False, complete=False,
+                                      error='Dropbox has not received every block (incorrect_offset)'), 409)
+                return _json(dict(_state(rec), ok=False, error=f'Dropbox finish failed: {err}'), 502)
+        if getattr(res, 'content_hash', None) and res.content_hash != content_hash:
+            logging.warning('upload_session %s: content_hash mismatch (ours %s, dropbox %s)',
+                            sid, content_hash, res.content_hash)
+        result = {'ok': True, 'path': getattr(res, 'path_display', None) or rec['dest_path'],
+                  'rev': getattr(res, 'rev', None), 'size': rec['size'], 'content_hash': content_hash}
+        store.finish(sid, result)
+        return _json(result)
 
     else:
-        return func.HttpResponse('Unknown action. Use start|append|finish', status_code=400)
+        return func.HttpResponse('Unknown action. Use start|append|status|finish', status_code=400)
@@ -0,0 +1,14 @@
+# functions/upload_session_gc/__init__.py
+import logging
+from lib.upload_sessions import session_store
+
+def main(mytimer):
+    # Expired records are sessions a client abandoned (every append extends
+    # the expiry) or finished ones kept only for retried finishes. Dropbox
+    # discards the session on its side once it ages out.
+    try:
+        n = session_store().purge()
+    except Exception:
+        logging.exception("upload_session_gc: purge failed")
+        return
+    logging.info("upload_session_gc: purged %d expired upload sessions", n)
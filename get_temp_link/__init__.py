@@ -1,22 +1,15 @@
-import azure.functions as func, os, json, httpx
-from lib.dropbox_client import get_temp_link
+import azure.functions as func, json
+from lib import link_cache, supabase
+from lib.dropbox_client import DropboxClient
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-
-def sb_get_asset(aid: int):
-    headers={"apikey":KEY,"Authorization":f"Bearer {KEY}"}
-    with httpx.Client(timeout=15) as c:
-        r = c.get(f"{SUPABASE_URL}/rest/v1/file_assets", headers=headers, params={"id": f"eq.{aid}", "select":"dropbox_path,stored_filename"})
-        r.raise_for_status()
-        j = r.json()
-        if not j: raise ValueError("asset not found")
-        return j[0]
+def sb_get_asset_path(aid: int):
+    row = supabase.select_one("file_assets", "dropbox_path", {"id": f"eq.{aid}"})
+    if not row: raise ValueError("asset not found")
+    return row["dropbox_path"]
 
 def main(req: func.HttpRequest):
     aid = req.params.get("id")
     if not aid: return func.HttpResponse("id required", status_code=400)
-    asset = sb_get_asset(int(aid))
-    full = f"{asset['dropbox_path']}"
-    url = get_temp_link(full)
-    return func.HttpResponse(json.dumps({"ok": True, "url": url}), mimetype="application/json")
+    full = link_cache.asset_path(int(aid), sb_get_asset_path)
+    url, expires_at = link_cache.temp_link(DropboxClient.from_env(), full)
+    return func.HttpResponse(json.dumps({"ok": True, "url": url, "expires_at": expires_at}), mimetype="application/json")
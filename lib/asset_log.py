@@ -0,0 +1,314 @@
+# lib/asset_log.py
+"""
+Write-behind logging of `file_assets` rows for the upload endpoints.
+
+`record(row)` appends the row to a local journal file and an in-memory
+buffer and returns; a background thread writes the buffer to Supabase in
+bulk once it holds BATCH_ROWS rows or its oldest row is FLUSH_INTERVAL
+seconds old. Uploads therefore never wait on PostgREST.
+
+The journal is what makes this lossless. Each worker process appends to
+its own `<host>-<pid>.active.jsonl` (held under an exclusive flock for the
+life of the process). A flush seals the active file by renaming it, writes
+its rows, and deletes the sealed segment only once Supabase accepted them.
+If Supabase is unreachable the segment simply stays on disk, and the next
+flush - in this process or any other sharing JOURNAL_DIR, including one
+starting cold after a crash - replays every segment it can lock.
+
+Every row carries a client-generated `log_id` and is written with
+`insert ... on conflict (log_id) do nothing`, so a segment replayed twice
+or a batch retried after a lost response can't duplicate rows.
+
+Only failures that can pass are retried: 429, 5xx and connection errors.
+When PostgREST rejects a batch with any other 4xx (a NULL entity_id, a
+non-integer id), the batch is written again in halves down to single
+rows, so only the rows rejected on their own are set aside. Those would
+fail the same way forever; they go to DEAD_DIR (same file name, one JSON
+row per line, ready to move back for a replay) with one error log instead
+of blocking the flushes behind them. `upload_row()` builds the row shape
+every upload endpoint records.
+"""
+import atexit, fcntl, glob, json, logging, os, socket, tempfile, threading, time, uuid
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from lib import supabase
+
+TABLE = "file_assets"
+BATCH_ROWS = int(os.getenv("ASSET_LOG_BATCH_ROWS", "100"))
+FLUSH_INTERVAL = float(os.getenv("ASSET_LOG_FLUSH_SECONDS", "2"))
+# Local disk on the instance; point it at a path that survives restarts if
+# the host recycles its temp dir.
+JOURNAL_DIR = os.getenv("ASSET_LOG_JOURNAL_DIR") or os.path.join(tempfile.gettempdir(), "altus_asset_log")
+# Rows Supabase rejected on their own, kept for inspection; never replayed.
+DEAD_DIR = "dead"
+
+
+def upload_row(entity_type: str, meta: dict, original: str, path: str, up) -> dict:
+    """The file_assets row (001_init columns) for a file an upload endpoint stored at `path`."""
+    return {
+        "original_filename": original,
+        "stored_filename": path.rsplit("/", 1)[-1],
+        "dropbox_path": path,
+        "entity_type": entity_type,
+        "entity_id": meta.get("lease_id") or meta.get("unit_id") or meta.get("property_id") or meta.get("owner_id") or meta.get("applicant_id") or meta.get("work_order_id"),
+        "property_id": meta.get("property_id"),
+        "unit_id": meta.get("unit_id"),
+        "lease_id": meta.get("lease_id"),
+        "size_bytes": up.size,
+        "content_hash": up.content_hash.hexdigest(),
+    }
+
+
+def _permanent(e: Exception) -> bool:
+    """A rejection a retry can't fix: PostgREST 4xx other than 429."""
+    return (isinstance(e, httpx.HTTPStatusError) and 400 <= e.response.status_code < 500
+            and e.response.status_code != 429)
+
+
+def _write_rows(rows: List[dict]):
+    # PostgREST bulk inserts take their column list from the first object,
+    # so rows from different endpoints go in one request per column set
+    groups: Dict[Tuple[str, ...], List[dict]] = {}
+    for r in rows:
+        groups.setdefault(tuple(sorted(r)), []).append(r)
+    for batch in groups.values():
+        supabase.upsert(TABLE, batch, on_conflict="log_id", ignore_duplicates=True)
+
+
+def _read_segment(f) -> List[dict]:
+    f.seek(0)
+    rows = []
+    for line in f:
+        try:
+            rows.append(json.loads(line))
+        except ValueError:
+            # torn final line from a process killed mid-write
+            logging.warning("asset_log: skipping unreadable journal line in %s", f.name)
+    return rows
+
+
+def _lock_segment(path: str):
+    """Opens and exclusively locks `path`, or returns None if it's in use or gone."""
+    try:
+        f = open(path, "r+", encoding="utf-8")
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # another replayer may have finished and unlinked it between open and lock
+        if os.fstat(f.fileno()).st_ino != os.stat(path).st_ino:
+            raise FileNotFoundError(path)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+class AssetLog:
+    def __init__(self, journal_dir: str = JOURNAL_DIR, batch_rows: int = BATCH_ROWS,
+                 interval: float = FLUSH_INTERVAL, write=_write_rows):
+        self.journal_dir = journal_dir
+        self.batch_rows = batch_rows
+        self.interval = interval
+        self._write = write
+        self._name = f"{socket.gethostname()}-{os.getpid()}"
+        self._active = os.path.join(journal_dir, f"{self._name}.active.jsonl")
+        self._seq = 0
+        self._file = None
+        self._buffer: List[dict] = []
+        self._writing: List[dict] = []  # sealed rows until Supabase has them
+        self._oldest = 0.0
+        self._retry_at: Optional[float] = None  # set while failed segments wait for replay
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._failed = False
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    # ---------- producer side ----------
+    def start(self):
+        """Starts the flusher (which replays leftover segments first); idempotent."""
+        with self._cond:
+            if self._thread is None and not self._closed:
+                os.makedirs(self.journal_dir, exist_ok=True)
+                self._thread = threading.Thread(target=self._run, name="asset-log", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def record(self, row: dict):
+        row = dict(row, log_id=row.get("log_id") or str(uuid.uuid4()))
+        line = json.dumps(row, default=str) + "\n"
+        self.start()
+        with self._cond:
+            if self._file is None:
+                self._file = open(self._active, "a", encoding="utf-8")
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+            self._file.write(line)
+            self._file.flush()
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            self._buffer.append(row)
+            if len(self._buffer) in (1, self.batch_rows):
+                self._cond.notify()
+
+    # ---------- flushing ----------
+    def _seal(self):
+        """Under self._cond: takes the buffered rows and renames their (still locked) journal file."""
+        rows, f = self._buffer, self._file
+        self._buffer, self._file, self._writing = [], None, rows
+        if f is None:
+            return rows, None, None
+        self._seq += 1
+        path = os.path.join(self.journal_dir, f"{self._name}-{self._seq}.jsonl")
+        os.replace(self._active, path)
+        return rows, path, f
+
+    def flush(self) -> int:
+        """Writes buffered rows and any replayable segments; returns rows written."""
+        with self._flush_lock:
+            with self._cond:
+                rows, path, f = self._seal()
+            self._failed = False
+            written = self._commit(path, f, rows) if f is not None else 0
+            with self._cond:
+                self._writing = []
+            for seg_path in sorted(glob.glob(os.path.join(self.journal_dir, "*.jsonl"))):
+                if seg_path == self._active:
+                    continue
+                seg = _lock_segment(seg_path)
+                if seg is not None:
+                    written += self._commit(seg_path, seg, _read_segment(seg))
+            with self._cond:
+                self._retry_at = time.monotonic() + self.interval if self._failed else None
+            return written
+
+    def _commit(self, path: str, f, rows: List[dict]) -> int:
+        try:
+            written = len(rows)
+            try:
+                if rows:
+                    self._write(rows)
+            except Exception as e:
+                try:
+                    if not _permanent(e):
+                        raise
+                    written, rejected = self._split(rows, e)
+                except Exception:
+                    logging.exception("asset_log: %d file_assets rows kept in %s for replay", len(rows), path)
+                    self._failed = True
+                    return 0
+                self._dead_letter(path, rejected)
+            os.remove(path)
+            return written
+        finally:
+            f.close()
+
+    def _split(self, rows: List[dict], e: Exception) -> Tuple[int, List[Tuple[dict, Exception]]]:
+        """
+        Writes a batch PostgREST rejected in halves, recursively. Returns the
+        rows written and the single rows rejected on their own with their
+        errors; a retryable failure on the way raises and keeps the segment.
+        """
+        if len(rows) == 1:
+            return 0, [(rows[0], e)]
+        written, rejected = 0, []
+        mid = len(rows) // 2
+        for half in (rows[:mid], rows[mid:]):
+            try:
+                self._write(half)
+                written += len(half)
+            except Exception as he:
+                if not _permanent(he):
+                    raise
+                w, r = self._split(half, he)
+                written += w
+                rejected += r
+        return written, rejected
+
+    def _dead_letter(self, path: str, rejected: List[Tuple[dict, Exception]]):
+        dead = os.path.join(self.journal_dir, DEAD_DIR)
+        os.makedirs(dead, exist_ok=True)
+        dest = os.path.join(dead, os.path.basename(path))
+        with open(dest + ".tmp", "w", encoding="utf-8") as out:
+            for row, _ in rejected:
+                out.write(json.dumps(row, default=str) + "\n")
+        os.replace(dest + ".tmp", dest)
+        e = rejected[0][1]
+        logging.error("asset_log: Supabase rejected %d file_assets rows (first: %s %s); moved to %s",
+                      len(rejected), e.response.status_code, e.response.text[:300], dest)
+
+    def _run(self):
+        self.flush()
+        while True:
+            with self._cond:
+                while not self._closed:
+                    now = time.monotonic()
+                    if self._buffer:
+                        due = self._oldest + self.interval - now
+                        if len(self._buffer) >= self.batch_rows or due <= 0:
+                            break
+                    elif self._retry_at is not None:
+                        due = self._retry_at - now
+                        if due <= 0:
+                            break
+                    else:
+                        due = None
+                    self._cond.wait(due)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                logging.exception("asset_log: flush failed")
+
+    def close(self):
+        """Stops the flusher and writes what's left (called at worker shutdown)."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 30)
+        try:
+            self.flush()
+        except Exception:
+            logging.exception("asset_log: final flush failed; rows stay in %s", self.journal_dir)
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._buffer)
+
+    def find(self, **equals) -> Optional[dict]:
+        """Newest row recorded here but maybe not yet in Supabase whose columns equal `equals`."""
+        with self._cond:
+            rows = self._writing + self._buffer
+        for r in reversed(rows):
+            if all(str(r.get(k)) == str(v) for k, v in equals.items()):
+                return r
+        return None
+
+
+_log = AssetLog()
+
+
+def start():
+    """Cold-start hook for the upload functions: replays leftover journals."""
+    if supabase.configured():
+        _log.start()
+
+
+def record(row: dict):
+    """Queues a file_assets row; never blocks on Supabase."""
+    if supabase.configured():
+        _log.record(row)
+
+
+def find(**equals) -> Optional[dict]:
+    return _log.find(**equals)
+
+
+def flush() -> int:
+    return _log.flush()
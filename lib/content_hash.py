@@ -0,0 +1,56 @@
+# lib/content_hash.py
+"""
+Dropbox content hash: SHA-256 of each 4 MB block of the file, then SHA-256
+of the concatenated block digests. It matches `FileMetadata.content_hash`,
+so a file can be identified before (or without) uploading it, and block
+digests can be computed in any order and combined at the end.
+"""
+import hashlib
+from typing import Iterable, List
+
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def block_digests(data, offset: int = 0) -> List[str]:
+    """
+    Hex digests of the 4 MB blocks in `data`, which must start on a block
+    boundary (`offset` is only checked, not used for slicing).
+    """
+    if offset % BLOCK_SIZE:
+        raise ValueError(f"offset {offset} is not a multiple of {BLOCK_SIZE}")
+    view = memoryview(data)
+    return [hashlib.sha256(view[i:i + BLOCK_SIZE]).hexdigest() for i in range(0, len(view), BLOCK_SIZE)]
+
+
+def combine(digests: Iterable[str]) -> str:
+    h = hashlib.sha256()
+    for d in digests:
+        h.update(bytes.fromhex(d))
+    return h.hexdigest()
+
+
+class ContentHasher:
+    """Streaming content hash; `update` accepts chunks of any size."""
+
+    def __init__(self):
+        self._overall = hashlib.sha256()
+        self._block = hashlib.sha256()
+        self._filled = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            take = min(BLOCK_SIZE - self._filled, len(view))
+            self._block.update(view[:take])
+            self._filled += take
+            view = view[take:]
+            if self._filled == BLOCK_SIZE:
+                self._overall.update(self._block.digest())
+                self._block = hashlib.sha256()
+                self._filled = 0
+
+    def hexdigest(self) -> str:
+        h = self._overall.copy()
+        if self._filled:
+            h.update(self._block.digest())
+        return h.hexdigest()
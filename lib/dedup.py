@@ -0,0 +1,70 @@
+# lib/dedup.py
+"""
+Upload-time deduplication on the Dropbox content hash.
+
+Before sending bytes, the upload handlers look the file's content hash up in
+`file_assets` for the same entity (the most specific of lease, unit,
+property in `meta`; file_assets has no owner column, so owner-level uploads
+are not deduplicated). If a matching file is still in Dropbox with the
+same hash, it is reused in place when it already sits in the destination
+folder, or copied server-side with `files_copy_v2` when it doesn't. Stale
+rows (file moved, deleted or changed) just fall through to a normal upload.
+"""
+import logging
+from typing import Optional, Tuple
+
+from lib import asset_log, supabase
+from lib.dropbox_client import DropboxClient
+from lib.upload_body import UploadBody
+
+# file_assets columns that scope "the same entity", most specific first.
+ENTITY_KEYS = ("lease_id", "unit_id", "property_id")
+
+
+def _entity_key(meta: dict) -> Optional[Tuple[str, object]]:
+    for k in ENTITY_KEYS:
+        if meta.get(k) not in (None, ""):
+            return k, meta[k]
+    return None
+
+
+def find_existing(content_hash: str, meta: dict) -> Optional[str]:
+    """Dropbox path of the newest file_assets row with this hash for the entity."""
+    scope = _entity_key(meta or {})
+    if not (supabase.configured() and scope):
+        return None
+    # rows still waiting in the write-behind buffer are newer than anything in Supabase
+    row = asset_log.find(content_hash=content_hash, **{scope[0]: scope[1]})
+    try:
+        row = row or supabase.select_one("file_assets", "*", {scope[0]: f"eq.{scope[1]}",
+                                                              "content_hash": f"eq.{content_hash}"},
+                                         order="id.desc")
+    except Exception:
+        logging.exception("dedup lookup failed; uploading")
+        return None
+    if not row:
+        return None
+    # the legacy root handler records the path as dbx_path
+    return row.get("dropbox_path") or row.get("dbx_path")
+
+
+def store(client: DropboxClient, path: str, up: UploadBody, meta: dict) -> Tuple[object, Optional[str]]:
+    """
+    Puts `up` at `path` (autorenamed on conflict) unless an identical file
+    for the same entity already exists. Returns (FileMetadata, how): `how`
+    is None for a fresh upload, "reused" when the existing file was returned
+    as is (it already has a file_assets row) and "copied" for a server-side
+    copy.
+    """
+    digest = up.content_hash.hexdigest()
+    existing = find_existing(digest, meta)
+    if existing:
+        try:
+            md = client.get_file(existing)
+            if md is not None and md.content_hash == digest:
+                if md.path_lower.rsplit("/", 1)[0] == path.lower().rsplit("/", 1)[0]:
+                    return md, "reused"
+                return client.copy(md.path_display, path), "copied"
+        except Exception:
+            logging.exception("dedup reuse of %s failed; uploading", existing)
+    return client.upload_stream(path, up.file, up.size), None
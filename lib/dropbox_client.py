@@ -1,24 +1,594 @@
+import base64
+import io
 import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
 import dropbox
-from dropbox.exceptions import ApiError
+import requests
+from dropbox import create_session
+from dropbox.exceptions import ApiError, InternalServerError, RateLimitError
+from dropbox.session import API_HOST
+
+from lib import namespace_mirror, rate_limit
+from lib.folder_cache import FolderCache
 
 # Pull creds from App Settings (Configuration > Application settings)
 APP_KEY = os.environ.get("DROPBOX_APP_KEY")
 APP_SECRET = os.environ.get("DROPBOX_APP_SECRET")
 REFRESH_TOKEN = os.environ.get("DROPBOX_REFRESH_TOKEN")
 
+# Keep-alive pool size per credential set; one worker rarely has more in flight.
+POOL_MAXSIZE = int(os.environ.get("DROPBOX_POOL_MAXSIZE", "16"))
+# Refresh the access token this many seconds before Dropbox expires it.
+TOKEN_REFRESH_MARGIN = 300
+TIMEOUT = 30
+# Folders seen to exist are trusted for this long before we ask Dropbox again.
+FOLDER_CACHE_TTL = float(os.environ.get("DROPBOX_FOLDER_CACHE_TTL", "900"))
+FOLDER_CACHE_SIZE = int(os.environ.get("DROPBOX_FOLDER_CACHE_SIZE", "4096"))
+# Paths per create_folder_batch call (Dropbox accepts up to 10,000).
+FOLDER_BATCH_SIZE = 1000
+# Rounds (and first delay, doubling) for entries refused with too_many_write_operations.
+FOLDER_BATCH_RETRIES = 3
+FOLDER_BATCH_RETRY_DELAY = 1.0
+# Entries per files_get_thumbnail_batch call (the Dropbox limit).
+THUMBNAIL_BATCH_SIZE = 25
+# Async job polling: first wait, cap, and give-up deadline (seconds).
+JOB_POLL_INTERVAL = 0.5
+JOB_POLL_MAX_INTERVAL = 4.0
+JOB_POLL_TIMEOUT = 120.0
+# Uploads up to this size go in one files_upload call (Dropbox caps it at
+# 150 MB); larger ones use a concurrent upload session fed UPLOAD_CHUNK_SIZE
+# pieces (rounded down to the 4 MB block size) from UPLOAD_WORKERS threads.
+UPLOAD_BLOCK = 4 * 1024 * 1024
+UPLOAD_SINGLE_MAX = int(os.environ.get("DROPBOX_UPLOAD_SINGLE_MAX", str(8 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.environ.get("DROPBOX_UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+UPLOAD_WORKERS = int(os.environ.get("DROPBOX_UPLOAD_WORKERS", "4"))
+# Attempts per session call on transient failures, and the first backoff (s).
+UPLOAD_CHUNK_RETRIES = 3
+UPLOAD_RETRY_DELAY = 0.5
+# Entries per files_move_batch_v2 call (Dropbox caps this at 1000).
+MOVE_BATCH_SIZE = 1000
+# Entries per list_folder page (Dropbox caps this at 2000).
+LIST_PAGE_SIZE = 2000
+# lib/rate_limit.py namespace every API request is paced and retried under (RATE_LIMIT_DROPBOX_*).
+RATE_NAMESPACE = "dropbox"
+
+
+# Routes that are safe to send again after a 5xx, whose request may have
+# been carried out: reads, async job checks, and folder creation without
+# autorename (a repeat answers conflict, which counts as "exists"); a second
+# session start only leaves an unused session. Everything else (uploads,
+# autorenamed copies, moves, session appends and finishes) is retried by
+# the limiter only on 429, which Dropbox sends before doing anything.
+IDEMPOTENT_ROUTES = frozenset({
+    "files/get_metadata", "files/list_folder", "files/list_folder/continue",
+    "files/list_folder/get_latest_cursor", "files/get_temporary_link", "files/get_thumbnail_batch",
+    "files/download", "files/copy_reference/get", "files/create_folder_v2", "files/create_folder_batch",
+    "files/create_folder_batch/check", "files/move_batch/check_v2", "files/upload_session/start",
+})
+
+
+def _classify(e: BaseException, retry_transient: bool = True):
+    """
+    rate_limit classification of an SDK error: 429s and 503s throttle, other
+    5xx are transient. With `retry_transient` off, 5xx are raised instead.
+    """
+    if isinstance(e, RateLimitError):
+        reason = getattr(e.error, "reason", None)
+        # write contention on one namespace, not the app's request rate: retry without slowing down
+        if reason is not None and reason.is_too_many_write_operations():
+            return rate_limit.TRANSIENT, e.backoff
+        return rate_limit.THROTTLE, e.backoff
+    if isinstance(e, InternalServerError) and retry_transient:
+        return (rate_limit.THROTTLE if e.status_code == 503 else rate_limit.TRANSIENT), None
+    return None, None
+
+
+def _classify_write(e: BaseException):
+    return _classify(e, retry_transient=False)
+
+
+class _PacedDropbox(dropbox.Dropbox):
+    """
+    SDK client whose every HTTP request goes through the "dropbox" namespace
+    of lib/rate_limit.py. The SDK's own retry loop is turned off (it retried
+    429s forever, one caller at a time), so pacing, Retry-After and backoff
+    are shared by every thread on the worker. 5xx are retried only for
+    IDEMPOTENT_ROUTES.
+    """
+
+    def request_json_string(self, host, func_name, *args, **kwargs):
+        classify = _classify if func_name in IDEMPOTENT_ROUTES else _classify_write
+        return rate_limit.call(RATE_NAMESPACE, lambda: super(_PacedDropbox, self).request_json_string(
+            host, func_name, *args, **kwargs), classify)
+
+
+class DropboxClient:
+    """
+    Per-worker Dropbox client for one credential set.
+
+    Instances are shared through `shared()` / `from_env()`, so every handler
+    invocation on a warm worker reuses the same keep-alive connection pool
+    and the same short-lived access token. The token is refreshed shortly
+    before it expires, and only one thread performs the refresh.
+    """
+
+    _registry: Dict[Tuple, "DropboxClient"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, app_key: str, app_secret: str, refresh_token: str, timeout: int = TIMEOUT):
+        if not (app_key and app_secret and refresh_token):
+            raise RuntimeError("Missing Dropbox credentials: app key/secret/refresh token")
+        self.app_key = app_key
+        self.app_secret = app_secret
+        self.refresh_token = refresh_token
+        self.timeout = timeout
+        self._session = create_session(max_connections=POOL_MAXSIZE)
+        self._token_lock = threading.Lock()
+        self._access_token: Optional[str] = None
+        self._expires_at = 0.0
+        self._dbx: Optional[dropbox.Dropbox] = None
+        self.known_folders = FolderCache(FOLDER_CACHE_SIZE, FOLDER_CACHE_TTL)
+
+    # ---------- registry ----------
+    @classmethod
+    def shared(cls, app_key: str, app_secret: str, refresh_token: str) -> "DropboxClient":
+        """
+        Returns the worker-wide client for this credential set, creating it once.
+        """
+        key = (cls, app_key, app_secret, refresh_token)
+        client = cls._registry.get(key)
+        if client is not None:
+            return client
+        with cls._registry_lock:
+            client = cls._registry.get(key)
+            if client is None:
+                client = cls(app_key, app_secret, refresh_token)
+                cls._registry[key] = client
+        return client
+
+    @classmethod
+    def from_env(cls) -> "DropboxClient":
+        key = os.getenv("DROPBOX_APP_KEY") or APP_KEY
+        sec = os.getenv("DROPBOX_APP_SECRET") or APP_SECRET
+        ref = os.getenv("DROPBOX_REFRESH_TOKEN") or REFRESH_TOKEN
+        if not (key and sec and ref):
+            raise RuntimeError("Missing Dropbox env vars: DROPBOX_APP_KEY/SECRET/REFRESH_TOKEN")
+        return cls.shared(key, sec, ref)
+
+    @classmethod
+    def reset_shared(cls):
+        """
+        Drops every pooled client (closing its connections). Used on credential
+        rotation and by the local benchmarks.
+        """
+        with cls._registry_lock:
+            clients = list(cls._registry.values())
+            cls._registry.clear()
+        for c in clients:
+            c._session.close()
+
+    # ---------- token handling ----------
+    def _token_fresh(self) -> bool:
+        return self._access_token is not None and time.monotonic() < self._expires_at
+
+    def _refresh_token(self):
+        r = self._session.post(
+            f"https://{API_HOST}/oauth2/token",
+            data={"grant_type": "refresh_token", "refresh_token": self.refresh_token},
+            auth=(self.app_key, self.app_secret),
+            timeout=self.timeout,
+        )
+        r.raise_for_status()
+        tok = r.json()
+        expires_in = int(tok.get("expires_in") or 14400)
+        # The SDK object is cheap once the session is shared; rebuild it per token
+        # so it never tries to refresh on its own.
+        self._dbx = _PacedDropbox(
+            oauth2_access_token=tok["access_token"],
+            session=self._session,
+            timeout=self.timeout,
+            max_retries_on_error=0,
+            max_retries_on_rate_limit=0,
+        )
+        # Published last: readers outside the lock take the fast path as soon
+        # as _token_fresh() holds, so the client must already be in place.
+        self._access_token = tok["access_token"]
+        self._expires_at = time.monotonic() + max(expires_in - TOKEN_REFRESH_MARGIN, 0)
+
+    @property
+    def dbx(self) -> dropbox.Dropbox:
+        """
+        Authenticated SDK client on the pooled session; refreshes the access
+        token (single-flight) when it is missing or about to expire.
+        """
+        if not self._token_fresh():
+            with self._token_lock:
+                if not self._token_fresh():
+                    self._refresh_token()
+        return self._dbx
+
+    # ---------- folders ----------
+    def ensure_folder(self, path: str) -> dict:
+        """
+        Ensure a folder exists at `path`. If it doesn't, create it.
+        Returns a small dict with the resulting path.
+
+        Folders already seen are answered from `known_folders`, then from the
+        namespace mirror when it is enabled (lib/namespace_mirror.py);
+        otherwise a single create call is made and a folder conflict counts
+        as success.
+        """
+        target = _normalize_path(path)
+        if target in self.known_folders:
+            return {"ok": True, "path": target, "created": False, "cached": True}
+        mirror = namespace_mirror.shared()
+        if mirror is not None:
+            mirror.refresh(self)
+            # only a hit is trusted: a folder created since the last sync isn't in the mirror yet
+            if mirror.is_folder(target):
+                self.known_folders.add(target)
+                return {"ok": True, "path": target, "created": False, "cached": True}
+        created = self.create_folder_if_not_exists(target)
+        return {"ok": True, "path": target, "created": created}
+
+    def create_folder_if_not_exists(self, path: str) -> bool:
+        """
+        Creates `path`; returns False when it already existed.
+        """
+        target = _normalize_path(path)
+        try:
+            self.dbx.files_create_folder_v2(target, autorename=False)
+            created = True
+        except ApiError as e:
+            err = getattr(e, "error", None)
+            if not (err is not None and err.is_path() and err.get_path().is_conflict()):
+                raise
+            if not err.get_path().get_conflict().is_folder():
+                raise RuntimeError(f"path exists but is not a folder: {target}")
+            created = False
+        self.known_folders.add(target)
+        return created
+
+    def create_folders(self, paths: List[str], use_cache: bool = True, workers: int = 1,
+                       on_chunk: Optional[Callable[[Dict[str, str]], None]] = None) -> Dict[str, str]:
+        """
+        Creates many folders through `files_create_folder_batch`, polling the
+        async job when Dropbox defers it. Pass leaf paths only (see
+        lib.pathmap.leaf_paths); parents are created implicitly. Callers that
+        already know the paths are missing pass `use_cache=False`.
+
+        With `workers` > 1 that many batches are in flight (and polled) at
+        once. `on_chunk` gets each batch's results as it finishes. Entries
+        Dropbox refuses with too_many_write_operations are retried in a
+        later batch, up to FOLDER_BATCH_RETRIES times.
+
+        Returns {path: "created" | "exists" | "error: ..."} in input order.
+        """
+        out: Dict[str, str] = {}
+        todo = []
+        for p in paths:
+            p = _normalize_path(p)
+            if use_cache and p in self.known_folders:
+                out[p] = "exists"
+            else:
+                out[p] = ""
+                todo.append(p)
+
+        for attempt in range(FOLDER_BATCH_RETRIES + 1):
+            chunks = [todo[i:i + FOLDER_BATCH_SIZE] for i in range(0, len(todo), FOLDER_BATCH_SIZE)]
+            if not chunks:
+                break
+            if workers > 1 and len(chunks) > 1:
+                with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+                    futures = [pool.submit(self._create_folder_chunk, c) for c in chunks]
+                    results = (f.result() for f in as_completed(futures))
+                    todo = self._collect_folder_chunks(results, out, on_chunk, attempt)
+            else:
+                todo = self._collect_folder_chunks((self._create_folder_chunk(c) for c in chunks), out, on_chunk,
+                                                   attempt)
+        return out
+
+    def _collect_folder_chunks(self, results, out: Dict[str, str], on_chunk, attempt: int) -> List[str]:
+        retry = []
+        for res in results:
+            for p, r in res.items():
+                if r == "retry":
+                    if attempt < FOLDER_BATCH_RETRIES:
+                        retry.append(p)
+                        continue
+                    r = res[p] = "error: too_many_write_operations"
+                out[p] = r
+            if on_chunk:
+                on_chunk({p: r for p, r in res.items() if r != "retry"})
+        if retry:
+            time.sleep(FOLDER_BATCH_RETRY_DELAY * 2 ** attempt)
+        return retry
+
+    def _create_folder_chunk(self, chunk: List[str]) -> Dict[str, str]:
+        launch = self.dbx.files_create_folder_batch(chunk, autorename=False, force_async=False)
+        if launch.is_complete():
+            entries = launch.get_complete().entries
+        elif launch.is_async_job_id():
+            status = self.wait_for_job(self.dbx.files_create_folder_batch_check, launch.get_async_job_id())
+            if not status.is_complete():
+                raise RuntimeError(f"create_folder_batch failed: {status}")
+            entries = status.get_complete().entries
+        else:
+            raise RuntimeError(f"create_folder_batch unexpected response: {launch}")
+
+        res: Dict[str, str] = {}
+        for p, entry in zip(chunk, entries):
+            if entry.is_success():
+                res[p] = "created"
+            else:
+                err = entry.get_failure()
+                if err.is_path() and err.get_path().is_conflict() and err.get_path().get_conflict().is_folder():
+                    res[p] = "exists"
+                elif err.is_path() and err.get_path().is_too_many_write_operations():
+                    res[p] = "retry"
+                    continue
+                else:
+                    res[p] = f"error: {err}"
+                    continue
+            self.known_folders.add(p)
+        return res
+
+    def move_batch(self, moves: List[Tuple[str, str]],
+                   on_chunk: Optional[Callable[[int, List[Optional[str]]], None]] = None) -> List[Optional[str]]:
+        """
+        Moves (from_path, to_path) pairs with `files_move_batch_v2`, polling the
+        async job. Returns one entry per pair: None on success, otherwise the
+        Dropbox error as a string. `on_chunk(start, errors)` gets each job's
+        entries as it finishes, `start` being the index of its first pair.
+        """
+        out: List[Optional[str]] = []
+        for i in range(0, len(moves), MOVE_BATCH_SIZE):
+            chunk = moves[i:i + MOVE_BATCH_SIZE]
+            entries = [dropbox.files.RelocationPath(from_path=f, to_path=t) for f, t in chunk]
+            launch = self.dbx.files_move_batch_v2(entries, autorename=False)
+            if launch.is_complete():
+                results = launch.get_complete().entries
+            elif launch.is_async_job_id():
+                status = self.wait_for_job(self.dbx.files_move_batch_check_v2, launch.get_async_job_id())
+                if not status.is_complete():
+                    raise RuntimeError(f"move_batch failed: {status}")
+                results = status.get_complete().entries
+            else:
+                raise RuntimeError(f"move_batch unexpected response: {launch}")
+            for (src, _), r in zip(chunk, results):
+                if r.is_success():
+                    self.known_folders.discard(src)
+                    out.append(None)
+                else:
+                    out.append(str(r.get_failure()))
+            if on_chunk:
+                on_chunk(i, out[i:])
+        return out
+
+    def list_folder_pages(self, path: str, cursor: Optional[str] = None, recursive: bool = True):
+        """
+        Yields (entries, cursor) per page: a full listing of `path` when no
+        cursor is given, otherwise only the changes since `cursor`. An expired
+        cursor raises ApiError whose `error.is_reset()` is true.
+        """
+        dbx = self.dbx
+        if cursor:
+            res = dbx.files_list_folder_continue(cursor)
+        else:
+            res = dbx.files_list_folder(_normalize_path(path), recursive=recursive, limit=LIST_PAGE_SIZE)
+        while True:
+            yield res.entries, res.cursor
+            if not res.has_more:
+                return
+            res = dbx.files_list_folder_continue(res.cursor)
+
+    def latest_cursor(self, path: str, recursive: bool = True) -> str:
+        """A list_folder cursor for `path` as of now, without listing it."""
+        return self.dbx.files_list_folder_get_latest_cursor(_normalize_path(path), recursive=recursive).cursor
+
+    @staticmethod
+    def wait_for_job(check, async_job_id: str, timeout: float = JOB_POLL_TIMEOUT):
+        """
+        Polls `check(async_job_id)` with capped backoff until the job leaves
+        `in_progress`, and returns the final status object.
+        """
+        deadline = time.monotonic() + timeout
+        delay = JOB_POLL_INTERVAL
+        while True:
+            status = check(async_job_id)
+            if not status.is_in_progress():
+                return status
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError(f"Dropbox job {async_job_id} still in progress after {timeout}s")
+            time.sleep(delay)
+            delay = min(delay * 2, JOB_POLL_MAX_INTERVAL)
+
+    # ---------- uploads ----------
+    def upload_bytes(self, path: str, data: bytes):
+        """
+        Uploads `data` to `path`. If Dropbox reports the parent as missing (it
+        was deleted or moved behind our cache), the folder is evicted,
+        re-created and the upload retried once. Payloads above
+        UPLOAD_SINGLE_MAX go through upload_stream.
+        """
+        if len(data) > UPLOAD_SINGLE_MAX:
+            return self.upload_stream(path, io.BytesIO(data), len(data))
+        return self._in_parent(path, lambda: self._files_upload(path, data))
+
+    def _in_parent(self, path: str, call):
+        """
+        Runs `call` (a write to `path`); if Dropbox answers path/not_found,
+        the parent folder is evicted from `known_folders`, created with a
+        direct API call and `call` retried once.
+        """
+        try:
+            return call()
+        except ApiError as e:
+            if not _path_not_found(getattr(e, "error", None)):
+                raise
+        folder = path.rsplit("/", 1)[0]
+        self.known_folders.discard(folder)
+        self.create_folder_if_not_exists(folder)
+        return call()
+
+    def _files_upload(self, path: str, data: bytes):
+        return self.dbx.files_upload(
+            data,
+            path,
+            mode=dropbox.files.WriteMode("add"),
+            autorename=True,
+            mute=True,
+        )
+
+    def upload_stream(self, path: str, fileobj, size: int, workers: Optional[int] = None):
+        """
+        Uploads `size` bytes read from `fileobj` to `path` and returns the
+        FileMetadata. Small files go in one call; larger ones open a
+        concurrent upload session and append block-aligned chunks from a
+        thread pool. `fileobj` is only read from the calling thread, and at
+        most two chunks per worker are held in memory. A missing parent on
+        the session finish is handled as in upload_bytes.
+        """
+        if size <= UPLOAD_SINGLE_MAX:
+            return self.upload_bytes(path, fileobj.read(size))
+
+        chunk = max(UPLOAD_CHUNK_SIZE // UPLOAD_BLOCK, 1) * UPLOAD_BLOCK
+        workers = max(workers or UPLOAD_WORKERS, 1)
+        session_id = self.session_start()
+        slots = threading.BoundedSemaphore(workers * 2)
+
+        def append(offset: int, data: bytes):
+            try:
+                self.session_append(session_id, offset, data, close=offset + len(data) >= size)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            for offset in range(0, size, chunk):
+                slots.acquire()
+                failed = {f for f in pending if f.done()}
+                pending -= failed
+                for f in failed:
+                    f.result()  # re-raise the first chunk that ran out of retries
+                data = fileobj.read(min(chunk, size - offset))
+                if not data:
+                    raise ValueError(f"upload stream ended at {offset} of {size} bytes")
+                pending.add(pool.submit(append, offset, data))
+            for f in pending:
+                f.result()
+
+        return self._in_parent(path, lambda: self.session_finish(session_id, size, path))
+
+    @staticmethod
+    def _with_retries(call, done=None):
+        """
+        Runs one upload-session call, retrying connection failures with
+        exponential backoff; 429s were already retried under the rate
+        limiter. `done(err)` marks an ApiError seen on a retry as "the
+        earlier attempt already landed" (the response was lost, not the
+        request); the call then counts as successful. Calls with `done` are
+        retried on 5xx here as well, so that rule covers those retries too.
+        """
+        delay = UPLOAD_RETRY_DELAY
+        for attempt in range(UPLOAD_CHUNK_RETRIES):
+            try:
+                return call()
+            except ApiError as e:
+                if attempt and done is not None and done(e.error):
+                    return None
+                raise
+            except InternalServerError:
+                if done is None or attempt == UPLOAD_CHUNK_RETRIES - 1:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, JOB_POLL_MAX_INTERVAL)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == UPLOAD_CHUNK_RETRIES - 1:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, JOB_POLL_MAX_INTERVAL)
+
+    def upload(self, path: str, data: bytes) -> dict:
+        md = self.upload_bytes(path, data)
+        return {"path": md.path_display, "id": md.id, "rev": md.rev, "size": md.size}
+
+    # Concurrent upload sessions: appends may arrive in any order, each at a
+    # 4 MB-aligned offset and a multiple of 4 MB long except the closing one.
+    def session_start(self) -> str:
+        return self._with_retries(lambda: self.dbx.files_upload_session_start(
+            b"", session_type=dropbox.files.UploadSessionType.concurrent)).session_id
+
+    def session_append(self, session_id: str, offset: int, data: bytes, close: bool = False):
+        cursor = dropbox.files.UploadSessionCursor(session_id=session_id, offset=offset)
+        self._with_retries(lambda: self.dbx.files_upload_session_append_v2(data, cursor, close=close),
+                           done=lambda err: err.is_incorrect_offset())
+
+    def session_finish(self, session_id: str, size: int, dest_path: str):
+        cursor = dropbox.files.UploadSessionCursor(session_id=session_id, offset=size)
+        commit = dropbox.files.CommitInfo(path=dest_path, mode=dropbox.files.WriteMode("add"),
+                                          autorename=True, mute=True)
+        return self._with_retries(lambda: self.dbx.files_upload_session_finish(b"", cursor, commit))
+
+    def get_temp_link(self, path: str) -> str:
+        return self.dbx.files_get_temporary_link(path).link
+
+    def get_thumbnails(self, entries: List[Tuple[str, str, str]], mode: str = "bestfit"
+                       ) -> List[Union[Tuple[dropbox.files.FileMetadata, bytes], str]]:
+        """
+        Thumbnails for (path, size, format) entries, e.g. ("/x.jpg", "w256h256",
+        "jpeg"), THUMBNAIL_BATCH_SIZE per `files_get_thumbnail_batch` call.
+        Returns one entry per input: (metadata, image bytes) on success,
+        otherwise the Dropbox error as a string.
+        """
+        out: List[Union[Tuple[dropbox.files.FileMetadata, bytes], str]] = []
+        for i in range(0, len(entries), THUMBNAIL_BATCH_SIZE):
+            chunk = entries[i:i + THUMBNAIL_BATCH_SIZE]
+            args = [dropbox.files.ThumbnailArg(path=p, size=dropbox.files.ThumbnailSize(size, None),
+                                               format=dropbox.files.ThumbnailFormat(fmt, None),
+                                               mode=dropbox.files.ThumbnailMode(mode, None))
+                    for p, size, fmt in chunk]
+            for r in self.dbx.files_get_thumbnail_batch(args).entries:
+                if r.is_success():
+                    data = r.get_success()
+                    out.append((data.metadata, base64.b64decode(data.thumbnail)))
+                else:
+                    out.append(str(r.get_failure()))
+        return out
+
+    def get_file(self, path: str) -> Optional[dropbox.files.FileMetadata]:
+        """FileMetadata at `path`, or None if nothing (or a folder) is there."""
+        try:
+            md = self.dbx.files_get_metadata(path)
+        except ApiError as e:
+            if _path_not_found(getattr(e, "error", None)):
+                return None
+            raise
+        return md if isinstance(md, dropbox.files.FileMetadata) else None
+
+    def copy(self, from_path: str, to_path: str) -> dropbox.files.FileMetadata:
+        """Server-side copy (no bytes through us); renames on conflict."""
+        return self.dbx.files_copy_v2(from_path, to_path, autorename=True).metadata
+
+    def copy_reference(self, path: str) -> Tuple[str, dropbox.files.Metadata]:
+        """A copy reference for `path` that another account can save, plus its metadata."""
+        res = self.dbx.files_copy_reference_get(path)
+        return res.copy_reference, res.metadata
+
+    def save_copy_reference(self, copy_reference: str, path: str) -> dropbox.files.Metadata:
+        """Materialises a copy reference (possibly from another account) at `path`, server-side."""
+        return self.dbx.files_copy_reference_save(copy_reference, path).metadata
+
+
 def get_dbx() -> dropbox.Dropbox:
     """
     Returns an authenticated Dropbox client using refresh-token flow.
     """
-    if not (APP_KEY and APP_SECRET and REFRESH_TOKEN):
-        raise RuntimeError("Missing Dropbox env vars: DROPBOX_APP_KEY/SECRET/REFRESH_TOKEN")
-    return dropbox.Dropbox(
-        app_key=APP_KEY,
-        app_secret=APP_SECRET,
-        oauth2_refresh_token=REFRESH_TOKEN,
-        timeout=30,
-    )
+    return DropboxClient.from_env().dbx
 
 def _normalize_path(path: str) -> str:
     if not path:
@@ -28,22 +598,38 @@ def _normalize_path(path: str) -> str:
         path = "/" + path
     return path
 
+def _path_not_found(err) -> bool:
+    """
+    True for a path/not_found error: GetMetadataError's LookupError, or the
+    WriteError of an upload (nested in UploadWriteFailed.reason) or of an
+    upload session finish. SDK 12's WriteError has no not_found member, so
+    writes only match on SDK versions that add one.
+    """
+    if err is None or not err.is_path():
+        return False
+    path = err.get_path()
+    reason = getattr(path, "reason", path)
+    is_not_found = getattr(reason, "is_not_found", None)
+    return bool(is_not_found and is_not_found())
+
+def folder_report(results: Dict[str, str]) -> dict:
+    """
+    Response body for provisioning endpoints from `create_folders()` results.
+    """
+    errors = {p: r for p, r in results.items() if r.startswith("error")}
+    return {
+        "ok": not errors,
+        "created": [p for p, r in results.items() if r == "created"],
+        "existing": [p for p, r in results.items() if r == "exists"],
+        "errors": errors,
+    }
+
 def ensure_folder(path: str) -> dict:
     """
     Ensure a folder exists at `path`. If it doesn't, create it.
     Returns a small dict with the resulting path.
     """
-    dbx = get_dbx()
-    target = _normalize_path(path)
-
-    try:
-        dbx.files_get_metadata(target)
-        # Folder exists
-        return {"ok": True, "path": target, "created": False}
-    except ApiError as e:
-        # If it doesn't exist, create it
-        if (hasattr(e, "error") and hasattr(e.error, "is_path") and e.error.is_path()):
-            dbx.files_create_folder_v2(target, autorename=False)
-            return {"ok": True, "path": target, "created": True}
-        # Different API error – surface it
-        raise
+    return DropboxClient.from_env().ensure_folder(path)
+
+def get_temp_link(path: str) -> str:
+    return DropboxClient.from_env().get_temp_link(path)
@@ -0,0 +1,243 @@
+# lib/dropbox_sync.py
+"""
+Dropbox -> file_assets change feed (migration V17).
+
+functions/dropbox_webhook checks the notification's signature and calls
+`request()`. That only bumps `requested_at` on the root's
+dropbox_sync_state row, so a burst of notifications is one pending pull,
+not a queue of them. functions/dropbox_sync_tick calls `pull()`, which
+leases the row through `dropbox_sync_claim` once the burst has been quiet
+for DEBOUNCE seconds (or MAX_WAIT after the last pull, so a steady stream
+can't starve it; and every POLL seconds regardless, in case a webhook was
+lost), then:
+
+1. replays `files/list_folder/continue` from the stored cursor. The first
+   pull lists ROOT in full instead: that matches the rows uploads wrote by
+   path and attaches their Dropbox file ids, which later moves are followed
+   by, and adds files that never went through the app;
+2. turns each page into deleted paths and file records, and applies them
+   with `file_assets_apply_changes`, one call per APPLY_BATCH entries. A
+   move keeps the Dropbox file id, so the row is re-pointed rather than
+   deleted and re-created. A file that matches no row becomes a row tagged
+   with the owner/property/unit ids its path encodes, as far as those rows
+   exist (V19); a batch the database rejects is split down to single
+   entries and the ones rejected on their own are skipped with an error
+   log, so one bad entry can't pin the cursor;
+3. stores the page's cursor only after its changes are in, under the
+   lease. A page replayed after a crash re-applies to the same result.
+
+A new file that matches no row and was modified less than SETTLE seconds
+ago is held back (`deferred`) to the next pull. It may be an app upload
+whose write-behind file_assets row (lib/asset_log.py) hasn't landed yet.
+"""
+import hashlib, hmac, logging, os, socket, time, uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+import dropbox
+import httpx
+
+from lib import supabase
+from lib.pathmap import ROOT, ids_from_path
+
+STATE = "dropbox_sync_state"
+LEASE_SECONDS = int(os.getenv("DROPBOX_SYNC_LEASE_SECONDS", "120"))
+DEBOUNCE = int(os.getenv("DROPBOX_SYNC_DEBOUNCE_SECONDS", "10"))
+MAX_WAIT = int(os.getenv("DROPBOX_SYNC_MAX_WAIT_SECONDS", "60"))
+POLL = int(os.getenv("DROPBOX_SYNC_POLL_SECONDS", "900"))
+SETTLE = float(os.getenv("DROPBOX_SYNC_SETTLE_SECONDS", "30"))
+# Entries per file_assets_apply_changes call.
+APPLY_BATCH = 500
+# Ids read from folder names that can't be a bigint are ignored.
+_MAX_ID = 2 ** 63 - 1
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _iso(dt: datetime) -> str:
+    return dt.isoformat()
+
+
+def new_owner() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+# ---------- webhook side ----------
+def signature_ok(body: bytes, signature: Optional[str], secret: Optional[str]) -> bool:
+    """X-Dropbox-Signature: hex HMAC-SHA256 of the raw body, keyed with the app secret."""
+    if not (signature and secret):
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature.strip().lower())
+
+
+def request(root: str = ROOT):
+    supabase.rpc("dropbox_sync_request", {"p_root": root})
+
+
+# ---------- pull side ----------
+def _file_record(md) -> dict:
+    # candidates only: file_assets_apply_changes keeps the ids whose rows exist
+    ids = {k: v for k, v in ids_from_path(md.path_display).items() if v <= _MAX_ID}
+    entity = next(((k[:-3], ids[k]) for k in ("unit_id", "property_id", "owner_id") if k in ids), ("dropbox", 0))
+    return {"dropbox_id": md.id, "path": md.path_display, "path_lower": md.path_lower, "name": md.name,
+            "rev": md.rev, "size": md.size, "content_hash": getattr(md, "content_hash", None),
+            "entity_type": entity[0], "entity_id": entity[1], "owner_id": ids.get("owner_id"),
+            "property_id": ids.get("property_id"), "unit_id": ids.get("unit_id"),
+            "modified": _iso(md.server_modified.replace(tzinfo=timezone.utc))}
+
+
+def _split(entries) -> Tuple[List[dict], List[str]]:
+    files, deleted = [], []
+    for e in entries:
+        if isinstance(e, dropbox.files.FileMetadata):
+            files.append(_file_record(e))
+        elif isinstance(e, dropbox.files.DeletedMetadata):
+            deleted.append(e.path_lower)
+    return files, deleted
+
+
+def _in(values) -> str:
+    return "in.(" + ",".join('"' + v.replace('"', '\\"') + '"' for v in values) + ")"
+
+
+def _known(files: List[dict]) -> set:
+    """dropbox_ids and lower-cased paths among `files` that already have a file_assets row."""
+    known = set()
+    for i in range(0, len(files), 100):
+        chunk = files[i:i + 100]
+        for col, key in (("dropbox_id", "dropbox_id"), ("dropbox_path_lower", "path_lower")):
+            known.update(r[col] for r in supabase.select("file_assets", col, {col: _in(f[key] for f in chunk)}))
+    return known
+
+
+def _hold_back(files: List[dict]) -> Tuple[List[dict], List[dict]]:
+    """(files to apply now, new files too recent to tell from an app upload still being logged)."""
+    cutoff = _now() - timedelta(seconds=SETTLE)
+    recent = [f for f in files if datetime.fromisoformat(f["modified"]) > cutoff]
+    if not recent:
+        return files, []
+    known = _known(recent)
+    held = [f for f in recent if f["dropbox_id"] not in known and f["path_lower"] not in known]
+    if not held:
+        return files, []
+    ids = {id(f) for f in held}
+    return [f for f in files if id(f) not in ids], held
+
+
+def _apply_batch(chunk: List[dict], deleted: List[str], totals: dict):
+    """
+    One file_assets_apply_changes call. If the database rejects it (a 4xx),
+    the deletions go alone and the files are retried in halves; a single
+    file rejected on its own is skipped rather than failing the page.
+    """
+    try:
+        res = supabase.rpc("file_assets_apply_changes", {"p_files": chunk, "p_deleted": deleted})
+    except httpx.HTTPStatusError as e:
+        code = e.response.status_code
+        if not (400 <= code < 500 and code != 429) or not chunk:
+            raise
+        if deleted:
+            _apply_batch([], deleted, totals)
+            _apply_batch(chunk, [], totals)
+        elif len(chunk) == 1:
+            logging.error("dropbox_sync: skipping %s: %s %s", chunk[0]["path"], code, e.response.text[:300])
+            totals["skipped"] += 1
+        else:
+            mid = len(chunk) // 2
+            _apply_batch(chunk[:mid], [], totals)
+            _apply_batch(chunk[mid:], [], totals)
+        return
+    for k in ("deleted", "updated", "created"):
+        totals[k] += res[k]
+
+
+def apply(files: List[dict], deleted: List[str]) -> dict:
+    """Writes one page's changes; returns counts of deleted / updated / created / skipped entries."""
+    totals = {"deleted": 0, "updated": 0, "created": 0, "skipped": 0}
+    for i in range(0, max(len(files), 1), APPLY_BATCH):
+        chunk = [{k: v for k, v in f.items() if k != "modified"} for f in files[i:i + APPLY_BATCH]]
+        # the deletions ride with the first call, which applies them before its files
+        batch_deleted = deleted if i == 0 else []
+        if not (chunk or batch_deleted):
+            break
+        _apply_batch(chunk, batch_deleted, totals)
+    return totals
+
+
+def claim(owner: str, root: str = ROOT) -> Optional[dict]:
+    rows = supabase.rpc("dropbox_sync_claim", {"p_root": root, "p_owner": owner, "p_lease_seconds": LEASE_SECONDS,
+                                               "p_debounce_seconds": DEBOUNCE, "p_max_wait_seconds": MAX_WAIT,
+                                               "p_poll_seconds": POLL})
+    return rows[0] if rows else None
+
+
+def _save(row: dict, owner: str, patch: dict) -> bool:
+    """Updates the state row if `owner` still holds its lease (renewing it)."""
+    patch = dict(patch, updated_at=_iso(_now()))
+    if "lease_owner" not in patch:
+        patch["lease_expires_at"] = _iso(_now() + timedelta(seconds=LEASE_SECONDS))
+    return bool(supabase.update(STATE, {"root": f"eq.{row['root']}", "lease_owner": f"eq.{owner}"}, patch,
+                                returning=True))
+
+
+def pull(client, budget_seconds: float, owner: Optional[str] = None, root: str = ROOT) -> dict:
+    """Applies the changes since the stored cursor, if a pull is due; see the module docstring."""
+    owner = owner or new_owner()
+    report = {"pulled": False, "pages": 0, "entries": 0, "deleted": 0, "updated": 0, "created": 0,
+              "skipped": 0, "deferred": 0, "complete": False}
+    row = claim(owner, root)
+    if row is None:
+        return report
+    report["pulled"] = True
+    deadline = time.monotonic() + budget_seconds
+    # no cursor yet: list_folder_pages lists the root in full, checkpointing as it goes
+    cursor, error = row.get("cursor"), None
+
+    # files held back last time go first; the ones still unmatched and recent are held again
+    files, held = _hold_back(row.get("deferred") or [])
+    counts = apply(files, [])
+    for k in ("deleted", "updated", "created", "skipped"):
+        report[k] += counts[k]
+
+    complete = False
+    try:
+        for entries, next_cursor in client.list_folder_pages(root, cursor):
+            files, deleted = _split(entries)
+            files, recent = _hold_back(files)
+            held += recent
+            counts = apply(files, deleted)
+            for k in ("deleted", "updated", "created", "skipped"):
+                report[k] += counts[k]
+            report["pages"] += 1
+            report["entries"] += len(entries)
+            if not _save(row, owner, {"cursor": next_cursor, "deferred": held,
+                                      "changes": (row.get("changes") or 0) + report["entries"]}):
+                logging.warning("dropbox_sync: lost the lease on %s", root)
+                return report
+            cursor = next_cursor
+            if time.monotonic() > deadline:
+                break
+        else:
+            complete = True
+    except dropbox.exceptions.ApiError as e:
+        err = getattr(e, "error", None)
+        if not (err is not None and hasattr(err, "is_reset") and err.is_reset()):
+            raise
+        # Dropbox expired the cursor: start again from now; what changed in between needs a reconcile
+        logging.error("dropbox_sync: cursor for %s was reset; changes since the last pull were skipped", root)
+        cursor, error, complete = client.latest_cursor(root), "cursor reset", True
+
+    if error is None and report["skipped"]:
+        error = f"{report['skipped']} entries skipped; see the function log"
+    patch = {"cursor": cursor, "deferred": held, "lease_owner": None, "lease_expires_at": None,
+             "last_error": error}
+    if complete:
+        patch["pulled_at"] = row["claimed_at"]
+    if held:
+        patch["requested_at"] = _iso(_now())
+    _save(row, owner, patch)
+    report.update(deferred=len(held), complete=complete)
+    return report
@@ -0,0 +1,62 @@
+# lib/folder_cache.py
+import threading, time
+from collections import OrderedDict
+from typing import Optional
+
+
+class FolderCache:
+    """
+    Bounded LRU + TTL set of Dropbox folders known to exist.
+
+    Adding `/a/b/c` also records `/a/b` and `/a`, since Dropbox can't hold a
+    folder without its parents. Evicting a folder drops its descendants too.
+    Paths are compared case-insensitively, like Dropbox does.
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 900.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return path.strip().rstrip("/").lower()
+
+    def __contains__(self, path: str) -> bool:
+        k = self._key(path)
+        now = time.monotonic()
+        with self._lock:
+            exp = self._entries.get(k)
+            if exp is None:
+                return False
+            if exp < now:
+                del self._entries[k]
+                return False
+            self._entries.move_to_end(k)
+            return True
+
+    def add(self, path: str, now: Optional[float] = None):
+        k = self._key(path)
+        exp = (now or time.monotonic()) + self.ttl
+        with self._lock:
+            while k:
+                self._entries[k] = exp
+                self._entries.move_to_end(k)
+                k = k.rpartition("/")[0]
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, path: str):
+        k = self._key(path)
+        prefix = k + "/"
+        with self._lock:
+            for key in [key for key in self._entries if key == k or key.startswith(prefix)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,190 @@
+# lib/idempotency.py
+"""
+Idempotency-Key handling for the upload endpoints.
+
+`claim(key)` returns the stored response for a key that already completed,
+or makes the caller the one request allowed to do the work:
+
+1. a bounded in-process LRU of completed keys answers repeats on this worker
+   without a round trip;
+2. a duplicate arriving while this worker is already handling the key waits
+   on that request instead of starting a second upload;
+3. otherwise the key is reserved in `upload_requests` with one
+   `insert ... on conflict do nothing returning` (PostgREST POST with
+   `resolution=ignore-duplicates`). Whoever gets the row back owns the key;
+   everyone else polls the row until the owner completes it. The reserve
+   isn't retried on a lost response; that error, like any other Supabase
+   failure here, lets the request proceed unguarded.
+
+A reservation is short-lived (PENDING_TTL) so a crashed owner doesn't hold
+the key forever; completion stores the response and extends the expiry to
+IDEMPOTENCY_TTL. Expired rows are ignored here and purged by
+functions/idempotency_purge.
+"""
+import logging, os, threading, time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from lib import supabase
+
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+# How long an unfinished reservation blocks duplicates, and how long a
+# duplicate waits for it before answering 409.
+PENDING_TTL = int(os.getenv("IDEMPOTENCY_PENDING_TTL", "300"))
+WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "60"))
+POLL_INTERVAL = 0.25
+CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "1024"))
+TABLE = "upload_requests"
+
+
+def _at(seconds: int) -> str:
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).isoformat()
+
+
+class _Completed:
+    """Bounded LRU of key -> (response, monotonic expiry)."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is None:
+                return None
+            if hit[1] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return hit[0]
+
+    def put(self, key: str, response: dict):
+        with self._lock:
+            self._entries[key] = (response, time.monotonic() + IDEMPOTENCY_TTL)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+_completed = _Completed(CACHE_SIZE)
+_inflight: Dict[str, threading.Event] = {}
+_inflight_lock = threading.Lock()
+
+
+class Claim:
+    """
+    Outcome of `claim(key)`. Exactly one of: `response` is set (replay it),
+    `owned` is true (do the work, then `complete` or `release`), or neither
+    (another request still holds the key; answer 409).
+    """
+
+    def __init__(self, key: Optional[str], response: Optional[dict] = None, owned: bool = False):
+        self.key = key
+        self.response = response
+        self.owned = owned
+
+    def complete(self, response: dict):
+        if not (self.key and self.owned):
+            return
+        _completed.put(self.key, response)
+        try:
+            if supabase.configured():
+                supabase.update(TABLE, {"idempotency_key": f"eq.{self.key}"},
+                                {"status": "done", "response": response, "expires_at": _at(IDEMPOTENCY_TTL)})
+        except Exception:
+            logging.exception("idempotency: storing response for %s failed", self.key)
+        finally:
+            _finish_local(self.key)
+
+    def release(self):
+        """Gives the key up after a failed attempt so a retry can run."""
+        if not (self.key and self.owned):
+            return
+        try:
+            if supabase.configured():
+                supabase.delete(TABLE, {"idempotency_key": f"eq.{self.key}", "status": "eq.pending"})
+        except Exception:
+            logging.exception("idempotency: releasing %s failed", self.key)
+        finally:
+            _finish_local(self.key)
+
+
+def _finish_local(key: str):
+    with _inflight_lock:
+        ev = _inflight.pop(key, None)
+    if ev is not None:
+        ev.set()
+
+
+def _reserve(key: str) -> bool:
+    # not retried on 502/504: a repeat of a reserve that landed comes back
+    # empty and would leave us waiting on our own row
+    return bool(supabase.upsert(TABLE, {"idempotency_key": key, "status": "pending", "response": None,
+                                        "expires_at": _at(PENDING_TTL)},
+                                on_conflict="idempotency_key", ignore_duplicates=True, returning=True,
+                                idempotent=False))
+
+
+def _fetch(key: str) -> Optional[dict]:
+    return supabase.select_one(TABLE, "status,response,expires_at", {"idempotency_key": f"eq.{key}"})
+
+
+def _drop_expired(key: str):
+    supabase.delete(TABLE, {"idempotency_key": f"eq.{key}",
+                            "expires_at": f"lt.{datetime.now(timezone.utc).isoformat()}"})
+
+
+def _claim_remote(key: str) -> Claim:
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while True:
+        if _reserve(key):
+            return Claim(key, owned=True)
+        row = _fetch(key)
+        # row None: released between our insert and read; otherwise still pending or expired
+        if row is not None:
+            if row["status"] == "done" and row.get("response") is not None:
+                return Claim(key, response=row["response"])
+            if row["expires_at"] and datetime.fromisoformat(row["expires_at"]) < datetime.now(timezone.utc):
+                _drop_expired(key)  # abandoned reservation or stale result
+        # every retry waits and respects the deadline, so a key that keeps flipping can't spin
+        if time.monotonic() >= deadline:
+            return Claim(key)
+        time.sleep(POLL_INTERVAL)
+
+
+def claim(key: Optional[str]) -> Claim:
+    if not key:
+        return Claim(None, owned=True)
+    prior = _completed.get(key)
+    if prior is not None:
+        return Claim(key, response=prior)
+
+    with _inflight_lock:
+        ev = _inflight.get(key)
+        if ev is None:
+            _inflight[key] = threading.Event()
+    if ev is not None:
+        # same key already running on this worker: wait for it
+        finished = ev.wait(WAIT_TIMEOUT)
+        prior = _completed.get(key)
+        if prior is not None:
+            return Claim(key, response=prior)
+        # the owner gave the key up after a failure: compete for it again
+        return claim(key) if finished else Claim(key)
+
+    if not supabase.configured():
+        return Claim(key, owned=True)
+    try:
+        c = _claim_remote(key)
+    except Exception:
+        # don't turn a Supabase hiccup into a failed upload
+        logging.exception("idempotency: reserving %s failed; proceeding unguarded", key)
+        c = Claim(key, owned=True)
+    if not c.owned:
+        if c.response is not None:
+            _completed.put(key, c.response)
+        _finish_local(key)
+    return c
@@ -0,0 +1,228 @@
+# lib/link_cache.py
+"""
+Cache of Dropbox temporary links for the get_temp_link endpoints.
+
+A temp link stays valid for four hours after `files_get_temporary_link`.
+`temp_link(client, path)` hands out a cached link while it still has at
+least MIN_REMAINING seconds to live, so a client always gets a link it can
+use for a while, and fetches a fresh one otherwise. Every answer carries
+`expires_at`: the fetch time plus LINK_LIFETIME, which is kept a few
+minutes under Dropbox's four hours.
+
+`temp_links(client, paths)` is the batch form: one shared-table query for
+the misses, then the links still missing fetched concurrently on at most
+WORKERS threads; results come back in input order, a failed fetch as the
+exception in its slot. `asset_paths` resolves many asset ids with one
+lookup.
+
+Two per-worker LRUs, both bounded: path -> (link, expiry) and
+asset id -> path (short ASSET_PATH_TTL, since transfers rewrite paths).
+With TEMP_LINK_CACHE_SHARED=1 links are also kept in the `temp_link_cache`
+table (migration V14) so every worker shares hits. Transfers call
+`invalidate_prefix(old_root)`, which drops this worker's entries and the
+shared rows under that folder; other workers' asset paths age out within
+ASSET_PATH_TTL.
+"""
+import logging, os, random, threading, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple, Union
+
+from lib import supabase
+
+# Dropbox temp links live 4 hours; claim a little less.
+LINK_LIFETIME = 4 * 3600 - 300
+# Don't hand out a cached link with less than this left on it.
+MIN_REMAINING = int(os.getenv("TEMP_LINK_MIN_REMAINING", "3600"))
+CACHE_SIZE = int(os.getenv("TEMP_LINK_CACHE_SIZE", "4096"))
+ASSET_PATH_TTL = float(os.getenv("TEMP_LINK_ASSET_PATH_TTL", "300"))
+SHARED = os.getenv("TEMP_LINK_CACHE_SHARED", "0") == "1"
+# Concurrent files_get_temporary_link calls for one batch.
+WORKERS = int(os.getenv("TEMP_LINK_WORKERS", "8"))
+TABLE = "temp_link_cache"
+# Fraction of shared writes that also delete expired rows.
+SHARED_GC_RATE = 0.01
+
+
+class _LRU:
+    """Bounded LRU map whose values carry an absolute (wall-clock) expiry."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, Tuple[object, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, min_remaining: float = 0.0):
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is None:
+                return None
+            if hit[1] - time.time() < min_remaining:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return hit
+
+    def put(self, key: Hashable, value, expires: float):
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard_where(self, pred: Callable[[Hashable, object], bool]) -> int:
+        with self._lock:
+            dead = [k for k, (v, _) in self._entries.items() if pred(k, v)]
+            for k in dead:
+                del self._entries[k]
+        return len(dead)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_links = _LRU(CACHE_SIZE)
+_asset_paths = _LRU(CACHE_SIZE)
+
+
+def _key(path: str) -> str:
+    return path.strip().rstrip("/").lower()
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def _under(path: str, prefix: str) -> bool:
+    return path == prefix or path.startswith(prefix + "/")
+
+
+# ---------- shared table ----------
+def _in_list(values: Iterable) -> str:
+    # quoted, so commas and parentheses in paths survive
+    return "in.(" + ",".join('"' + str(v).replace('"', '\\"') + '"' for v in values) + ")"
+
+
+def _shared_get(keys: List[str]) -> Dict[str, Tuple[str, float]]:
+    try:
+        rows = supabase.select(TABLE, "path_lower,link,expires_at",
+                               {"path_lower": _in_list(keys),
+                                "expires_at": f"gt.{_iso(time.time() + MIN_REMAINING)}"})
+    except Exception:
+        logging.exception("temp_link_cache lookup failed")
+        return {}
+    return {r["path_lower"]: (r["link"], datetime.fromisoformat(r["expires_at"]).timestamp()) for r in rows}
+
+
+def _shared_put(entries: Dict[str, Tuple[str, float]]):
+    try:
+        supabase.upsert(TABLE, [{"path_lower": k, "link": link, "expires_at": _iso(exp)}
+                                for k, (link, exp) in entries.items()])
+        if random.random() < SHARED_GC_RATE:
+            supabase.delete(TABLE, {"expires_at": f"lt.{_iso(time.time())}"})
+    except Exception:
+        logging.exception("temp_link_cache write failed")
+
+
+def _fetch(client, path: str) -> Union[Tuple[str, float], Exception]:
+    # stamp the expiry before asking, so it never runs past the real one
+    expires = time.time() + LINK_LIFETIME
+    try:
+        return client.get_temp_link(path), expires
+    except Exception as e:
+        return e
+
+
+# ---------- public ----------
+def temp_links(client, paths: List[str], workers: int = WORKERS) -> List[Union[Tuple[str, str], Exception]]:
+    """(link, expires_at ISO) per path, in order; a path whose link couldn't be fetched gets the exception."""
+    keys = [_key(p) for p in paths]
+    found: Dict[str, Union[Tuple[str, float], Exception]] = {}
+    first: Dict[str, str] = {}
+    for k, p in zip(keys, paths):
+        first.setdefault(k, p)
+        hit = _links.get(k, MIN_REMAINING)
+        if hit is not None:
+            found[k] = hit
+    missing = [k for k in first if k not in found]
+    shared = SHARED and supabase.configured()
+    if missing and shared:
+        for k, hit in _shared_get(missing).items():
+            _links.put(k, *hit)
+            found[k] = hit
+        missing = [k for k in missing if k not in found]
+    if len(missing) > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, len(missing))) as pool:
+            got = list(pool.map(lambda k: _fetch(client, first[k]), missing))
+    else:
+        got = [_fetch(client, first[k]) for k in missing]
+    fresh = {}
+    for k, hit in zip(missing, got):
+        found[k] = hit
+        if not isinstance(hit, Exception):
+            _links.put(k, *hit)
+            fresh[k] = hit
+    if fresh and shared:
+        _shared_put(fresh)
+    return [r if isinstance(r, Exception) else (r[0], _iso(r[1])) for r in (found[k] for k in keys)]
+
+
+def temp_link(client, path: str) -> Tuple[str, str]:
+    """(link, expires_at ISO) for `path`, from cache when it still has MIN_REMAINING to run."""
+    out = temp_links(client, [path])[0]
+    if isinstance(out, Exception):
+        raise out
+    return out
+
+
+def asset_path(asset_id: int, lookup: Callable[[int], Optional[str]]) -> Optional[str]:
+    """Dropbox path of a file_assets row, via `lookup` on a miss."""
+    hit = _asset_paths.get(asset_id)
+    if hit is not None:
+        return hit[0]
+    path = lookup(asset_id)
+    if path:
+        _asset_paths.put(asset_id, path, time.time() + ASSET_PATH_TTL)
+    return path
+
+
+def asset_paths(asset_ids: List[int], lookup: Callable[[List[int]], Dict[int, str]]) -> Dict[int, str]:
+    """Dropbox paths of many file_assets rows; one `lookup` call for the ids not cached. Unknown ids are left out."""
+    out, missing = {}, []
+    for aid in dict.fromkeys(asset_ids):
+        hit = _asset_paths.get(aid)
+        if hit is not None:
+            out[aid] = hit[0]
+        else:
+            missing.append(aid)
+    if missing:
+        expires = time.time() + ASSET_PATH_TTL
+        for aid, path in lookup(missing).items():
+            if path:
+                _asset_paths.put(aid, path, expires)
+                out[aid] = path
+    return out
+
+
+def invalidate_prefix(prefix: str) -> int:
+    """Forgets links and asset paths at or under `prefix` (a moved folder); returns local entries dropped."""
+    p = _key(prefix)
+    n = _links.discard_where(lambda k, _: _under(k, p))
+    n += _asset_paths.discard_where(lambda _, path: _under(_key(path), p))
+    if SHARED and supabase.configured():
+        try:
+            # PostgREST `like` uses * as the wildcard; _ and % in the path are escaped
+            # (a * can't be, and only widens the delete to a few extra cache rows)
+            literal = p.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            supabase.delete(TABLE, {"path_lower": f"like.{literal}/*"})
+            supabase.delete(TABLE, {"path_lower": f"eq.{p}"})
+        except Exception:
+            logging.exception("temp_link_cache invalidation failed for %s", prefix)
+    return n
+
+
+def clear():
+    _links.clear()
+    _asset_paths.clear()
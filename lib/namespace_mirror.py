@@ -0,0 +1,339 @@
+# lib/namespace_mirror.py
+"""
+Local SQLite mirror of the Dropbox tree under ROOT.
+
+Folder existence checks, drift comparisons and audit queries can be
+answered from an indexed copy of the namespace instead of the Dropbox API:
+`exists` / `is_folder` / `get` are primary-key lookups, `children` walks
+the parent index, `subtree` is one range scan over the primary key (every
+path under `/a/b` sorts between `/a/b/` and `/a/b0`) and `find_by_hash`
+uses the content_hash index. None of them makes a network call.
+
+The database is one file per host (MIRROR_PATH, in WAL mode, so the
+worker processes on it read concurrently while one of them writes).
+`sync(client)` fills it from a recursive `files/list_folder` of ROOT and
+afterwards replays `files/list_folder/continue` from the stored cursor.
+Each page is applied together with its cursor in one transaction that
+first checks the stored cursor is still the one the page continues from;
+if another process got there first the page is dropped, so changes are
+never applied out of order. An expired cursor relists.
+
+Cold start: with SNAPSHOT_PATH set (shared storage, e.g. under /home on
+Azure Functions), a worker whose mirror is empty restores the snapshot
+with the SQLite backup API and continues from the snapshot's cursor,
+which costs a few list_folder/continue calls instead of a full relist.
+Whichever worker syncs next after the snapshot is SNAPSHOT_EVERY seconds
+old writes a new one (`VACUUM INTO` a temp file, then an atomic rename).
+
+The mirror is as current as its last sync. `refresh(client)` starts a
+background sync when it is more than MAX_AGE seconds old, so callers on
+the request path never wait for Dropbox. It is opt-in (NAMESPACE_MIRROR=1);
+`shared()` returns None otherwise.
+"""
+import logging, os, shutil, sqlite3, tempfile, threading, time
+from typing import Dict, List, Optional
+
+import dropbox
+
+from lib.pathmap import ROOT
+
+ENABLED = os.getenv("NAMESPACE_MIRROR", "0") == "1"
+MIRROR_PATH = os.getenv("NAMESPACE_MIRROR_PATH") or os.path.join(tempfile.gettempdir(), "altus_namespace.sqlite")
+SNAPSHOT_PATH = os.getenv("NAMESPACE_MIRROR_SNAPSHOT") or None
+# A sync older than this triggers a background refresh on the next lookup.
+MAX_AGE = float(os.getenv("NAMESPACE_MIRROR_MAX_AGE", "60"))
+SNAPSHOT_EVERY = float(os.getenv("NAMESPACE_MIRROR_SNAPSHOT_EVERY", "900"))
+# Seconds a writer waits for another process's transaction.
+BUSY_TIMEOUT = 30.0
+
+_SCHEMA = """
+create table if not exists entries (
+  path_lower text primary key,
+  parent text not null,
+  path text not null,
+  tag text not null,               -- 'file' | 'folder'
+  id text,
+  rev text,
+  size integer,
+  content_hash text,
+  server_modified text
+) without rowid;
+create index if not exists entries_parent on entries (parent);
+create index if not exists entries_content_hash on entries (content_hash) where content_hash is not null;
+create table if not exists meta (key text primary key, value text);
+"""
+
+_COLUMNS = ("path_lower", "parent", "path", "tag", "id", "rev", "size", "content_hash", "server_modified")
+
+
+def _key(path: str) -> str:
+    path = path.strip().rstrip("/").lower()
+    return path if path.startswith("/") else "/" + path
+
+
+def _parent(key: str) -> str:
+    return key.rsplit("/", 1)[0] or "/"
+
+
+def _under(key: str):
+    """(lo, hi) bounds of the paths strictly under `key`; '0' is the character after '/'."""
+    return key + "/", key + "0"
+
+
+def _is_reset(e: dropbox.exceptions.ApiError) -> bool:
+    err = getattr(e, "error", None)
+    return err is not None and hasattr(err, "is_reset") and err.is_reset()
+
+
+def _row(md) -> Optional[tuple]:
+    if isinstance(md, dropbox.files.FileMetadata):
+        modified = md.server_modified.isoformat() if md.server_modified else None
+        return (md.path_lower, _parent(md.path_lower), md.path_display or md.path_lower, "file", md.id,
+                md.rev, md.size, md.content_hash, modified)
+    if isinstance(md, dropbox.files.FolderMetadata):
+        return (md.path_lower, _parent(md.path_lower), md.path_display or md.path_lower, "folder", md.id,
+                None, None, None, None)
+    return None
+
+
+class NamespaceMirror:
+    def __init__(self, path: str = MIRROR_PATH, root: str = ROOT, snapshot_path: Optional[str] = SNAPSHOT_PATH):
+        self.path = path
+        self.root = root
+        self.root_key = _key(root)
+        self.snapshot_path = snapshot_path
+        self._local = threading.local()
+        self._sync_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+        if self.cursor() is None and snapshot_path and os.path.exists(snapshot_path):
+            self.restore(snapshot_path)
+
+    # ---------- connections ----------
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread; autocommit, transactions are explicit."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                                   check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("pragma journal_mode=wal")
+            # the mirror can always be rebuilt from Dropbox; don't fsync every commit
+            conn.execute("pragma synchronous=normal")
+            self._local.conn = conn
+        return conn
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self._conn().execute("select value from meta where key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def cursor(self) -> Optional[str]:
+        return self._meta("cursor")
+
+    def age(self) -> float:
+        """Seconds since the last completed sync; infinite before the first."""
+        synced = self._meta("synced_at")
+        return time.time() - float(synced) if synced else float("inf")
+
+    @property
+    def ready(self) -> bool:
+        """True once a full listing has been applied (lookups reflect the whole tree)."""
+        return self.cursor() is not None and self._meta("listing") is None
+
+    # ---------- lookups ----------
+    def get(self, path: str) -> Optional[Dict]:
+        row = self._conn().execute("select * from entries where path_lower = ?", (_key(path),)).fetchone()
+        return dict(row) if row else None
+
+    def exists(self, path: str) -> bool:
+        return self._conn().execute("select 1 from entries where path_lower = ?", (_key(path),)).fetchone() is not None
+
+    def is_folder(self, path: str) -> bool:
+        row = self._conn().execute("select tag from entries where path_lower = ?", (_key(path),)).fetchone()
+        return row is not None and row[0] == "folder"
+
+    def children(self, path: str) -> List[Dict]:
+        rows = self._conn().execute("select * from entries where parent = ? order by path_lower", (_key(path),))
+        return [dict(r) for r in rows]
+
+    def subtree(self, path: str) -> Dict[str, int]:
+        """{"files", "folders", "bytes"} strictly under `path`."""
+        lo, hi = _under(_key(path))
+        row = self._conn().execute(
+            "select coalesce(sum(tag = 'file'), 0), coalesce(sum(tag = 'folder'), 0), coalesce(sum(size), 0) "
+            "from entries where path_lower >= ? and path_lower < ?", (lo, hi)).fetchone()
+        return {"files": row[0], "folders": row[1], "bytes": row[2]}
+
+    def find_by_hash(self, content_hash: str, under: Optional[str] = None) -> List[Dict]:
+        sql, args = "select * from entries where content_hash = ?", [content_hash]
+        if under:
+            sql += " and path_lower >= ? and path_lower < ?"
+            args += _under(_key(under))
+        return [dict(r) for r in self._conn().execute(sql + " order by path_lower", args)]
+
+    def folders(self, under: Optional[str] = None) -> set:
+        """Lower-cased paths of every folder under `under` (default the root), itself included."""
+        key = _key(under or self.root)
+        lo, hi = _under(key)
+        rows = self._conn().execute(
+            "select path_lower from entries where tag = 'folder' and (path_lower = ? or "
+            "(path_lower >= ? and path_lower < ?))", (key, lo, hi))
+        return {r[0] for r in rows}
+
+    # ---------- sync ----------
+    def _apply_page(self, entries, expected: Optional[str], next_cursor: str, relist: bool) -> bool:
+        """Applies one page and its cursor if the stored cursor is still `expected`."""
+        conn = self._conn()
+        conn.execute("begin immediate")
+        try:
+            if self.cursor() != expected:
+                conn.execute("rollback")
+                return False
+            if relist and expected is None:
+                conn.execute("delete from entries")
+                conn.execute("insert or replace into meta values ('listing', '1')")
+            upserts = []
+            for e in entries:
+                if isinstance(e, dropbox.files.DeletedMetadata):
+                    if upserts:
+                        conn.executemany(f"insert or replace into entries values ({','.join('?' * len(_COLUMNS))})",
+                                         upserts)
+                        upserts = []
+                    lo, hi = _under(e.path_lower)
+                    conn.execute("delete from entries where path_lower = ? or (path_lower >= ? and path_lower < ?)",
+                                 (e.path_lower, lo, hi))
+                else:
+                    row = _row(e)
+                    if row is not None:
+                        upserts.append(row)
+            if upserts:
+                conn.executemany(f"insert or replace into entries values ({','.join('?' * len(_COLUMNS))})", upserts)
+            conn.execute("insert or replace into meta values ('cursor', ?)", (next_cursor,))
+            conn.execute("commit")
+        except BaseException:
+            conn.execute("rollback")
+            raise
+        return True
+
+    def _consume(self, pages, cursor: Optional[str], report: dict) -> Optional[str]:
+        relist = cursor is None
+        for entries, next_cursor in pages:
+            if not self._apply_page(entries, cursor, next_cursor, relist):
+                report["superseded"] = True
+                return None
+            report["pages"] += 1
+            report["entries"] += len(entries)
+            cursor, relist = next_cursor, False
+        return cursor
+
+    def sync(self, client) -> dict:
+        """
+        Brings the mirror up to date: a full listing when it is empty,
+        otherwise the changes since its cursor. Returns page / entry counts.
+        """
+        report = {"pages": 0, "entries": 0, "relisted": False, "superseded": False}
+        with self._sync_lock:
+            cursor = self.cursor()
+            report["relisted"] = cursor is None
+            try:
+                done = self._consume(client.list_folder_pages(self.root, cursor), cursor, report)
+            except dropbox.exceptions.ApiError as e:
+                if not _is_reset(e):
+                    raise
+                logging.warning("namespace mirror: cursor for %s was reset; relisting", self.root)
+                conn = self._conn()
+                conn.execute("delete from meta where key = 'cursor'")
+                report["relisted"] = True
+                done = self._consume(client.list_folder_pages(self.root), None, report)
+            if done is None:
+                return report
+            conn = self._conn()
+            conn.execute("insert or ignore into entries values (?, ?, ?, 'folder', null, null, null, null, null)",
+                         (self.root_key, _parent(self.root_key), self.root))
+            conn.execute("delete from meta where key = 'listing'")
+            conn.execute("insert or replace into meta values ('synced_at', ?)", (str(time.time()),))
+        if self.snapshot_path and self._snapshot_age() > SNAPSHOT_EVERY:
+            try:
+                self.save_snapshot(self.snapshot_path)
+            except Exception:
+                logging.exception("namespace mirror: snapshot to %s failed", self.snapshot_path)
+        return report
+
+    def refresh(self, client, max_age: float = MAX_AGE, wait: bool = False):
+        """Syncs in a background thread (or inline with `wait`) if the last sync is older than `max_age`."""
+        if self.age() <= max_age:
+            return
+        if wait:
+            self.sync(client)
+            return
+        with self._refresh_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.sync(client)
+            except Exception:
+                logging.exception("namespace mirror: background sync failed")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name="namespace-mirror-sync", daemon=True).start()
+
+    # ---------- snapshots ----------
+    def _snapshot_age(self) -> float:
+        try:
+            return time.time() - os.path.getmtime(self.snapshot_path)
+        except OSError:
+            return float("inf")
+
+    def save_snapshot(self, dest: str):
+        """Writes a compacted copy of the mirror to `dest`, replacing it atomically."""
+        os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+        tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        self._conn().execute("vacuum into ?", (tmp,))
+        os.replace(tmp, dest)
+
+    def restore(self, src: str):
+        """Replaces the mirror's contents (and cursor) with the snapshot at `src`."""
+        # copy first: the snapshot may sit on a network share another worker is replacing
+        local = f"{self.path}.restore"
+        shutil.copyfile(src, local)
+        try:
+            snap = sqlite3.connect(local)
+            try:
+                snap.backup(self._conn())
+            finally:
+                snap.close()
+        finally:
+            os.remove(local)
+        # the restored copy carries the snapshot's cursor; the next sync replays from there
+        self._conn().execute("delete from meta where key = 'synced_at'")
+
+
+_shared: Optional[NamespaceMirror] = None
+_shared_lock = threading.Lock()
+
+
+def shared() -> Optional[NamespaceMirror]:
+    """The worker's mirror of ROOT, opened on first use; None unless NAMESPACE_MIRROR=1."""
+    global _shared
+    if not ENABLED:
+        return None
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = NamespaceMirror()
+    return _shared
+
+
+def reset_shared():
+    """Forgets the worker's mirror (the file stays). Used by the local benchmarks."""
+    global _shared
+    with _shared_lock:
+        _shared = None
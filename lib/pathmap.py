@@ -1,19 +1,27 @@
 # lib/pathmap.py
-import re
-from typing import Optional, Dict, Any
+import os, re
+from functools import lru_cache
+from typing import Optional, Dict, Any, Iterable, List, Callable, Mapping, Tuple, Union
 
 ROOT = "/Altus_Empire_Command_Center"
 OWNERS_DIR = "00_Owners"
 AUM_DIR = "10_AUM"  # Assets Under Management lives under each owner
 
+# Names repeat across requests (same owners, properties, units), so slugs are memoized.
+SLUG_CACHE_SIZE = int(os.getenv("PATHMAP_SLUG_CACHE_SIZE", "4096"))
+
 _slug_rx = re.compile(r"[^a-z0-9]+")
+@lru_cache(maxsize=SLUG_CACHE_SIZE)
 def slugify(s: Optional[str]) -> str:
     if not s: return "unknown"
     s = _slug_rx.sub("-", s.strip().lower()).strip("-")
     return s or "unknown"
 
+def _present(v) -> bool:
+    return v not in (None, "", "null")
+
 def _tag(name: str, idlike: Optional[int | str]) -> str:
-    return f"{slugify(name)}{'-' + str(idlike) if idlike not in (None, '', 'null') else ''}"
+    return f"{slugify(name)}{'-' + str(idlike) if _present(idlike) else ''}"
 
 # ---------- Owner ----------
 def owner_root(owner_name: str, owner_id: Optional[int | str]) -> str:
@@ -74,3 +82,243 @@ def lease_root(owner_name: str, owner_id: Optional[int | str],
     return f"{property_root(owner_name, owner_id, property_name, property_id)}/02_Leases/{_tag('lease', lease_id)}"
 
 LEASE_SUBS = ["Signed_Lease_Agreement","Amendments","Tenant_Correspondence"]
+
+# ---------- Applicant (under Property/02_Leases, before there is a tenancy) ----------
+def applicant_root(owner_name: str, owner_id: Optional[int | str],
+                   property_name: str, property_id: Optional[int | str],
+                   applicant_name: str, applicant_id: Optional[int | str]) -> str:
+    return f"{property_root(owner_name, owner_id, property_name, property_id)}/02_Leases/00_Applicants/{_tag(applicant_name or 'applicant', applicant_id)}"
+
+APPLICANT_SUBS = ["Application","Screening","Income","Identity","Correspondence"]
+
+# ---------- Work order (under the unit's 04_Work_Orders, or the property's 05_Work_Orders) ----------
+def work_order_root(owner_name: str, owner_id: Optional[int | str],
+                    property_name: str, property_id: Optional[int | str],
+                    unit_name: str, unit_id: Optional[int | str],
+                    work_order_id: Optional[int | str]) -> str:
+    if _present(unit_id):
+        base = f"{unit_root(owner_name, owner_id, property_name, property_id, unit_name, unit_id)}/04_Work_Orders"
+    else:
+        base = f"{property_root(owner_name, owner_id, property_name, property_id)}/05_Work_Orders"
+    return f"{base}/{_tag('wo', work_order_id)}"
+
+WORK_ORDER_SUBS = ["Photos","Invoices","Docs"]
+
+# ---------- reverse: entity ids from a path in the owner tree ----------
+_tag_id_rx = re.compile(r"-(\d+)$")
+# (segment index below ROOT/OWNERS_DIR, folder name expected just before it or None, key)
+_ID_SEGMENTS = ((0, None, "owner_id"), (2, AUM_DIR, "property_id"), (4, "01_Units", "unit_id"))
+
+def ids_from_path(path: str) -> Dict[str, int]:
+    """
+    owner_id / property_id / unit_id read back from the `-<id>` tag suffixes
+    of a path under ROOT/OWNERS_DIR; {} for paths outside the owner tree.
+    Only folder segments count, so a file name ending in digits is ignored.
+    """
+    parts = (path or "").strip("/").split("/")
+    head = f"{ROOT}/{OWNERS_DIR}".strip("/").lower().split("/")
+    if [p.lower() for p in parts[:len(head)]] != head:
+        return {}
+    folders = parts[len(head):-1]
+    out: Dict[str, int] = {}
+    for i, before, key in _ID_SEGMENTS:
+        if i >= len(folders) or (before and folders[i - 1].lower() != before.lower()):
+            break
+        m = _tag_id_rx.search(folders[i])
+        if m:
+            out[key] = int(m.group(1))
+    return out
+
+# ---------- provisioning: folders for one new entity ----------
+def entity_folders(entity_type: str, data: Mapping[str, Any]) -> List[str]:
+    """
+    Base folder plus the subfolders provisioning creates for a new entity.
+    `name`/`id` in `data` are the entity's own, e.g. a unit row carries
+    owner_name/owner_id, property_name/property_id, name and id. Both
+    dropbox_provision_folders handlers and onboard_portfolio use this.
+    """
+    e = (entity_type or "").strip().lower()
+    g = data.get
+    if e == "owner":
+        return with_subs(owner_root(g("name"), g("id")), OWNER_SUBS)
+    if e == "property":
+        return with_subs(property_root(g("owner_name"), g("owner_id"), g("name"), g("id")), PROPERTY_SUBS)
+    if e == "unit":
+        return with_subs(unit_root(g("owner_name"), g("owner_id"), g("property_name"), g("property_id"),
+                                   g("name"), g("id")), UNIT_SUBS)
+    if e in ("tenancy", "tenant"):
+        return with_subs(tenancy_root(g("owner_name"), g("owner_id"), g("property_name"), g("property_id"),
+                                      g("unit_name"), g("unit_id"), data), TENANCY_SUBS)
+    if e in ("lease", "lease_legacy"):
+        return with_subs(lease_root(g("owner_name"), g("owner_id"), g("property_name"), g("property_id"),
+                                    g("id")), LEASE_SUBS)
+    if e == "applicant":
+        return with_subs(applicant_root(g("owner_name"), g("owner_id"), g("property_name"), g("property_id"),
+                                        g("name"), g("id")), APPLICANT_SUBS)
+    if e == "work_order":
+        return with_subs(work_order_root(g("owner_name"), g("owner_id"), g("property_name"), g("property_id"),
+                                         g("unit_name"), g("unit_id"), g("id")), WORK_ORDER_SUBS)
+    raise ValueError(f"Unknown entity_type '{entity_type}'")
+
+class PathTrie:
+    """
+    Folder paths merged on their shared prefixes (case-insensitively, as
+    Dropbox compares them): each folder is stored once however many
+    entities name it, and `leaves()` is the minimal set to create.
+    """
+
+    def __init__(self, paths: Iterable[str] = ()):
+        # node: {lower-cased name: [display name, children]}
+        self._root: Dict[str, list] = {}
+        self.folders = 0
+        for p in paths:
+            self.add(p)
+
+    def add(self, path: str):
+        node = self._root
+        for part in path.strip("/").split("/"):
+            if not part:
+                continue
+            child = node.get(part.lower())
+            if child is None:
+                child = node[part.lower()] = [part, {}]
+                self.folders += 1
+            node = child[1]
+
+    def leaves(self) -> List[str]:
+        """Folders with no children, depth-first (siblings in insertion order)."""
+        out: List[str] = []
+        def walk(prefix, node):
+            for name, children in node.values():
+                if children:
+                    walk(f"{prefix}/{name}", children)
+                else:
+                    out.append(f"{prefix}/{name}")
+        walk("", self._root)
+        return out
+
+# ---------- upload routing ----------
+# entity_type -> destination folder template(s), "<anchor>/<sub path>". With
+# several templates the first whose anchor key is in the upload's meta wins
+# (e.g. a unit-level folder when unit_id is given); the last one always
+# applies. "{category|Default}" takes meta["category"] when it is one of the
+# anchor's subfolders, else Default. Sub paths are the folders provisioning
+# creates (the *_SUBS lists above).
+ROUTES: Dict[str, Union[str, Tuple[str, ...]]] = {
+    # media
+    "PropertyPhoto":            "property/11_Media",
+    "PropertyVideo":            "property/11_Media",
+    "UnitPhoto":                ("unit/06_Media", "property/11_Media"),
+    "PropertyNotice":           "property/09_Notices",
+
+    # inspections / work orders / turnover
+    "Inspection":               ("unit/03_Inspections", "property/04_Inspections"),
+    "WorkOrder":                ("unit/04_Work_Orders", "property/05_Work_Orders"),
+    "WorkOrderDoc":             "work_order/{category|Docs}",
+    "TurnoverPrePhoto":         "unit/01_Photos",
+    "TurnoverPostPhoto":        "unit/01_Photos",
+    "TurnoverBudget":           "unit/07_Construction",
+
+    # tenancy-centric (the legacy property-level lease folder without a unit)
+    "LeaseSigned":              ("tenancy/02_Lease/Signed", "lease/Signed_Lease_Agreement"),
+    "LeaseAmendment":           ("tenancy/02_Lease/Amendments", "lease/Amendments"),
+    "LeaseAddendum":            "tenancy/02_Lease/Addenda",
+    "TenantNotice":             "tenancy/04_Notices",
+    "LeaseNotice":              "tenancy/04_Notices",
+    "TenantCorrespondence":     ("tenancy/03_Correspondence", "lease/Tenant_Correspondence"),
+    "LeaseCorrespondence":      ("tenancy/03_Correspondence", "lease/Tenant_Correspondence"),
+    "RentReceipt":              "tenancy/05_Rent",
+    "SubsidyDoc":               "tenancy/06_Subsidy",
+    "LeaseSubsidyVoucher":      "tenancy/06_Subsidy",
+    "MoveInDoc":                "tenancy/08_Move_In",
+    "MoveOutDoc":               "tenancy/09_Move_Out",
+    "TenantLegal":              "tenancy/10_Legal",
+    "TenantCompliance":         "tenancy/11_Compliance",
+    "TenantDocument":           "tenancy/12_Documents",
+    "ApplicantDoc":             "applicant/{category|Application}",
+
+    # owner
+    "OwnerManagementAgreement": "owner/02_Agreements",
+    "OwnerW9":                  "owner/03_Tax",
+    "OwnerDirectDeposit":       "owner/06_Bill_Pay",
+    "OwnerRemitPackage":        "owner/05_Reports",
+    "OwnerCommunication":       "owner/04_Comms",
+}
+
+# anchor -> (root builder over upload meta, meta key the anchor needs, its subfolders)
+_ANCHORS: Dict[str, Tuple[Callable[[Mapping[str, Any]], str], Optional[str], List[str]]] = {
+    "owner": (lambda m: owner_root(m.get("owner_name"), m.get("owner_id")), None, OWNER_SUBS),
+    "property": (lambda m: property_root(m.get("owner_name"), m.get("owner_id"),
+                                         m.get("property_name"), m.get("property_id")), None, PROPERTY_SUBS),
+    "unit": (lambda m: unit_root(m.get("owner_name"), m.get("owner_id"), m.get("property_name"), m.get("property_id"),
+                                 m.get("unit_name"), m.get("unit_id")), "unit_id", UNIT_SUBS),
+    "tenancy": (lambda m: tenancy_root(m.get("owner_name"), m.get("owner_id"), m.get("property_name"),
+                                       m.get("property_id"), m.get("unit_name"), m.get("unit_id"), m), "unit_id",
+                TENANCY_SUBS),
+    "lease": (lambda m: lease_root(m.get("owner_name"), m.get("owner_id"), m.get("property_name"),
+                                   m.get("property_id"), m.get("lease_id")), "lease_id", LEASE_SUBS),
+    "applicant": (lambda m: applicant_root(m.get("owner_name"), m.get("owner_id"), m.get("property_name"),
+                                           m.get("property_id"), m.get("applicant_name"), m.get("applicant_id")),
+                  None, APPLICANT_SUBS),
+    "work_order": (lambda m: work_order_root(m.get("owner_name"), m.get("owner_id"), m.get("property_name"),
+                                             m.get("property_id"), m.get("unit_name"), m.get("unit_id"),
+                                             m.get("work_order_id")), None, WORK_ORDER_SUBS),
+}
+
+_category_rx = re.compile(r"^\{category\|([^}]+)\}$")
+
+def _compile_template(template: str) -> Tuple[Optional[str], Callable[[Mapping[str, Any]], str]]:
+    anchor, _, sub = template.partition("/")
+    build, needs, subs = _ANCHORS[anchor]
+    m = _category_rx.match(sub)
+    if m:
+        default, allowed = m.group(1), frozenset(subs)
+        def fn(meta):
+            cat = meta.get("category")
+            return f"{build(meta)}/{cat if cat in allowed else default}"
+    else:
+        def fn(meta):
+            return f"{build(meta)}/{sub}"
+    return needs, fn
+
+def _compile(templates: Union[str, Tuple[str, ...]]) -> Callable[[Mapping[str, Any]], str]:
+    compiled = [_compile_template(t) for t in ((templates,) if isinstance(templates, str) else templates)]
+    if len(compiled) == 1:
+        return compiled[0][1]
+    *guarded, (_, last) = compiled
+    def fn(meta):
+        for needs, build in guarded:
+            if needs is None or _present(meta.get(needs)):
+                return build(meta)
+        return last(meta)
+    return fn
+
+# built once at import; a request only runs the one it needs
+_ROUTERS: Dict[str, Callable[[Mapping[str, Any]], str]] = {k: _compile(v) for k, v in ROUTES.items()}
+
+def route_for(entity_type: str, meta: Mapping[str, Any]) -> str:
+    """Dropbox folder an upload of `entity_type` goes to; ValueError for an unknown type."""
+    router = _ROUTERS.get(entity_type)
+    if router is None:
+        raise ValueError(f"Unknown entity_type '{entity_type}'")
+    return router(meta or {})
+
+# ---------- provisioning helpers ----------
+def with_subs(base: str, subs: Iterable[str]) -> List[str]:
+    return [base] + [f"{base}/{s}" for s in subs]
+
+def leaf_paths(paths: Iterable[str]) -> List[str]:
+    """
+    Drops every path that is an ancestor of another one in `paths` (Dropbox
+    creates intermediate folders implicitly). Order of first appearance is kept.
+    """
+    uniq = list(dict.fromkeys(p.rstrip("/") for p in paths if p))
+    ancestors = set()
+    for p in uniq:
+        head = p.lower()
+        while "/" in head:
+            head = head.rsplit("/", 1)[0]
+            if head in ancestors:
+                break
+            ancestors.add(head)
+    return [p for p in uniq if p.lower() not in ancestors]
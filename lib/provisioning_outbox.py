@@ -0,0 +1,139 @@
+# lib/provisioning_outbox.py
+"""
+Consumer for `provisioning_outbox` (migration V16), which the
+properties/units/leases insert triggers fill instead of calling the
+provisioning Function synchronously.
+
+`run()` repeatedly claims up to BATCH due rows through the
+`provisioning_outbox_claim` RPC (`for update skip locked`, so concurrent
+consumers never share a row), merges every row's folders in one PathTrie,
+creates only the leaves with `create_folders` (WORKERS batch jobs in
+flight) and writes each row's outcome back with
+`provisioning_outbox_finish` in one call:
+
+- done when every folder the row needs was created or already existed;
+- retried after an exponential backoff (with jitter) when Dropbox failed;
+- dead after MAX_ATTEMPTS claims, or at once for an entity type pathmap
+  can't route.
+
+Claims are leases of LEASE_SECONDS: rows held by a consumer that died are
+claimed again after it, and its late write-back is ignored. `rpc` defaults
+to supabase.rpc; bench/outbox_pg.py passes one bound to a local Postgres.
+"""
+import logging, os, random, socket, time, uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from lib import supabase
+from lib.pathmap import PathTrie, entity_folders
+
+TABLE = "provisioning_outbox"
+BATCH = int(os.getenv("PROVISIONING_OUTBOX_BATCH", "200"))
+LEASE_SECONDS = int(os.getenv("PROVISIONING_OUTBOX_LEASE_SECONDS", "120"))
+MAX_ATTEMPTS = int(os.getenv("PROVISIONING_OUTBOX_MAX_ATTEMPTS", "8"))
+# Retry backoff: first delay and cap (seconds), with jitter.
+RETRY_DELAY = float(os.getenv("PROVISIONING_OUTBOX_RETRY_DELAY", "30"))
+RETRY_MAX_DELAY = float(os.getenv("PROVISIONING_OUTBOX_RETRY_MAX_DELAY", "3600"))
+# create_folder_batch jobs in flight per claimed batch.
+WORKERS = int(os.getenv("PROVISIONING_OUTBOX_WORKERS", "4"))
+# Done rows are purged after this many days; dead rows stay until requeued or deleted.
+RETENTION_DAYS = float(os.getenv("PROVISIONING_OUTBOX_RETENTION_DAYS", "7"))
+
+Rpc = Callable[[str, dict], object]
+
+
+def _iso(dt: datetime) -> str:
+    return dt.isoformat()
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(RETRY_DELAY * 2 ** max(attempts - 1, 0), RETRY_MAX_DELAY)
+    return delay * (0.5 + random.random() / 2)
+
+
+def new_owner() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def claim(owner: str, limit: int = BATCH, rpc: Optional[Rpc] = None) -> List[dict]:
+    rpc = rpc or supabase.rpc
+    return rpc("provisioning_outbox_claim", {"p_owner": owner, "p_limit": limit,
+                                             "p_lease_seconds": LEASE_SECONDS}) or []
+
+
+def _outcome(row: dict, error: Optional[str], permanent: bool = False) -> dict:
+    if error is None:
+        return {"id": row["id"], "status": "done", "last_error": None, "next_attempt_at": None}
+    dead = permanent or row["attempts"] >= MAX_ATTEMPTS
+    return {"id": row["id"], "status": "dead" if dead else "pending", "last_error": error[:1000],
+            "next_attempt_at": None if dead else _iso(_now() + timedelta(seconds=_backoff(row["attempts"])))}
+
+
+def work_batch(client, rows: List[dict]) -> List[dict]:
+    """Creates the folders of claimed rows; one outcome per row for provisioning_outbox_finish."""
+    out, needs = [], []
+    trie = PathTrie()
+    for row in rows:
+        if row["attempts"] > MAX_ATTEMPTS:
+            # only reachable when every earlier claim's lease ran out
+            out.append(_outcome(row, f"gave up after {row['attempts'] - 1} expired claims", permanent=True))
+            continue
+        try:
+            folders = entity_folders(row["entity_type"], row.get("payload") or {})
+        except ValueError as e:
+            out.append(_outcome(row, str(e), permanent=True))
+            continue
+        for f in folders:
+            trie.add(f)
+        needs.append((row, [f.rstrip("/").lower() for f in folders]))
+    if not needs:
+        return out
+
+    leaves = trie.leaves()
+    try:
+        results = client.create_folders(leaves, workers=WORKERS)
+    except Exception as e:
+        logging.exception("provisioning_outbox: create_folders failed for %d rows", len(needs))
+        return out + [_outcome(row, f"create_folders: {e}") for row, _ in needs]
+
+    # a failed leaf may leave any of its ancestors uncreated
+    failed = {p.rstrip("/").lower(): f"{p}: {r}" for p, r in results.items() if r not in ("created", "exists")}
+    for row, folders in needs:
+        errs = [msg for leaf, msg in failed.items()
+                if any(leaf == f or leaf.startswith(f + "/") for f in folders)] if failed else []
+        out.append(_outcome(row, "; ".join(errs[:5]) if errs else None))
+    return out
+
+
+def run(client, budget_seconds: float, owner: Optional[str] = None, rpc: Optional[Rpc] = None) -> dict:
+    """Claims and provisions batches until nothing is due or the time budget is spent."""
+    rpc = rpc or supabase.rpc
+    owner = owner or new_owner()
+    deadline = time.monotonic() + budget_seconds
+    t0 = time.perf_counter()
+    totals: Dict[str, int] = {"batches": 0, "claimed": 0, "done": 0, "retry": 0, "dead": 0, "lost": 0}
+    while time.monotonic() < deadline:
+        rows = claim(owner, BATCH, rpc)
+        if not rows:
+            break
+        outcomes = work_batch(client, rows)
+        written = rpc("provisioning_outbox_finish", {"p_owner": owner, "p_results": outcomes}) or 0
+        totals["batches"] += 1
+        totals["claimed"] += len(rows)
+        totals["lost"] += len(outcomes) - written
+        for o in outcomes:
+            totals["retry" if o["status"] == "pending" else o["status"]] += 1
+            if o["status"] == "dead":
+                logging.error("provisioning_outbox: row %s dead: %s", o["id"], o["last_error"])
+        if len(rows) < BATCH:
+            break
+    return dict(totals, owner=owner, seconds=round(time.perf_counter() - t0, 3))
+
+
+def purge(days: float = RETENTION_DAYS):
+    """Deletes done rows last updated more than `days` ago."""
+    supabase.delete(TABLE, {"status": "eq.done", "updated_at": f"lt.{_iso(_now() - timedelta(days=days))}"})
@@ -0,0 +1,256 @@
+# lib/rate_limit.py
+"""
+Shared pacing and retries for outbound calls.
+
+Every Dropbox API request (lib/dropbox_client.py) and every PostgREST
+request (lib/supabase.py) runs through `call(namespace, fn, classify)`.
+Each namespace ("dropbox", "supabase") has, per worker:
+
+- a token bucket: RATE_LIMIT_<NS>_RPS requests per second with bursts of
+  RATE_LIMIT_<NS>_BURST. 0 (the default) starts unlimited;
+- a cap of RATE_LIMIT_<NS>_CONCURRENCY requests in flight;
+- one pause for everybody: a throttle's Retry-After holds the whole
+  namespace, so the other threads don't each spend a request rediscovering
+  the limit;
+- an adaptive rate: a throttle cuts the bucket to DECREASE x the rate
+  requests were being accepted at (or its own rate, if lower), and every
+  success after that grows it again by INCREASE per second (5%/s), never
+  above a configured RPS. Batch jobs settle just under the limit Dropbox
+  or PostgREST enforces instead of bouncing off it. Throttles from
+  requests started before the last cut don't cut again, and an unlimited
+  bucket with no successes measured yet only pauses.
+
+`classify(exc)` says what a failure was: THROTTLE (429, or 503 when the
+server is shedding load), TRANSIENT (other 5xx, lost connections when the
+call is safe to repeat) or None (raise it). A throttle waits Retry-After,
+a transient error backs off exponentially with jitter, and after `retries`
+attempts, or a Retry-After above MAX_RETRY_AFTER, the last error is
+raised. `stats()` returns per-namespace counters: calls, throttles,
+retries, failures, wait_seconds and the current rate.
+"""
+import logging, os, random, threading, time
+from collections import Counter, deque
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+
+THROTTLE = "throttle"
+TRANSIENT = "transient"
+
+# Adaptive rate: cut to DECREASE x on a throttle, then grow by INCREASE of itself per second.
+DECREASE = 0.7
+INCREASE = float(os.getenv("RATE_LIMIT_INCREASE", "0.05"))
+MIN_RATE = 1.0
+# Seconds of recent successes used to measure the accepted rate.
+RATE_WINDOW = 2.0
+# Longer Retry-After values are not slept through; the call fails instead.
+MAX_RETRY_AFTER = float(os.getenv("RATE_LIMIT_MAX_RETRY_AFTER", "60"))
+
+T = TypeVar("T")
+Classify = Callable[[BaseException], Tuple[Optional[str], Optional[float]]]
+
+
+class TokenBucket:
+    """`rate` tokens per second up to `burst`; rate 0 means unlimited."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._at) * self.rate)
+        self._at = now
+
+    def reserve(self) -> float:
+        """Takes a token; returns how long to wait before spending it."""
+        with self._lock:
+            if self.rate <= 0:
+                return 0.0
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def set_rate(self, rate: float, burst: Optional[float] = None):
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.rate <= 0 < rate:
+                self._tokens = 0.0
+            self.rate = rate
+            if burst is not None:
+                self.burst = burst
+                self._tokens = min(self._tokens, burst)
+
+
+class Limiter:
+    """One namespace's bucket, concurrency cap, shared pause and counters."""
+
+    def __init__(self, name: str, rate: float = 0.0, burst: float = 0.0, concurrency: int = 0,
+                 retries: int = 5, base_delay: float = 0.2, max_delay: float = 10.0, adaptive: bool = True):
+        self.name = name
+        self.max_rate = rate
+        self.fixed_burst = burst or None
+        self.bucket = TokenBucket(rate, burst or max(rate / 10, 1.0))
+        self.concurrency = concurrency
+        self._slots = threading.BoundedSemaphore(concurrency) if concurrency > 0 else None
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.adaptive = adaptive
+        self.counters: Counter = Counter()
+        self._accepted: deque = deque(maxlen=4096)
+        self._paused_until = 0.0
+        self._cut_at = 0.0
+        self._lock = threading.Lock()
+
+    def _accepted_rate(self, now: float) -> float:
+        """Successes per second since the last pause ended (the rate the server was granting)."""
+        since = max(now - RATE_WINDOW, self._paused_until)
+        while self._accepted and self._accepted[0] < since:
+            self._accepted.popleft()
+        if not self._accepted:
+            return 0.0
+        return len(self._accepted) / max(now - self._accepted[0], 0.1)
+
+    def _wait(self) -> float:
+        t0 = time.monotonic()
+        pause = self._paused_until - t0
+        if pause > 0:
+            time.sleep(pause)
+        delay = self.bucket.reserve()
+        if delay > 0:
+            time.sleep(delay)
+        return time.monotonic() - t0
+
+    def _throttled(self, started: float, pause: float):
+        with self._lock:
+            now = time.monotonic()
+            self.counters["throttles"] += 1
+            cut = self.adaptive and started >= self._cut_at
+            if cut:
+                accepted = self._accepted_rate(now)
+                current = min(self.bucket.rate, accepted) if self.bucket.rate > 0 and accepted else (
+                    self.bucket.rate or accepted)
+                # unlimited and nothing measured yet: there is no rate to cut from, so
+                # only the pause applies until some successes show what the server grants
+                cut = current > 0
+                rate = max(MIN_RATE, current * DECREASE)
+            self._paused_until = max(self._paused_until, now + min(pause, MAX_RETRY_AFTER))
+            if not cut:
+                return
+            self.bucket.set_rate(rate, self.fixed_burst or max(rate / 10, 1.0))
+            self._cut_at = now
+        logging.warning("rate_limit: %s throttled; pausing %.1fs, rate now %.1f/s", self.name, pause, rate)
+
+    def _succeeded(self):
+        with self._lock:
+            self._accepted.append(time.monotonic())
+        rate = self.bucket.rate
+        if not self.adaptive or rate <= 0 or (self.max_rate and rate >= self.max_rate):
+            return
+        # `rate` successes a second, each adding INCREASE: INCREASE x rate per second
+        rate += INCREASE
+        if self.max_rate:
+            rate = min(rate, self.max_rate)
+        self.bucket.set_rate(rate, self.fixed_burst or max(rate / 10, 1.0))
+
+    def call(self, fn: Callable[[], T], classify: Classify, retries: Optional[int] = None) -> T:
+        attempts = retries or self.retries
+        delay = self.base_delay
+        for attempt in range(attempts):
+            waited = self._wait()
+            if self._slots is not None:
+                t0 = time.monotonic()
+                self._slots.acquire()
+                waited += time.monotonic() - t0
+            started = time.monotonic()
+            with self._lock:
+                self.counters["calls"] += 1
+                self.counters["wait_seconds"] += waited
+            try:
+                result = fn()
+            except Exception as e:
+                kind, retry_after = classify(e)
+                if kind is None:
+                    raise
+                pause = retry_after if retry_after is not None else random.uniform(delay / 2, delay)
+                delay = min(delay * 2, self.max_delay)
+                if kind == THROTTLE:
+                    self._throttled(started, pause)
+                if attempt == attempts - 1 or pause > MAX_RETRY_AFTER:
+                    with self._lock:
+                        self.counters["failures"] += 1
+                    raise
+                with self._lock:
+                    self.counters["retries"] += 1
+                if kind == TRANSIENT:
+                    with self._lock:
+                        self.counters["wait_seconds"] += pause
+                    time.sleep(pause)
+                # a throttle's pause is waited out in _wait, with everybody else
+                continue
+            finally:
+                if self._slots is not None:
+                    self._slots.release()
+            self._succeeded()
+            return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = {k: self.counters[k] for k in ("calls", "throttles", "retries", "failures")}
+            out["wait_seconds"] = round(self.counters["wait_seconds"], 3)
+        out["rate"] = round(self.bucket.rate, 2) or None
+        out["concurrency"] = self.concurrency or None
+        return out
+
+
+def _setting(namespace: str, name: str, default: str) -> str:
+    return os.getenv(f"RATE_LIMIT_{namespace.upper()}_{name}", default)
+
+
+def _from_env(namespace: str, retries: int, base_delay: float, max_delay: float) -> Limiter:
+    return Limiter(namespace,
+                   rate=float(_setting(namespace, "RPS", "0")),
+                   burst=float(_setting(namespace, "BURST", "0")),
+                   concurrency=int(_setting(namespace, "CONCURRENCY", "16")),
+                   retries=int(_setting(namespace, "RETRIES", str(retries))),
+                   base_delay=base_delay, max_delay=max_delay,
+                   adaptive=_setting(namespace, "ADAPTIVE", "1") == "1")
+
+
+_limiters: Dict[str, Limiter] = {}
+_limiters_lock = threading.Lock()
+# Defaults for namespaces without RATE_LIMIT_<NS>_* settings: attempts, first backoff, cap.
+DEFAULTS = {"dropbox": (6, 0.5, 8.0), "supabase": (3, 0.2, 2.0)}
+
+
+def limiter(namespace: str) -> Limiter:
+    lim = _limiters.get(namespace)
+    if lim is None:
+        with _limiters_lock:
+            lim = _limiters.get(namespace)
+            if lim is None:
+                lim = _limiters[namespace] = _from_env(namespace, *DEFAULTS.get(namespace, (5, 0.2, 10.0)))
+    return lim
+
+
+def configure(namespace: str, **kw) -> Limiter:
+    """Replaces a namespace's limiter (Limiter keyword arguments). Used by the local benchmarks."""
+    with _limiters_lock:
+        lim = _limiters[namespace] = Limiter(namespace, **kw)
+    return lim
+
+
+def call(namespace: str, fn: Callable[[], T], classify: Classify, retries: Optional[int] = None) -> T:
+    return limiter(namespace).call(fn, classify, retries)
+
+
+def stats() -> Dict[str, dict]:
+    return {name: lim.stats() for name, lim in sorted(_limiters.items())}
+
+
+def reset():
+    """Forgets every namespace's state and counters."""
+    with _limiters_lock:
+        _limiters.clear()
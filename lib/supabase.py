@@ -0,0 +1,233 @@
+# lib/supabase.py
+"""
+Shared Supabase/PostgREST access for every function.
+
+One keep-alive `httpx.Client` per worker (HTTP/2 when SUPABASE_HTTP2=1 and
+the `h2` package is installed) so calls stop paying DNS + TCP + TLS each
+time, one timeout for all of them, and retries with backoff on connection
+failures and 429/502/503/504 (honouring Retry-After), paced and counted by
+the "supabase" namespace of lib/rate_limit.py. Writes that aren't safe to
+repeat (plain inserts, RPCs not marked idempotent) are only retried when
+the request never reached the server or was refused with 429/503.
+
+Filters use PostgREST syntax: `{"id": "eq.5", "status": "in.(a,b)"}`;
+`columns` is a PostgREST projection (`"id,dropbox_path"`).
+"""
+import logging, os, threading
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+import httpx
+
+from lib import rate_limit
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "15"))
+POOL_MAXSIZE = int(os.getenv("SUPABASE_POOL_MAXSIZE", "16"))
+HTTP2 = os.getenv("SUPABASE_HTTP2", "0") == "1"
+# Attempts, backoff and pacing come from the rate_limit namespace (RATE_LIMIT_SUPABASE_*).
+RETRY_STATUSES = {429, 502, 503, 504}
+NAMESPACE = "supabase"
+# Stay below PostgREST's default max-rows (1000) so a page is never truncated.
+PAGE_SIZE = 1000
+
+Rows = Union[dict, List[dict]]
+
+_client: Optional[httpx.Client] = None
+_client_lock = threading.Lock()
+
+
+def configured() -> bool:
+    return bool(SUPABASE_URL and SUPABASE_KEY)
+
+
+def _new_client(transport: Optional[httpx.BaseTransport] = None) -> httpx.Client:
+    kw: Dict[str, Any] = dict(timeout=TIMEOUT, limits=httpx.Limits(max_connections=POOL_MAXSIZE,
+                                                                   max_keepalive_connections=POOL_MAXSIZE))
+    if transport is not None:
+        return httpx.Client(transport=transport, **kw)
+    if HTTP2:
+        try:
+            return httpx.Client(http2=True, **kw)
+        except ImportError:
+            logging.warning("SUPABASE_HTTP2=1 but the h2 package is missing; using HTTP/1.1")
+    return httpx.Client(**kw)
+
+
+def client() -> httpx.Client:
+    """Worker-wide keep-alive client for PostgREST."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _new_client()
+    return _client
+
+
+def reset_client(transport: Optional[httpx.BaseTransport] = None):
+    """
+    Closes the pooled client; the next call opens a new one (on `transport`
+    if given). Used on settings rotation and by the local benchmarks.
+    """
+    global _client
+    with _client_lock:
+        old, _client = _client, (_new_client(transport) if transport is not None else None)
+    if old is not None:
+        old.close()
+
+
+def headers(**extra) -> Dict[str, str]:
+    h = {"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"}
+    h.update(extra)
+    return h
+
+
+def request(method: str, path: str, *, params: Optional[dict] = None, json: Any = None,
+            prefer: Optional[str] = None, idempotent: Optional[bool] = None) -> httpx.Response:
+    """
+    Sends one PostgREST request (`path` is relative to /rest/v1/) and returns
+    the response after raise_for_status. `idempotent` defaults to true for
+    GET/HEAD/PATCH/DELETE.
+    """
+    if idempotent is None:
+        idempotent = method in ("GET", "HEAD", "PATCH", "DELETE")
+    hdrs = headers()
+    if json is not None:
+        hdrs["content-type"] = "application/json"
+    if prefer:
+        hdrs["prefer"] = prefer
+    url = f"{SUPABASE_URL}/rest/v1/{path}"
+
+    def send() -> httpx.Response:
+        r = client().request(method, url, params=params, json=json, headers=hdrs)
+        # 429/503 are refusals; 502/504 may hide an applied write
+        if r.status_code in RETRY_STATUSES and (idempotent or r.status_code in (429, 503)):
+            raise _Retryable(r)
+        r.raise_for_status()
+        return r
+
+    def classify(e: BaseException):
+        if isinstance(e, _Retryable):
+            kind = rate_limit.THROTTLE if e.response.status_code in (429, 503) else rate_limit.TRANSIENT
+            return kind, _retry_after(e.response)
+        if isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+            return rate_limit.TRANSIENT, None
+        # the request may have been applied; only repeat it if that's harmless
+        if isinstance(e, httpx.TransportError) and idempotent:
+            return rate_limit.TRANSIENT, None
+        return None, None
+
+    try:
+        return rate_limit.call(NAMESPACE, send, classify)
+    except _Retryable as e:
+        e.response.raise_for_status()
+        raise
+
+
+class _Retryable(Exception):
+    """A response worth another attempt; the last one is raised as HTTPStatusError."""
+
+    def __init__(self, response: httpx.Response):
+        super().__init__(response.status_code)
+        self.response = response
+
+
+def _retry_after(r: httpx.Response) -> Optional[float]:
+    try:
+        return float(r.headers.get("retry-after") or "")
+    except ValueError:
+        return None
+
+
+# ---------- typed helpers ----------
+def select(table: str, columns: str = "*", filters: Optional[Dict[str, str]] = None,
+           order: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+    params = dict(filters or {}, select=columns)
+    if order:
+        params["order"] = order
+    if limit is not None:
+        params["limit"] = str(limit)
+    return request("GET", table, params=params).json()
+
+
+def select_one(table: str, columns: str = "*", filters: Optional[Dict[str, str]] = None,
+               order: Optional[str] = None) -> Optional[dict]:
+    rows = select(table, columns, filters, order=order, limit=1)
+    return rows[0] if rows else None
+
+
+def insert(table: str, rows: Rows, returning: bool = False) -> Optional[List[dict]]:
+    """Inserts one row or a list of rows (one bulk request)."""
+    r = request("POST", table, json=rows, prefer="return=representation" if returning else "return=minimal")
+    return r.json() if returning else None
+
+
+def upsert(table: str, rows: Rows, on_conflict: Optional[str] = None, ignore_duplicates: bool = False,
+           returning: bool = False, idempotent: bool = True) -> Optional[List[dict]]:
+    """
+    Insert-or-merge on `on_conflict` (default: the primary key). With
+    `ignore_duplicates` existing rows are left alone, and `returning` gives
+    back only the rows actually inserted (`insert ... on conflict do
+    nothing returning`). A repeat of that returns nothing for rows the lost
+    first attempt inserted, so callers acting on the result pass
+    `idempotent=False`.
+    """
+    prefer = "resolution=ignore-duplicates" if ignore_duplicates else "resolution=merge-duplicates"
+    prefer += ",return=representation" if returning else ",return=minimal"
+    r = request("POST", table, params={"on_conflict": on_conflict} if on_conflict else None,
+                json=rows, prefer=prefer, idempotent=idempotent)
+    return r.json() if returning else None
+
+
+def update(table: str, filters: Dict[str, str], patch: dict, returning: bool = False) -> Optional[List[dict]]:
+    r = request("PATCH", table, params=filters, json=patch,
+                prefer="return=representation" if returning else "return=minimal")
+    return r.json() if returning else None
+
+
+def delete(table: str, filters: Dict[str, str], returning: Optional[str] = None) -> Optional[List[dict]]:
+    """Deletes matching rows; `returning` is a column list to get back."""
+    params = dict(filters)
+    if returning:
+        params["select"] = returning
+    r = request("DELETE", table, params=params, prefer="return=representation" if returning else "return=minimal")
+    return r.json() if returning else None
+
+
+def rpc(fn: str, args: dict, idempotent: bool = False):
+    """
+    Calls a Postgres function through `/rest/v1/rpc/<fn>` and returns its JSON result.
+    """
+    return request("POST", f"rpc/{fn}", json=args, idempotent=idempotent).json()
+
+
+def iter_rows(table: str, columns: str = "*", filters: Optional[Dict[str, str]] = None,
+              page_size: int = PAGE_SIZE, key: str = "id") -> Iterator[dict]:
+    """
+    Yields every row of `table` matching `filters`, one page at a time.
+
+    Pages are keyset-paginated on `key` (`key > last seen`, ascending), so only
+    one page is held in memory, PostgREST's max-rows cap can't truncate the
+    result, and rows updated out of the filter mid-scan don't shift later
+    pages the way `offset` does. `key` is added to `columns` if missing.
+    """
+    filters = dict(filters or {})
+    if key in filters:
+        raise ValueError(f"iter_rows keysets on '{key}'; filter on another column")
+    cols = [s.strip() for s in columns.split(",")]
+    if "*" not in cols and key not in cols:
+        columns = f"{columns},{key}"
+
+    last = None
+    while True:
+        params = dict(filters, select=columns, order=f"{key}.asc", limit=str(page_size))
+        if last is not None:
+            params[key] = f"gt.{last}"
+        page = request("GET", table, params=params).json()
+        # stop on an empty page rather than a short one: a server-side max-rows
+        # lower than page_size would otherwise end the scan early
+        if not page:
+            return
+        yield from page
+        last = page[-1][key]
@@ -0,0 +1,138 @@
+# lib/teamspace.py
+"""
+Copying files from the app-folder account into the Team Space app
+(functions/migrate_to_teamspace).
+
+Each file is moved server-side with a copy reference: `copy_reference/get`
+on the source account, `copy_reference/save` on the destination, so no
+bytes pass through the function. If the destination account refuses the
+reference (different app, missing permission) the file is streamed
+instead: the download response is read block by block straight into a
+concurrent upload session, so memory stays at a few chunks whatever the
+file size. A refusal is remembered for the rest of the run rather than
+paid per file.
+
+A destination path that already holds the same content (same Dropbox
+content hash) counts as done, so re-running over migrated rows is cheap.
+"""
+import contextlib, logging, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import dropbox
+from dropbox.exceptions import ApiError
+
+from lib.dropbox_client import DropboxClient
+
+# Files copied at once; Dropbox rate-limits per app, so a handful is plenty.
+WORKERS = int(os.getenv("TEAMSPACE_WORKERS", "8"))
+# Upload-session threads per streamed file (each holds up to two chunks).
+STREAM_WORKERS = int(os.getenv("TEAMSPACE_STREAM_WORKERS", "2"))
+
+
+class TeamDropboxClient(DropboxClient):
+    @classmethod
+    def from_env(cls):
+        key = os.getenv('TEAM_DROPBOX_APP_KEY')
+        sec = os.getenv('TEAM_DROPBOX_APP_SECRET')
+        ref = os.getenv('TEAM_DROPBOX_REFRESH_TOKEN')
+        if not (key and sec and ref):
+            raise RuntimeError('Missing TEAM_DROPBOX_* envs')
+        return cls.shared(key, sec, ref)
+
+
+def _save_conflict(err) -> bool:
+    return err.is_path() and err.get_path().is_conflict()
+
+
+def _reference_refused(err) -> bool:
+    # the reference is fine but this account can't use it
+    return err.is_invalid_copy_reference() or err.is_no_permission()
+
+
+class Migrator:
+    """Copies files between two accounts; `run()` fans rows out to a worker pool."""
+
+    def __init__(self, src: DropboxClient, dst: DropboxClient, workers: int = WORKERS):
+        self.src = src
+        self.dst = dst
+        self.workers = max(workers, 1)
+        self.use_references = True
+
+    def _pipe(self, path: str) -> dropbox.files.FileMetadata:
+        md, res = self.src.dbx.files_download(path)
+        with contextlib.closing(res):
+            # the pool already runs files in parallel; keep each file's share of chunks small
+            return self.dst.upload_stream(path, res.raw, md.size, workers=STREAM_WORKERS)
+
+    def _stream(self, path: str) -> Tuple[dropbox.files.FileMetadata, str]:
+        there = self.dst.get_file(path)
+        if there is not None and there.content_hash == self.src.get_file(path).content_hash:
+            return there, "exists"
+        return self._pipe(path), "streamed"
+
+    def copy(self, path: str) -> Tuple[dropbox.files.FileMetadata, str]:
+        """
+        Puts the source file at the same path in the destination account.
+        Returns (metadata, how) with `how` one of "reference", "streamed" or
+        "exists" (identical file already there).
+        """
+        if not self.use_references:
+            return self._stream(path)
+        ref, md = self.src.copy_reference(path)
+        try:
+            return self.dst.save_copy_reference(ref, path), "reference"
+        except ApiError as e:
+            if _reference_refused(e.error):
+                if self.use_references:
+                    logging.warning("teamspace: destination refused copy references (%s); streaming", e.error)
+                self.use_references = False
+                return self._stream(path)
+            if not _save_conflict(e.error):
+                raise
+        there = self.dst.get_file(path)
+        if there is not None and there.content_hash == getattr(md, "content_hash", None):
+            return there, "exists"
+        # a different file holds the name: stream in beside it (autorenamed)
+        return self._pipe(path), "streamed"
+
+    def run(self, rows: Iterable[dict], path_key: str = "dropbox_path",
+            on_result: Optional[Callable[[dict, object, Optional[str], Optional[str]], None]] = None) -> dict:
+        """
+        Copies every row's file with `workers` threads. Returns counts,
+        throughput and the per-row failures; one bad file doesn't stop the rest.
+        `on_result(row, metadata, how, error)` is called for each row as it
+        finishes (metadata/how are None on failure, error None on success).
+        """
+        stats: Dict[str, int] = {"reference": 0, "streamed": 0, "exists": 0}
+        moved_bytes = 0
+        errors: List[dict] = []
+        lock = threading.Lock()
+
+        def one(row: dict):
+            nonlocal moved_bytes
+            try:
+                md, how = self.copy(row[path_key])
+            except Exception as e:
+                logging.warning("teamspace: %s failed: %s", row[path_key], e)
+                err = str(e)[:300]
+                with lock:
+                    errors.append({"id": row.get("id"), "path": row[path_key], "error": err})
+                if on_result:
+                    on_result(row, None, None, err)
+                return
+            with lock:
+                stats[how] += 1
+                if how != "exists":
+                    moved_bytes += md.size
+            if on_result:
+                on_result(row, md, how, None)
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            list(pool.map(one, rows))
+        secs = max(time.perf_counter() - t0, 1e-9)
+        files = stats["reference"] + stats["streamed"]
+        return {"copied": files, "by_method": stats, "failed": len(errors), "errors": errors,
+                "bytes": moved_bytes, "seconds": round(secs, 3),
+                "files_per_s": round(files / secs, 2), "bytes_per_s": int(moved_bytes / secs)}
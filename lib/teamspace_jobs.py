@@ -0,0 +1,215 @@
+# lib/teamspace_jobs.py
+"""
+Checkpointed, shardable state for the Team Space migration
+(`teamspace_migration` / `teamspace_migration_shards`, migration V13).
+
+file_assets ids are cut into fixed ranges of SHARD_SIZE; `plan()` adds
+shards up to the current max id (idempotent, so any invocation may call it).
+`run()` then repeatedly leases an open shard through the
+`teamspace_claim_shard` RPC (`for update skip locked`), so parallel
+invocations never work the same ids, and for each shard:
+
+1. copies its new file_assets ids into `teamspace_migration` as pending
+   rows (`seeded_to` is the checkpoint);
+2. works due rows (pending, or failed with `next_attempt_at` passed) through
+   lib.teamspace.Migrator in batches, recording status, attempts, the
+   destination rev and the last error. Failures back off exponentially and
+   become `dead` after MAX_ATTEMPTS;
+3. closes the shard once nothing is left, or releases it with `not_before`
+   set to its next retry.
+
+The lease is renewed after every batch; an invocation that loses it (ran
+past LEASE_SECONDS without checking in) stops touching the shard.
+Don't change TEAMSPACE_SHARD_SIZE mid-migration: shard ids are derived
+from it.
+"""
+import logging, os, random, socket, threading, time, uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from lib import supabase
+from lib.teamspace import Migrator
+
+TABLE = "teamspace_migration"
+SHARDS = "teamspace_migration_shards"
+SHARD_SIZE = int(os.getenv("TEAMSPACE_SHARD_SIZE", "5000"))
+LEASE_SECONDS = int(os.getenv("TEAMSPACE_LEASE_SECONDS", "300"))
+MAX_ATTEMPTS = int(os.getenv("TEAMSPACE_MAX_ATTEMPTS", "6"))
+# Retry backoff: first delay and cap (seconds), with jitter.
+RETRY_DELAY = float(os.getenv("TEAMSPACE_RETRY_DELAY", "60"))
+RETRY_MAX_DELAY = float(os.getenv("TEAMSPACE_RETRY_MAX_DELAY", "3600"))
+# Rows copied per batch, per worker; a batch is also the lease check-in unit.
+BATCH_PER_WORKER = 4
+SEED_PAGE = 1000
+# Window the progress endpoint derives its rate (and ETA) from.
+RATE_WINDOW = 900
+
+
+def _iso(dt: datetime) -> str:
+    return dt.isoformat()
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(RETRY_DELAY * 2 ** max(attempts - 1, 0), RETRY_MAX_DELAY)
+    return delay * (0.5 + random.random() / 2)
+
+
+def new_owner() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+# ---------- shards ----------
+def plan() -> int:
+    """Adds shards covering file_assets up to its current max id; returns the shard count added."""
+    top = supabase.select_one("file_assets", "id", order="id.desc")
+    if not top:
+        return 0
+    last = supabase.select_one(SHARDS, "shard_id", order="shard_id.desc")
+    if last:
+        first = last["shard_id"] + 1
+    else:
+        first = (supabase.select_one("file_assets", "id", order="id.asc")["id"] - 1) // SHARD_SIZE
+    rows = [{"shard_id": k, "lo": k * SHARD_SIZE, "hi": (k + 1) * SHARD_SIZE, "seeded_to": k * SHARD_SIZE,
+             "status": "open"} for k in range(first, (top["id"] - 1) // SHARD_SIZE + 1)]
+    if rows:
+        # concurrent planners compute the same ids; whoever is second adds nothing
+        supabase.upsert(SHARDS, rows, ignore_duplicates=True)
+    return len(rows)
+
+
+def claim(owner: str) -> Optional[dict]:
+    rows = supabase.rpc("teamspace_claim_shard", {"p_owner": owner, "p_lease_seconds": LEASE_SECONDS})
+    return rows[0] if rows else None
+
+
+def _renew(shard: dict, owner: str, patch: Optional[dict] = None) -> bool:
+    patch = dict(patch or {}, lease_expires_at=_iso(_now() + timedelta(seconds=LEASE_SECONDS)),
+                 updated_at=_iso(_now()))
+    rows = supabase.update(SHARDS, {"shard_id": f"eq.{shard['shard_id']}", "lease_owner": f"eq.{owner}"},
+                           patch, returning=True)
+    return bool(rows)
+
+
+def _release(shard: dict, owner: str, patch: dict):
+    supabase.update(SHARDS, {"shard_id": f"eq.{shard['shard_id']}", "lease_owner": f"eq.{owner}"},
+                    dict(patch, lease_owner=None, lease_expires_at=None, updated_at=_iso(_now())))
+
+
+# ---------- one shard ----------
+def _seed(shard: dict, owner: str, max_id: int) -> bool:
+    """Copies the shard's not-yet-tracked file_assets into the state table; False if the lease was lost."""
+    cursor, hi = shard["seeded_to"], shard["hi"]
+    while cursor < min(hi, max_id):
+        page = supabase.select("file_assets", "id,dropbox_path", {"and": f"(id.gt.{cursor},id.lte.{hi})"},
+                               order="id.asc", limit=SEED_PAGE)
+        if page:
+            now = _iso(_now())
+            supabase.upsert(TABLE, [{"asset_id": r["id"], "shard_id": shard["shard_id"],
+                                     "dropbox_path": r.get("dropbox_path"),
+                                     "status": "pending" if r.get("dropbox_path") else "skipped",
+                                     "attempts": 0, "next_attempt_at": now, "updated_at": now} for r in page],
+                            ignore_duplicates=True)
+        # a short page means everything up to max_id is in
+        cursor = page[-1]["id"] if len(page) == SEED_PAGE else min(hi, max_id)
+        if not _renew(shard, owner, {"seeded_to": cursor}):
+            return False
+        shard["seeded_to"] = cursor
+    return True
+
+
+def _due(shard: dict, limit: int) -> List[dict]:
+    return supabase.select(TABLE, "*", {"shard_id": f"eq.{shard['shard_id']}", "status": "in.(pending,failed)",
+                                        "next_attempt_at": f"lte.{_iso(_now())}"},
+                           order="asset_id.asc", limit=limit)
+
+
+def _work_batch(migrator: Migrator, rows: List[dict]) -> dict:
+    results = []
+    lock = threading.Lock()
+
+    def record(row, md, how, error):
+        now = _now()
+        out = dict(row, updated_at=_iso(now))
+        if error is None:
+            out.update(status="done", method=how, dest_rev=getattr(md, "rev", None),
+                       bytes=getattr(md, "size", None), last_error=None)
+        else:
+            attempts = row["attempts"] + 1
+            out.update(attempts=attempts, last_error=error,
+                       status="dead" if attempts >= MAX_ATTEMPTS else "failed",
+                       next_attempt_at=_iso(now + timedelta(seconds=_backoff(attempts))))
+        with lock:
+            results.append(out)
+
+    report = migrator.run(rows, on_result=record)
+    if results:
+        supabase.upsert(TABLE, results)
+    return report
+
+
+def _finish(shard: dict, owner: str, max_id: int):
+    """Closes the shard if nothing is left to do, else releases it until its next retry."""
+    left = supabase.select_one(TABLE, "next_attempt_at", {"shard_id": f"eq.{shard['shard_id']}",
+                                                          "status": "in.(pending,failed)"},
+                               order="next_attempt_at.asc")
+    if left:
+        _release(shard, owner, {"not_before": left["next_attempt_at"]})
+    elif shard["hi"] <= max_id:
+        _release(shard, owner, {"status": "done", "not_before": None})
+    else:
+        # the newest shard: ids above max_id may still be added, so look again later
+        _release(shard, owner, {"not_before": _iso(_now() + timedelta(seconds=LEASE_SECONDS))})
+
+
+def work_shard(shard: dict, owner: str, migrator: Migrator, deadline: float, totals: dict):
+    max_id = (supabase.select_one("file_assets", "id", order="id.desc") or {"id": 0})["id"]
+    if not _seed(shard, owner, max_id):
+        logging.warning("teamspace: lost lease on shard %s while seeding", shard["shard_id"])
+        return
+    batch = migrator.workers * BATCH_PER_WORKER
+    while time.monotonic() < deadline:
+        rows = _due(shard, batch)
+        if not rows:
+            break
+        report = _work_batch(migrator, rows)
+        for k in ("copied", "failed", "bytes"):
+            totals[k] += report[k]
+        totals["exists"] += report["by_method"]["exists"]
+        if not _renew(shard, owner):
+            logging.warning("teamspace: lost lease on shard %s", shard["shard_id"])
+            return
+    _finish(shard, owner, max_id)
+
+
+# ---------- entry points ----------
+def run(migrator: Migrator, budget_seconds: float, owner: Optional[str] = None) -> dict:
+    """Works shards until none are claimable or the time budget is spent."""
+    owner = owner or new_owner()
+    deadline = time.monotonic() + budget_seconds
+    t0 = time.perf_counter()
+    totals = {"copied": 0, "exists": 0, "failed": 0, "bytes": 0, "shards": 0}
+    plan()
+    while time.monotonic() < deadline:
+        shard = claim(owner)
+        if shard is None:
+            break
+        totals["shards"] += 1
+        work_shard(shard, owner, migrator, deadline, totals)
+    secs = max(time.perf_counter() - t0, 1e-9)
+    return dict(totals, owner=owner, seconds=round(secs, 3), files_per_s=round(totals["copied"] / secs, 2),
+                bytes_per_s=int(totals["bytes"] / secs))
+
+
+def progress() -> dict:
+    """Status counts, throughput over the last RATE_WINDOW seconds and an ETA."""
+    p = supabase.rpc("teamspace_migration_progress", {"p_window_seconds": RATE_WINDOW}, idempotent=True)
+    rate = p["done_recent"] / RATE_WINDOW
+    remaining = max(p["assets"] - p["done"] - p["dead"] - p["skipped"], 0)
+    p.update(remaining=remaining, files_per_s=round(rate, 3),
+             eta_seconds=int(remaining / rate) if rate else None,
+             percent=round(100.0 * (p["assets"] - remaining) / p["assets"], 2) if p["assets"] else 100.0)
+    return p
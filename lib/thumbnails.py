@@ -0,0 +1,306 @@
+# lib/thumbnails.py
+"""
+Thumbnails for the portal's photo grids (functions/thumbnail).
+
+`thumbnails(client, paths, size, fmt, if_none_match)` returns one Thumb, or
+a Dropbox error string, per path. Cheapest source first:
+
+1. a disk cache of the derived bytes (THUMBNAIL_CACHE_DIR), LRU-evicted past
+   THUMBNAIL_CACHE_MAX_MB. Entries are per path+size+format and carry the
+   file revision, so a new revision replaces the old bytes. A revision is
+   trusted for REV_TTL seconds after Dropbox last confirmed it;
+2. `files_get_metadata` (no bytes) to re-confirm an older entry's revision,
+   or the revision behind a browser's If-None-Match;
+3. `files_get_thumbnail_batch` for the rest. Fetches from concurrent
+   requests in this worker are coalesced for up to BATCH_WINDOW_MS, so a
+   grid's dozens of <img> requests become a few 25-entry calls.
+
+ETags are derived from path, size, format and revision; a Thumb whose ETag
+matched If-None-Match has no data and the endpoint answers 304.
+
+Worker processes on one host may share the cache directory: writes are
+atomic renames and each process enforces the size bound over what it has
+seen, so the directory can briefly run over it.
+"""
+import hashlib, logging, os, tempfile, threading, time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from lib.dropbox_client import THUMBNAIL_BATCH_SIZE
+
+CACHE_DIR = os.getenv("THUMBNAIL_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "altus_thumbnails")
+CACHE_MAX_BYTES = int(float(os.getenv("THUMBNAIL_CACHE_MAX_MB", "512")) * 1024 * 1024)
+REV_TTL = float(os.getenv("THUMBNAIL_REV_TTL", "600"))
+BATCH_WINDOW = float(os.getenv("THUMBNAIL_BATCH_WINDOW_MS", "15")) / 1000
+# Concurrent Dropbox calls (thumbnail batches, metadata checks) per request.
+WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "4"))
+
+SIZES = ("w32h32", "w64h64", "w128h128", "w256h256", "w480h320", "w640h480", "w960h640",
+         "w1024h768", "w2048h1536")
+FORMATS = {"jpeg": "image/jpeg", "png": "image/png"}
+DEFAULT_SIZE = "w256h256"
+DEFAULT_FORMAT = "jpeg"
+
+
+class Thumb(NamedTuple):
+    etag: str
+    content_type: str
+    data: Optional[bytes]  # None when the caller's If-None-Match matched
+
+
+def _variant(path: str, size: str, fmt: str) -> str:
+    return hashlib.sha256(f"{path.strip().lower()}|{size}|{fmt}".encode()).hexdigest()[:32]
+
+
+def _etag(variant: str, rev: str) -> str:
+    return f'"{variant[:16]}-{rev}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+
+class DiskCache:
+    """Size-bounded LRU of thumbnail bytes on local disk, one `<variant>.<rev>` file per entry."""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root, self.max_bytes = root, max_bytes
+        # variant -> [rev, size, confirmed_at], least recently used first
+        self._index: "OrderedDict[str, list]" = OrderedDict()
+        self._bytes = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _path(self, variant: str, rev: str) -> str:
+        return os.path.join(self.root, f"{variant}.{rev}")
+
+    def _unlink(self, variant: str, rev: str):
+        try:
+            os.remove(self._path(variant, rev))
+        except FileNotFoundError:
+            pass
+
+    def _load(self):
+        # picks up what earlier processes left, oldest use first; revisions unconfirmed
+        os.makedirs(self.root, exist_ok=True)
+        found = []
+        for name in os.listdir(self.root):
+            variant, _, rev = name.partition(".")
+            if not rev or name.endswith(".tmp"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.root, name))
+            except FileNotFoundError:
+                continue
+            found.append((st.st_mtime, variant, rev, st.st_size))
+        for _, variant, rev, size in sorted(found):
+            old = self._index.pop(variant, None)
+            if old:
+                self._bytes -= old[1]
+                self._unlink(variant, old[0])
+            self._index[variant] = [rev, size, 0.0]
+            self._bytes += size
+        self._loaded = True
+        self._evict()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._index:
+            variant, (rev, size, _) = self._index.popitem(last=False)
+            self._bytes -= size
+            self._unlink(variant, rev)
+
+    def lookup(self, variant: str) -> Optional[Tuple[str, float]]:
+        """(rev, confirmed_at) of the cached entry, if any."""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            e = self._index.get(variant)
+            return (e[0], e[2]) if e else None
+
+    def read(self, variant: str, rev: str) -> Optional[bytes]:
+        path = self._path(variant, rev)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            # evicted by another process sharing the directory
+            with self._lock:
+                e = self._index.get(variant)
+                if e and e[0] == rev:
+                    del self._index[variant]
+                    self._bytes -= e[1]
+            return None
+        with self._lock:
+            if variant in self._index:
+                self._index.move_to_end(variant)
+        try:
+            os.utime(path)  # recency survives a restart
+        except OSError:
+            pass
+        return data
+
+    def confirm(self, variant: str, rev: str):
+        with self._lock:
+            e = self._index.get(variant)
+            if e and e[0] == rev:
+                e[2] = time.time()
+
+    def put(self, variant: str, rev: str, data: bytes):
+        with self._lock:
+            if not self._loaded:
+                self._load()
+        tmp = os.path.join(self.root, f"{variant}.{rev}.{os.getpid()}-{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._path(variant, rev))
+        with self._lock:
+            old = self._index.pop(variant, None)
+            if old:
+                self._bytes -= old[1]
+                if old[0] != rev:
+                    self._unlink(variant, old[0])
+            self._index[variant] = [rev, len(data), time.time()]
+            self._bytes += len(data)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            for variant, (rev, _, _) in self._index.items():
+                self._unlink(variant, rev)
+            self._index.clear()
+            self._bytes = 0
+
+
+class _Batcher:
+    """
+    Coalesces thumbnail fetches from concurrent requests: the first caller
+    waits BATCH_WINDOW for company, then fetches everything queued in
+    THUMBNAIL_BATCH_SIZE chunks on up to WORKERS threads.
+    """
+
+    def __init__(self):
+        self._queue: List[tuple] = []
+        self._leading = False
+        self._lock = threading.Lock()
+
+    def fetch(self, client, entries: List[Tuple[str, str, str]]) -> list:
+        futures = [Future() for _ in entries]
+        with self._lock:
+            self._queue.extend((client, e, f) for e, f in zip(entries, futures))
+            lead, self._leading = not self._leading, True
+        if lead:
+            if BATCH_WINDOW:
+                time.sleep(BATCH_WINDOW)
+            with self._lock:
+                queue, self._queue = self._queue, []
+                self._leading = False
+            self._run(queue)
+        return [f.result() for f in futures]
+
+    @staticmethod
+    def _run(queue: list):
+        chunks = []
+        for client in dict.fromkeys(c for c, _, _ in queue):
+            items = [(e, f) for c, e, f in queue if c is client]
+            chunks += [(client, items[i:i + THUMBNAIL_BATCH_SIZE])
+                       for i in range(0, len(items), THUMBNAIL_BATCH_SIZE)]
+
+        def one(chunk):
+            client, items = chunk
+            try:
+                results = client.get_thumbnails([e for e, _ in items])
+            except Exception as e:
+                logging.warning("files_get_thumbnail_batch failed: %s", e)
+                results = [str(e)] * len(items)
+            for (_, f), r in zip(items, results):
+                f.set_result(r)
+
+        if len(chunks) == 1:
+            one(chunks[0])
+        else:
+            with ThreadPoolExecutor(max_workers=min(WORKERS, len(chunks))) as pool:
+                list(pool.map(one, chunks))
+
+
+cache = DiskCache(CACHE_DIR, CACHE_MAX_BYTES)
+_batcher = _Batcher()
+
+
+def _revs(client, paths: List[str]) -> List[Optional[str]]:
+    """Current revision per path; None where Dropbox couldn't say (the fetch reports why)."""
+    def rev(path):
+        try:
+            md = client.get_file(path)
+        except Exception:
+            return None
+        return md.rev if md is not None else None
+    if len(paths) == 1:
+        return [rev(paths[0])]
+    with ThreadPoolExecutor(max_workers=min(WORKERS, len(paths))) as pool:
+        return list(pool.map(rev, paths))
+
+
+def thumbnails(client, paths: List[str], size: str = DEFAULT_SIZE, fmt: str = DEFAULT_FORMAT,
+               if_none_match: Optional[Sequence[Optional[str]]] = None) -> List[Union[Thumb, str]]:
+    """One Thumb per path, or the Dropbox error as a string."""
+    ctype = FORMATS[fmt]
+    inm = list(if_none_match or [None] * len(paths))
+    variants = [_variant(p, size, fmt) for p in paths]
+    out: List[Union[Thumb, str, None]] = [None] * len(paths)
+    now = time.time()
+
+    revalidate, fetch = [], []
+    for i, v in enumerate(variants):
+        hit = cache.lookup(v)
+        if hit and now - hit[1] < REV_TTL:
+            tag = _etag(v, hit[0])
+            if etag_matches(inm[i], tag):
+                out[i] = Thumb(tag, ctype, None)
+                continue
+            data = cache.read(v, hit[0])
+            if data is not None:
+                out[i] = Thumb(tag, ctype, data)
+            else:
+                fetch.append(i)
+        elif hit or inm[i]:
+            revalidate.append(i)
+        else:
+            fetch.append(i)
+
+    if revalidate:
+        for i, rev in zip(revalidate, _revs(client, [paths[i] for i in revalidate])):
+            v = variants[i]
+            if rev is None:
+                fetch.append(i)
+                continue
+            tag = _etag(v, rev)
+            hit = cache.lookup(v)
+            cached = hit is not None and hit[0] == rev
+            if cached:
+                cache.confirm(v, rev)
+            if etag_matches(inm[i], tag):
+                out[i] = Thumb(tag, ctype, None)
+                continue
+            data = cache.read(v, rev) if cached else None
+            if data is not None:
+                out[i] = Thumb(tag, ctype, data)
+            else:
+                fetch.append(i)
+
+    if fetch:
+        for i, r in zip(fetch, _batcher.fetch(client, [(paths[i], size, fmt) for i in fetch])):
+            if isinstance(r, str):
+                out[i] = r
+                continue
+            md, data = r
+            try:
+                cache.put(variants[i], md.rev, data)
+            except OSError:
+                logging.exception("thumbnail cache write failed under %s", cache.root)
+            tag = _etag(variants[i], md.rev)
+            out[i] = Thumb(tag, ctype, None if etag_matches(inm[i], tag) else data)
+    return out
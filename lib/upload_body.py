@@ -0,0 +1,137 @@
+# lib/upload_body.py
+"""
+Upload bodies for the file endpoints.
+
+Besides the legacy JSON body with `file_base64`, uploads may be sent as
+`application/octet-stream` (routing metadata in `X-Upload-*` headers or the
+query string) or as `multipart/form-data` (metadata as form fields, the file
+as the part that has a filename). Either way the bytes are copied slice by
+slice from the request buffer into a spooled temp file — in memory up to
+UPLOAD_SPOOL_MAX_BYTES, on disk beyond — and given its Dropbox content hash
+on the way through. No base64 text or parsed JSON is built. The request
+buffer itself (`req.get_body()`) stays alive while the handler runs, so a
+file under UPLOAD_SPOOL_MAX_BYTES is held twice, and a larger one once in
+memory plus its spool file.
+
+Header names map to fields by dropping the prefix: `X-Upload-Entity-Type`
+-> `entity_type`, `X-Upload-Original-Filename` -> `original_filename`,
+`X-Upload-Meta` -> `meta` (a JSON object).
+"""
+import io, json, os, re, tempfile
+from typing import Dict, Optional
+
+import azure.functions as func
+
+from lib.content_hash import ContentHasher
+
+SPOOL_MAX_BYTES = int(os.getenv("UPLOAD_SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))
+COPY_CHUNK = 1024 * 1024
+HEADER_PREFIX = "x-upload-"
+
+_boundary_rx = re.compile(r'boundary="?([^";]+)"?', re.I)
+_disp_rx = re.compile(r'(\w+)="([^"]*)"')
+
+
+class UploadBody:
+    """
+    A received file: `file` (positioned at 0 once complete), `size`, running
+    Dropbox `content_hash`, the multipart `filename` if any, and the routing
+    `fields`.
+    """
+
+    def __init__(self, file=None):
+        self.file = file if file is not None else tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        self.size = 0
+        self.content_hash = ContentHasher()
+        self.filename: Optional[str] = None
+        self.fields: Dict[str, str] = {}
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "UploadBody":
+        # BytesIO shares the decoded buffer until written to, so no extra copy
+        up = cls(io.BytesIO(data))
+        up.size = len(data)
+        up.content_hash.update(data)
+        return up
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.content_hash.update(chunk)
+        self.size += len(chunk)
+
+    def copy_from(self, buf: memoryview):
+        for i in range(0, len(buf), COPY_CHUNK):
+            self.write(buf[i:i + COPY_CHUNK])
+        self.file.seek(0)
+
+    @property
+    def meta(self) -> dict:
+        raw = self.fields.get("meta")
+        if not raw:
+            return {}
+        meta = json.loads(raw)
+        if not isinstance(meta, dict):
+            raise ValueError("'meta' must be a JSON object")
+        return meta
+
+    def close(self):
+        self.file.close()
+
+
+def is_binary_upload(req: func.HttpRequest) -> bool:
+    ctype = (req.headers.get("content-type") or "").lower()
+    return ctype.startswith("application/octet-stream") or ctype.startswith("multipart/form-data")
+
+
+def read_upload(req: func.HttpRequest) -> UploadBody:
+    """
+    Spools a raw or multipart request body. Raises ValueError on a malformed body.
+    """
+    raw = req.get_body() or b""
+    ctype = req.headers.get("content-type") or ""
+    up = UploadBody()
+    up.fields.update({k: v for k, v in req.params.items()})
+    for k, v in req.headers.items():
+        if k.lower().startswith(HEADER_PREFIX):
+            up.fields[k.lower()[len(HEADER_PREFIX):].replace("-", "_")] = v
+
+    if ctype.lower().startswith("multipart/form-data"):
+        m = _boundary_rx.search(ctype)
+        if not m:
+            raise ValueError("multipart body without boundary")
+        _read_multipart(raw, m.group(1).encode(), up)
+    else:
+        up.copy_from(memoryview(raw))
+    return up
+
+
+def _read_multipart(raw: bytes, boundary: bytes, up: UploadBody):
+    delim = b"--" + boundary
+    view = memoryview(raw)
+    pos = raw.find(delim)
+    if pos < 0:
+        raise ValueError("multipart boundary not found")
+    got_file = False
+    while True:
+        pos += len(delim)
+        if raw[pos:pos + 2] == b"--":
+            break
+        head_end = raw.find(b"\r\n\r\n", pos)
+        if head_end < 0:
+            raise ValueError("truncated multipart headers")
+        headers = raw[pos:head_end].decode("utf-8", "replace")
+        start = head_end + 4
+        nxt = raw.find(b"\r\n" + delim, start)
+        if nxt < 0:
+            raise ValueError("unterminated multipart part")
+        disp = next((l for l in headers.split("\r\n") if l.lower().startswith("content-disposition")), "")
+        params = dict(_disp_rx.findall(disp))
+        if "filename" in params and not got_file:
+            up.filename = params["filename"] or None
+            up.copy_from(view[start:nxt])
+            got_file = True
+        elif "name" in params:
+            up.fields[params["name"]] = raw[start:nxt].decode("utf-8")
+        pos = nxt + 2
+    if not got_file:
+        raise ValueError("multipart body has no file part")
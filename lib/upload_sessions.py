@@ -0,0 +1,133 @@
+# lib/upload_sessions.py
+"""
+Server-side state for resumable uploads (functions/upload_session).
+
+One record per Dropbox upload session: destination, declared size, the
+content-hash digest of every 4 MB block received so far, the committed
+offset (end of the unbroken run of blocks from 0) and an expiry that every
+append pushes forward. Blocks are keyed by index, so a retried, duplicated
+or re-ordered chunk only adds what is missing and the content hash can be
+assembled at finish without the bytes ever being in one place.
+
+`SupabaseSessionStore` keeps records in `upload_sessions` and merges block
+digests through the `upload_session_ack` RPC, so appends landing on
+different workers at once can't drop each other's blocks.
+`MemorySessionStore` is the in-process stand-in used when Supabase isn't
+configured (local runs, benchmarks).
+"""
+import os, threading, time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from lib import supabase
+from lib.content_hash import BLOCK_SIZE
+
+# Dropbox drops upload sessions after 7 days; keep ours well inside that.
+SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))
+TABLE = "upload_sessions"
+
+
+def block_count(size: int) -> int:
+    return max((size + BLOCK_SIZE - 1) // BLOCK_SIZE, 1)
+
+
+def committed_offset(blocks: Dict[str, str], size: int) -> int:
+    n = 0
+    while str(n) in blocks:
+        n += 1
+    return min(n * BLOCK_SIZE, size)
+
+
+def missing_offsets(rec: dict, limit: int = 100) -> List[int]:
+    blocks = rec["block_hashes"]
+    out = []
+    for i in range(block_count(rec["size"])):
+        if str(i) not in blocks:
+            out.append(i * BLOCK_SIZE)
+            if len(out) == limit:
+                break
+    return out
+
+
+def _expiry(now: Optional[float] = None) -> str:
+    t = datetime.fromtimestamp(now if now is not None else time.time(), timezone.utc)
+    return (t + timedelta(seconds=SESSION_TTL)).isoformat()
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class MemorySessionStore:
+    def __init__(self):
+        self._rows: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def create(self, session_id: str, dest_path: str, size: int) -> dict:
+        self.purge()
+        rec = {"session_id": session_id, "dest_path": dest_path, "size": size, "block_hashes": {},
+               "committed_offset": 0, "result": None, "expires_at": _expiry()}
+        with self._lock:
+            self._rows[session_id] = rec
+            return dict(rec)
+
+    def get(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            rec = self._rows.get(session_id)
+            if rec is None or rec["expires_at"] <= _now_iso():
+                return None
+            return dict(rec, block_hashes=dict(rec["block_hashes"]))
+
+    def ack(self, session_id: str, digests: Dict[str, str]) -> Optional[dict]:
+        with self._lock:
+            rec = self._rows.get(session_id)
+            if rec is None:
+                return None
+            rec["block_hashes"].update(digests)
+            rec["committed_offset"] = committed_offset(rec["block_hashes"], rec["size"])
+            rec["expires_at"] = _expiry()
+            return dict(rec, block_hashes=dict(rec["block_hashes"]))
+
+    def finish(self, session_id: str, result: dict):
+        with self._lock:
+            if session_id in self._rows:
+                self._rows[session_id]["result"] = result
+
+    def purge(self) -> int:
+        now = _now_iso()
+        with self._lock:
+            dead = [k for k, r in self._rows.items() if r["expires_at"] <= now]
+            for k in dead:
+                del self._rows[k]
+        return len(dead)
+
+
+class SupabaseSessionStore:
+    def create(self, session_id: str, dest_path: str, size: int) -> dict:
+        row = {"session_id": session_id, "dest_path": dest_path, "size": size, "expires_at": _expiry()}
+        return supabase.insert(TABLE, row, returning=True)[0]
+
+    def get(self, session_id: str) -> Optional[dict]:
+        return supabase.select_one(TABLE, "*", {"session_id": f"eq.{session_id}", "expires_at": f"gt.{_now_iso()}"})
+
+    def ack(self, session_id: str, digests: Dict[str, str]) -> Optional[dict]:
+        # merging digests is idempotent, so the RPC may be retried
+        return supabase.rpc("upload_session_ack",
+                            {"p_session_id": session_id, "p_hashes": digests, "p_ttl_seconds": SESSION_TTL},
+                            idempotent=True)
+
+    def finish(self, session_id: str, result: dict):
+        supabase.update(TABLE, {"session_id": f"eq.{session_id}"}, {"result": result})
+
+    def purge(self) -> int:
+        return len(supabase.delete(TABLE, {"expires_at": f"lte.{_now_iso()}"}, returning="session_id"))
+
+
+_memory = MemorySessionStore()
+
+
+def session_store():
+    """Supabase-backed store when configured, else the worker-local stand-in."""
+    if supabase.configured():
+        return SupabaseSessionStore()
+    return _memory
@@ -1,6 +1,7 @@
 import os, json, time
 import azure.functions as func
 import httpx
+from lib import supabase
 
 def _mask(s: str):
     if not s:
@@ -36,24 +37,21 @@ def _check_dropbox():
         return {"ok": False, "error": str(e)}
 
 def _check_supabase():
-    url = os.getenv("SUPABASE_URL"); key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-    if not (url and key):
+    if not supabase.configured():
         return {"ok": False, "stage": "env", "error": "Missing SUPABASE_* envs"}
-    headers = {"apikey": key, "Authorization": f"Bearer {key}"}
     try:
         # ping health via simple GET on file_assets (exists in our schema)
-        with httpx.Client(timeout=15) as c:
-            r = c.get(f"{url}/rest/v1/file_assets", headers=headers, params={"select":"id","limit":"1"})
-            if r.status_code == 200:
-                return {"ok": True, "table":"file_assets", "row_example": r.json()[0] if r.json() else None}
-            return {"ok": False, "status": r.status_code, "body": r.text[:300]}
+        rows = supabase.select("file_assets", "id", limit=1)
+        return {"ok": True, "table": "file_assets", "row_example": rows[0] if rows else None}
+    except httpx.HTTPStatusError as e:
+        return {"ok": False, "status": e.response.status_code, "body": e.response.text[:300]}
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
     present, masked = _env_check()
     dropbox = _check_dropbox()
-    supabase = _check_supabase()
+    supabase_check = _check_supabase()
 
     # compute overall
     greens = []
@@ -68,7 +66,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     else:
         reds.append("Dropbox check failed")
 
-    if supabase.get("ok"):
+    if supabase_check.get("ok"):
         greens.append("Supabase REST OK (file_assets reachable)")
     else:
         reds.append("Supabase check failed")
@@ -79,7 +77,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             "env_present": present,
             "env_masked_preview": masked,
             "dropbox": dropbox,
-            "supabase": supabase
+            "supabase": supabase_check
         },
         "summary": {"greens": greens, "reds": reds},
         "timestamp": int(time.time())